@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+# times the exporters' record rendering against the per record str.format it replaced
+#
+#     python benchmarks/render.py [records]
+
+import sys
+import time
+from libipam.export_bind import export_bind
+from libipam.export_nsd import export_nsd
+from libipam.export_unbound import export_unbound
+from libipam.utils import merge_dicts
+
+class _db:
+    # only what the old _rr_print used
+    def _splitfqdn(self, fqdn):
+        sp = fqdn.split('.')
+        return(sp[0],".".join(sp[1:]))
+
+def old_bind(db, fmt, kwargs):
+    # export_bind._rr_print before the templates were compiled
+    rr_type = kwargs['rr_type']
+    kwargs = merge_dicts(kwargs, kwargs['options'])
+    if kwargs.get('ttl') == None:
+        kwargs['ttl'] = ""
+    (name, domain) = db._splitfqdn(kwargs['fqdn'])
+    kwargs['name'] = name
+    kwargs['domain'] = domain
+    if name == "@":
+        kwargs['fqdn'] = name
+    return(fmt.get(rr_type, fmt['XX']).format(**kwargs))
+
+def old_fqdn(db, fmt, kwargs):
+    # export_nsd and export_unbound._rr_print before the templates were compiled
+    rr_type = kwargs['rr_type']
+    kwargs = merge_dicts(kwargs, kwargs['options'])
+    if kwargs.get('ttl') == None:
+        kwargs['ttl'] = ""
+    (name, domain) = db._splitfqdn(kwargs['fqdn'])
+    if name == "@":
+        kwargs['fqdn'] = domain+"."
+    else:
+        kwargs['fqdn'] = kwargs['fqdn']+"."
+    return(fmt.get(rr_type, fmt['XX']).format(**kwargs))
+
+def records(count):
+    # the mix of a typical forward zone, rows like zone_export yields them
+    ret = []
+    for i in range(count):
+        n = i % 10
+        fqdn = "host{}.example.com".format(i)
+        if n < 6:
+            r = { 'rr_type': "A", 'value': "10.{}.{}.{}".format(i >> 16 & 255, i >> 8 & 255, i & 255), 'options': {} }
+        elif n < 8:
+            r = { 'rr_type': "CNAME", 'value': "host{}.example.com".format(i-1), 'options': { 'ttl': 300 } }
+        elif n < 9:
+            r = { 'rr_type': "MX", 'value': "mail.example.com", 'options': { 'priority': 10 } }
+        else:
+            r = { 'rr_type': "TXT", 'value': "v=spf1 -all", 'options': {} }
+        r['id'] = i
+        r['fqdn'] = fqdn
+        ret.append(r)
+    return(ret)
+
+def timed(func, count, repeat=3):
+    # the old _rr_print changed the rows it was given, every run gets rows of its own
+    best = None
+    for i in range(repeat):
+        recs = records(count)
+        start = time.perf_counter()
+        for r in recs:
+            func(r)
+        t = time.perf_counter() - start
+        best = t if best == None or t < best else best
+    return(best)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    db = _db()
+    print("{} records, best of 3".format(count))
+    for (exporter, old) in [(export_bind, old_bind), (export_nsd, old_fqdn), (export_unbound, old_fqdn)]:
+        e = exporter(db)
+        # the old code and the new must agree before the times mean anything
+        for (a, b) in zip(records(1000), records(1000)):
+            if e._rr_print(a) != old(db, exporter.RR_FMT, b):
+                raise Exception("{} output differs for {}".format(exporter.__name__, a))
+        before = timed(lambda r: old(db, exporter.RR_FMT, r), count)
+        after = timed(e._rr_print, count)
+        print("{:<15} str.format {:6.2f}s  compiled {:6.2f}s  {:5.2f}x".format(exporter.__name__, before, after, before/after))
+
+if __name__ == "__main__":
+    main()
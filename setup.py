@@ -13,6 +13,9 @@ setup( name="libipam",
     install_requires = [
         "requests"
     ],
+    extras_require = {
+        "async": [ "aiohttp" ]
+    },
     classifiers=[
         "Environment :: Console",
         "License :: OSI Approved :: BSD License",
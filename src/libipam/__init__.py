@@ -28,11 +28,24 @@
 #     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 #     SUCH DAMAGE.
 
+import os
+import json
+import time
+import contextlib
+import threading
+import concurrent.futures
 from libipam.db_sqlite3 import db_sqlite3
 from libipam.db_http import db_http
+from libipam.db_memory import db_memory
+from libipam.db_snapshot import db_snapshot, compile_snapshot
 from libipam.export_bind import export_bind
 from libipam.export_nsd import export_nsd
 from libipam.export_unbound import export_unbound
+from libipam.export_delta import export_delta
+from libipam.import_zone import import_zone
+from libipam.prefix_trie import prefix_trie
+from libipam.cache import result_cache
+from libipam.utils import *
 
 class ipam:
     RR_OPTS = { 
@@ -61,39 +74,186 @@ class ipam:
 
     def __init__(self, *args, **kwargs):
         self.edriver = None
+        self.index = None
+        self.index_version = None
+        self.index_seq = None
         dbtype = kwargs.get('database')
-        if dbtype not in [ 'sqlite3', 'http' ]:
+        # export_all opens the same database again in its worker processes
+        self.dbargs = { k: v for k, v in kwargs.items() if k not in ['cache', 'cache_ttl'] }
+        if dbtype not in [ 'sqlite3', 'http', 'memory', 'snapshot' ]:
             raise Exception("unsupported database driver")
         if dbtype == "sqlite3":
             dbfile = kwargs.get('dbfile')
-            self.db = db_sqlite3(dbfile)
+            opts = { k: kwargs[k] for k in db_sqlite3.OPTIONS if k in kwargs }
+            self.db = db_sqlite3(dbfile, **opts)
+        if dbtype == "memory":
+            # :dbfile is only read at start, call self.db.dump() to keep the result
+            self.db = db_memory(kwargs.get('dbfile',None))
+        if dbtype == "snapshot":
+            # read only, made by compile_snapshot
+            self.db = db_snapshot(kwargs.get('dbfile'))
         if dbtype == "http":
             server = kwargs.get('server')
             port = kwargs.get('port')
             key = kwargs.get('key')
             self.db = db_http(server,port,key)
+        # optional read-through cache for find_*, sqlite checks data_version, http can only expire
+        self.cache = None
+        # transactions opened through ipam on this thread, reads in them are not cached
+        self._txn = threading.local()
+        if kwargs.get('cache',None):
+            ttl = kwargs.get('cache_ttl', 5 if dbtype == "http" else None)
+            self.cache = result_cache(size=kwargs.get('cache'), ttl=ttl)
 
     def find_domain(self, *args, **kwargs):
-        return self.db.find_domain(*args, **kwargs)
+        return self._cached('find_domain', *args, **kwargs)
+    def iter_domain(self, *args, **kwargs):
+        return self.db.iter_domain(*args, **kwargs)
     def add_domain(self, *args, **kwargs):
-        return self.db.add_domain(*args, **kwargs)
+        return self._write('add_domain', *args, **kwargs)
+    def add_domains(self, *args, **kwargs):
+        return self._write('add_domains', *args, **kwargs)
     def update_domain(self, *args, **kwargs):
-        return self.db.update_domain(*args, **kwargs)
+        return self._write('update_domain', *args, **kwargs)
     def delete_domain(self, *args, **kwargs):
-        return self.db.delete_domain(*args, **kwargs)
+        return self._write('delete_domain', *args, **kwargs)
 
     def find_record(self, *args, **kwargs):
-        return self.db.find_record(*args, **kwargs)
+        return self._cached('find_record', *args, **kwargs)
+    def iter_record(self, *args, **kwargs):
+        return self.db.iter_record(*args, **kwargs)
     def find_network(self, *args, **kwargs):
-        return self.db.find_network(*args, **kwargs)
+        return self._cached('find_network', *args, **kwargs)
+    def iter_network(self, *args, **kwargs):
+        return self.db.iter_network(*args, **kwargs)
     def find_address(self, *args, **kwargs):
-        return self.db.find_address(*args, **kwargs)
+        return self._cached('find_address', *args, **kwargs)
+    def iter_address(self, *args, **kwargs):
+        return self.db.iter_address(*args, **kwargs)
     def add_record(self, *args, **kwargs):
-        return self.db.add_record(*args, **kwargs)
+        return self._write('add_record', *args, **kwargs)
+    def add_records(self, *args, **kwargs):
+        return self._write('add_records', *args, **kwargs)
     def update_record(self, *args, **kwargs):
-        return self.db.update_record(*args, **kwargs)
+        return self._write('update_record', *args, **kwargs)
     def delete_record(self, *args, **kwargs):
-        return self.db.delete_record(*args, **kwargs)
+        return self._write('delete_record', *args, **kwargs)
+
+    def find_subnet(self, *args, **kwargs):
+        return self._cached('find_subnet', *args, **kwargs)
+    def iter_subnet(self, *args, **kwargs):
+        return self.db.iter_subnet(*args, **kwargs)
+    def add_subnet(self, *args, **kwargs):
+        return self._write('add_subnet', *args, **kwargs)
+    def update_subnet(self, *args, **kwargs):
+        return self._write('update_subnet', *args, **kwargs)
+    def delete_subnet(self, *args, **kwargs):
+        return self._write('delete_subnet', *args, **kwargs)
+
+    def allocate_address(self, *args, **kwargs):
+        if not hasattr(self.db, 'allocate_address'):
+            raise Exception("database driver does not support address allocation")
+        return self._write('allocate_address', *args, **kwargs)
+
+    def compile_snapshot(self, *args, **kwargs):
+        if len(args) < 1:
+            raise Exception("missing argument")
+        return compile_snapshot(self.db, args[0])
+
+    def cache_stats(self):
+        if self.cache == None:
+            return(None)
+        return self.cache.stats()
+
+    def _cached(self, name, *args, **kwargs):
+        func = getattr(self.db, name)
+        if self.cache == None or getattr(self._txn, 'depth', 0) > 0:
+            return func(*args, **kwargs)
+        version = self.db.data_version() if hasattr(self.db, 'data_version') else None
+        key = repr((name, args, sorted(kwargs.items())))
+        res = self.cache.get(key, version)
+        if res == None:
+            res = func(*args, **kwargs)
+            self.cache.put(key, res, version)
+        return(res)
+
+    def _write(self, name, *args, **kwargs):
+        try:
+            return getattr(self.db, name)(*args, **kwargs)
+        finally:
+            if self.cache != None:
+                self.cache.clear()
+
+    def longest_match(self, *args, **kwargs):
+        if self.index == None:
+            self.refresh_index()
+        return self.index.longest_match(*args, **kwargs)
+    def match_many(self, *args, **kwargs):
+        if self.index == None:
+            self.refresh_index()
+        return self.index.match_many(*args, **kwargs)
+
+    def changes_since(self, *args, **kwargs):
+        return self.db.changes_since(*args, **kwargs)
+
+    def refresh_index(self, *args, **kwargs):
+        # lookups never touch the database, call this to pick up changes
+        if self.index != None and self.index_seq != None:
+            changed = False
+            while True:
+                changes = self.db.changes_since(self.index_seq, limit=10000)
+                if len(changes) == 0:
+                    break
+                for c in changes:
+                    self._index_change(c)
+                self.index_seq = changes[-1]['seq']
+                changed = True
+            return(changed)
+        version = None
+        if hasattr(self.db, 'data_version'):
+            version = self.db.data_version()
+        if self.index != None and version != None and version == self.index_version:
+            return(False)
+        # take the journal position first, anything that lands during the load is applied again later
+        seq = None
+        if hasattr(self.db, 'last_change'):
+            seq = self.db.last_change()
+        index = prefix_trie()
+        index.load(self.db)
+        self.index = index
+        self.index_version = version
+        self.index_seq = seq
+        return(True)
+
+    def _index_change(self, change):
+        if change['table'] == "networks":
+            if change['old'] != None:
+                self.index.delete(change['old']['network'])
+            if change['new'] != None:
+                self.index.insert(change['new']['network'], change['new'])
+        elif change['table'] == "records":
+            # rows are matched on id, so applying a change twice is harmless
+            for rec in [change['old'], change['new']]:
+                if rec != None and rec['rr_type'] in ["A", "AAAA"]:
+                    self.index.remove_host(rec['value'], rec)
+            rec = change['new']
+            if rec != None and rec['rr_type'] in ["A", "AAAA"]:
+                self.index.add_host(rec['value'], { 'id': rec['id'], 'fqdn': rec['fqdn'], 'rr_type': rec['rr_type'],
+                                                    'value': rec['value'], 'options': rec['options'] })
+
+    @contextlib.contextmanager
+    def transaction(self, *args, **kwargs):
+        if not hasattr(self.db, 'transaction'):
+            raise Exception("database driver does not support transactions")
+        self._txn.depth = getattr(self._txn, 'depth', 0) + 1
+        try:
+            with self.db.transaction(*args, **kwargs) as txn:
+                yield txn
+        finally:
+            self._txn.depth -= 1
+            # a rollback does not move data_version, drop whatever was cached meanwhile
+            if self.cache != None:
+                self.cache.clear()
 
     def check_options(self, *args, **kwargs):
         ok = []
@@ -109,13 +269,73 @@ class ipam:
     def export(self, *args, **kwargs):
         e_type = kwargs.get('type', None);
         dom = kwargs.get('domain', None);
+        # a new exporter per call, async_ipam runs exports of different types side by side
         if e_type == "bind":
-            self.edriver = export_bind(self.db)
+            edriver = export_bind(self.db)
         elif e_type == "nsd":
-            self.edriver = export_nsd(self.db)
+            edriver = export_nsd(self.db)
         elif e_type == "unbound":
-            self.edriver = export_unbound(self.db)
-        return self.edriver.process(domain=dom)
+            edriver = export_unbound(self.db)
+        elif e_type in export_delta.FORMATS:
+            # changes since a journal position, the finished exporter is kept in edriver so its
+            # last_seq and reload can be read for the next call
+            edriver = export_delta(self.db)
+            res = edriver.process(since=kwargs.get('since',None), format=e_type, domain=dom,
+                                  server=kwargs.get('server',None), ttl=kwargs.get('ttl',3600))
+            self.edriver = edriver
+            return(res)
+        else:
+            raise Exception("unsupported export type")
+        if kwargs.get('reverse',None) != None:
+            # PTR zones built from the A/AAAA records, returned as { zone: text }
+            return edriver.process_reverse(reverse=kwargs.get('reverse'), soa=kwargs.get('soa',None))
+        # with :out the zone is streamed to that file name or file object instead of returned
+        return edriver.process(domain=dom, out=kwargs.get('out',None), serial=kwargs.get('serial',None))
+
+    def import_zone(self, *args, **kwargs):
+        # loads a master file, returns { 'domain', 'records', 'errors' }
+        try:
+            return import_zone(self.db, rr_opts=self.RR_OPTS).process(file=kwargs.get('file', None),
+                        domain=kwargs.get('domain', None), batch=kwargs.get('batch', 10000))
+        finally:
+            if self.cache != None:
+                self.cache.clear()
+
+    def export_all(self, *args, **kwargs):
+        e_type = kwargs.get('type', None)
+        outdir = kwargs.get('outdir', None)
+        if e_type not in ["bind", "nsd", "unbound"] or outdir == None:
+            raise Exception("missing arguments")
+        filename = kwargs.get('filename', "{zone}.zone")
+        workers = int(kwargs.get('workers', None) or os.cpu_count() or 1)
+        # with :manifest only the zones that changed since the last run are written again
+        manifest = kwargs.get('manifest', None)
+        entries = None
+        if manifest != None:
+            entries = {}
+            if os.path.exists(manifest):
+                with open(manifest, 'r') as f:
+                    entries = json.load(f)
+        # the last item is the zone's manifest entry, None for a new zone or False without a manifest
+        jobs = [ (e_type, d['fqdn'], os.path.join(outdir, filename.format(zone=d['fqdn'])),
+                  entries.get(d['fqdn'], None) if entries != None else False) for d in self.db.find_domain(None) ]
+        # an in memory database only exists in this process
+        if workers <= 1 or len(jobs) <= 1 or self.dbargs.get('database') == "memory":
+            results = [ _export_zone(self, job) for job in jobs ]
+        else:
+            dbargs = dict(self.dbargs)
+            if dbargs.get('database') == "sqlite3":
+                dbargs['readonly'] = True
+                dbargs['pooled'] = False
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                    initializer=_export_worker_init, initargs=(dbargs,)) as pool:
+                results = list(pool.map(_export_worker, jobs))
+        if manifest != None:
+            # zones that are gone drop out, a failed zone keeps what it had
+            entries = { zone: r.pop('manifest') for (zone, r) in results if r.get('manifest',None) != None }
+            write_lines([ json.dumps(entries, indent=1, sort_keys=True) ], manifest)
+        # { zone: { 'file': path, 'seconds': value, 'error': None or message, 'changed': bool } }
+        return(dict(results))
 
     def unpack_options(self, options):
         # take the option DB format and create dict
@@ -136,3 +356,48 @@ class ipam:
             s.append("{}:{}".format(k,options[k]))
         return(" ".join(s))
 
+# export_all worker processes, each with a database handle of its own
+_export_ipam = None
+
+def _export_worker_init(dbargs):
+    global _export_ipam
+    _export_ipam = ipam(**dbargs)
+
+def _export_worker(job):
+    return _export_zone(_export_ipam, job)
+
+def _export_zone(db, job):
+    (e_type, zone, path, entry) = job
+    start = time.perf_counter()
+    ret = { 'file': path, 'seconds': None, 'error': None, 'changed': True }
+    try:
+        if entry == False:
+            # written to a temp file and renamed, a failed zone leaves the old file alone
+            db.export(type=e_type, domain=zone, out=path)
+        else:
+            # a zone that fails keeps its old manifest entry
+            ret['manifest'] = entry
+            (ret['manifest'], ret['changed']) = _export_changed(db, e_type, zone, path, entry)
+    except Exception as e:
+        ret['error'] = str(e)
+    ret['seconds'] = time.perf_counter()-start
+    return(zone, ret)
+
+def _export_changed(db, e_type, zone, path, entry):
+    # returns the new manifest entry for the zone and whether it was exported
+    state = db.db.zone_state(zone) if hasattr(db.db, 'zone_state') else None
+    usable = entry != None and entry['type'] == e_type and os.path.exists(path)
+    if usable and state != None and entry.get('state',None) != None:
+        old = entry['state']
+        # a change in the same second as the last check would not move updated_at
+        if old['serial'] == state['serial'] and old['updated_at'] == state['updated_at'] \
+                and old['count'] == state['count'] and (old['updated_at'] or "") < old['now']:
+            return(entry, False)
+    digest = zone_hash(db.db, zone)
+    if usable and digest == entry['hash']:
+        return(merge_dicts(dict(entry), { 'state': state }), False)
+    serial = gen_serial()
+    if entry != None and serial <= entry['zone_serial']:
+        serial = entry['zone_serial']+1
+    db.export(type=e_type, domain=zone, out=path, serial=serial)
+    return({ 'type': e_type, 'hash': digest, 'zone_serial': serial, 'state': state }, True)
@@ -0,0 +1,133 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import asyncio
+import concurrent.futures
+from libipam import ipam
+from libipam.db_http_async import db_http_async
+
+"""
+    asyncio front end for ipam
+
+    async_ipam(database='sqlite3'|'http', workers=8, ...)
+        Takes the same arguments as ipam.  Every call is a coroutine.
+
+        With sqlite3 the calls run on a dedicated thread pool of :workers threads over a pooled
+        db_sqlite3, so each worker has its own connection.  At most :workers calls are in flight,
+        the rest wait on a semaphore rather than piling up in the executor queue.
+
+        With http the find/add/update/delete calls go through db_http_async.  export has no
+        async version and always runs on the thread pool.
+
+    await close()
+        Shuts down the thread pool and closes the database.
+
+    cache_stats()
+        Statistics of the ipam result cache when it was enabled with :cache, not a coroutine.
+"""
+class async_ipam:
+    def __init__(self, *args, **kwargs):
+        self.workers = int(kwargs.pop('workers', 8))
+        dbtype = kwargs.get('database')
+        if dbtype == "sqlite3":
+            kwargs['pooled'] = True
+        self.sync = ipam(*args, **kwargs)
+        self.native = None
+        if dbtype == "http":
+            self.native = db_http_async(kwargs.get('server'), kwargs.get('port'), kwargs.get('key'))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ipam")
+        self.limit = asyncio.Semaphore(self.workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self.native != None:
+            await self.native.close()
+        # waiting for the queued calls would block the loop, the workers need it to hand back results
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown, True)
+        self.sync.db.close()
+
+    def cache_stats(self):
+        return self.sync.cache_stats()
+
+    async def _run(self, name, *args, **kwargs):
+        if self.native != None and hasattr(self.native, name):
+            return await getattr(self.native, name)(*args, **kwargs)
+        func = getattr(self.sync, name)
+        async with self.limit:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def find_domain(self, *args, **kwargs):
+        return await self._run('find_domain', *args, **kwargs)
+    async def add_domain(self, *args, **kwargs):
+        return await self._run('add_domain', *args, **kwargs)
+    async def add_domains(self, *args, **kwargs):
+        return await self._run('add_domains', *args, **kwargs)
+    async def update_domain(self, *args, **kwargs):
+        return await self._run('update_domain', *args, **kwargs)
+    async def delete_domain(self, *args, **kwargs):
+        return await self._run('delete_domain', *args, **kwargs)
+
+    async def find_record(self, *args, **kwargs):
+        return await self._run('find_record', *args, **kwargs)
+    async def find_network(self, *args, **kwargs):
+        return await self._run('find_network', *args, **kwargs)
+    async def find_address(self, *args, **kwargs):
+        return await self._run('find_address', *args, **kwargs)
+    async def add_record(self, *args, **kwargs):
+        return await self._run('add_record', *args, **kwargs)
+    async def add_records(self, *args, **kwargs):
+        return await self._run('add_records', *args, **kwargs)
+    async def update_record(self, *args, **kwargs):
+        return await self._run('update_record', *args, **kwargs)
+    async def delete_record(self, *args, **kwargs):
+        return await self._run('delete_record', *args, **kwargs)
+
+    async def find_subnet(self, *args, **kwargs):
+        return await self._run('find_subnet', *args, **kwargs)
+    async def add_subnet(self, *args, **kwargs):
+        return await self._run('add_subnet', *args, **kwargs)
+    async def update_subnet(self, *args, **kwargs):
+        return await self._run('update_subnet', *args, **kwargs)
+    async def delete_subnet(self, *args, **kwargs):
+        return await self._run('delete_subnet', *args, **kwargs)
+    async def allocate_address(self, *args, **kwargs):
+        return await self._run('allocate_address', *args, **kwargs)
+
+    async def changes_since(self, *args, **kwargs):
+        return await self._run('changes_since', *args, **kwargs)
+
+    async def export(self, *args, **kwargs):
+        return await self._run('export', *args, **kwargs)
@@ -0,0 +1,119 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import time
+import threading
+import collections
+
+"""
+    bounded LRU cache for the results of the ipam find_* calls
+
+    result_cache(size=1024, ttl=None)
+        Keeps at most :size results, least recently used go first.  With :ttl entries older
+        than :ttl seconds are not returned.
+
+    get(key, version=None) / put(key, value, version=None)
+        :version is whatever the database reports for its current state, when it differs from
+        the version an entry was stored under the whole cache is dropped.  get returns None on
+        a miss.  Both return and store copies so callers can modify the rows.
+
+    clear()
+        Drops every entry, called for every write made through ipam.
+
+    stats()
+        { 'hits': value, 'misses': value, 'hit_ratio': value, 'size': value, 'max_size': value,
+          'evictions': value, 'invalidations': value }
+"""
+class result_cache:
+    def __init__(self, *args, **kwargs):
+        self.size = int(kwargs.get('size',1024))
+        self.ttl = kwargs.get('ttl',None)
+        self.entries = collections.OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version=None):
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key, None)
+            if entry != None and self.ttl != None and entry[1] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry == None:
+                self.misses += 1
+                return(None)
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return(self._copy(entry[0]))
+
+    def put(self, key, value, version=None):
+        with self.lock:
+            self._check_version(version)
+            expires = time.monotonic() + self.ttl if self.ttl != None else None
+            self.entries[key] = (self._copy(value), expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            if len(self.entries) > 0:
+                self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return({ 'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total > 0 else 0.0,
+                 'size': len(self.entries), 'max_size': self.size,
+                 'evictions': self.evictions, 'invalidations': self.invalidations })
+
+    def _check_version(self, version):
+        if version != self.version:
+            if len(self.entries) > 0:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def _copy(self, rows):
+        # find_* results are lists of flat dicts with an options dict inside
+        if not isinstance(rows, list):
+            return(rows)
+        ret = []
+        for r in rows:
+            r = dict(r)
+            if isinstance(r.get('options',None), dict):
+                r['options'] = dict(r['options'])
+            ret.append(r)
+        return(ret)
@@ -49,6 +49,10 @@ import json
         Does not check to make sure that required options are there.  Calling library should do that.
         If the ":force flag is true, on delete it will delete all records associated with record too
 
+    add_[domains|records](iterable)
+        Bulk versions of add_domain/add_record.  Each entry is sent to the server in turn and a list
+        of { 'index': n, 'fqdn': value, 'error': message } is returned for the entries that failed.
+
     find_[domain|record](fqdn, include_subs=False)
         Accepts the :name/:fqdn of the domain/record and searching for it.  If no :name/:fqdn is
         provided it does a wild card search.  Wild cards can also be added.
@@ -60,6 +64,13 @@ import json
     find_address(address)
         Accepts an :address and finds all records with that address
 
+    [add|update|delete]_subnet(network/bitmask, options={})
+    find_subnet(network/bitmask=None, relation='exact', usage=False)
+        Manage the stored network prefixes, see db_sqlite3
+
+    changes_since(seq, limit=1000, table=None)
+        Change journal entries after :seq, see db_sqlite3
+
     NOTES:
         [add|update|delete]_* either return an exception or an empty list
         find_* will return a list of dict's with the following format
@@ -116,6 +127,20 @@ class db_http:
             raise Exception(r['msg'])
         return(r['records'])
 
+    def add_domains(self, *args, **kwargs):
+        # ipamd has no bulk endpoint, post them one at a time and collect the errors
+        errors = []
+        for i, d in enumerate(args[0]):
+            if isinstance(d, str):
+                d = { 'fqdn': d }
+            elif not isinstance(d, dict):
+                d = dict(zip(['fqdn','options'], d))
+            try:
+                self.add_domain(d.get('fqdn'), options=d.get('options',None))
+            except Exception as e:
+                errors.append({'index': i, 'fqdn': d.get('fqdn'), 'error': str(e)})
+        return(errors)
+
     def update_domain(self, *args, **kwargs):
         headers = {'Authorization': self.api_key}
         path = [self.URL, "domain"]
@@ -188,6 +213,18 @@ class db_http:
             raise Exception(r['msg'])
         return(r['records'])
 
+    def add_records(self, *args, **kwargs):
+        # ipamd has no bulk endpoint, post them one at a time and collect the errors
+        errors = []
+        for i, r in enumerate(args[0]):
+            if not isinstance(r, dict):
+                r = dict(zip(['fqdn','rr_type','value','options'], r))
+            try:
+                self.add_record(r.get('fqdn'), r.get('rr_type'), r.get('value'), options=r.get('options',None))
+            except Exception as e:
+                errors.append({'index': i, 'fqdn': r.get('fqdn'), 'error': str(e)})
+        return(errors)
+
     def update_record(self, *args, **kwargs):
         headers = {'Authorization': self.api_key}
         path = [self.URL, "record"]
@@ -256,6 +293,89 @@ class db_http:
             raise Exception(r['msg'])
         return(r['records'])
 
+    ### networks
+    def find_subnet(self, *args, **kwargs):
+        headers = {'Authorization': self.api_key}
+        path = [self.URL, "subnet"]
+        network = args[0] if len(args) > 0 else None
+        if network != None:
+            path.append(network)
+        params = { 'relation': kwargs.get('relation','exact') }
+        if kwargs.get('usage',False) == True:
+            params['usage'] = 1
+        try:
+            res = requests.get("/".join(path),headers=headers,params=params)
+        except Exception as e:
+            raise Exception(e)
+        r = json.loads(res.text)
+        if res.status_code != 200:
+            raise Exception(f'response code {res.status_code}:{r["msg"]}')
+        if r['status'] == 'error':
+            raise Exception(r['msg'])
+        return(r['records'])
+
+    def add_subnet(self, *args, **kwargs):
+        return(self._subnet(requests.post, *args, **kwargs))
+
+    def update_subnet(self, *args, **kwargs):
+        return(self._subnet(requests.put, *args, **kwargs))
+
+    def delete_subnet(self, *args, **kwargs):
+        return(self._subnet(requests.delete, *args, **kwargs))
+
+    def _subnet(self, method, *args, **kwargs):
+        headers = {'Authorization': self.api_key}
+        path = [self.URL, "subnet"]
+        if len(args) == 0 or args[0] == None:
+            raise Exception("network: not specified")
+        data = { 'resouce': 'subnet', 'network': args[0], 'options': kwargs.get('options',None) }
+        jdata = json.dumps(data)
+        try:
+            res = method("/".join(path),headers=headers,data=jdata)
+        except Exception as e:
+            raise Exception(e)
+        r = json.loads(res.text)
+        if res.status_code != 200:
+            raise Exception(f'response code {res.status_code}:{r["msg"]}')
+        if r['status'] == 'error':
+            raise Exception(r['msg'])
+        return(r['records'])
+
+    def iter_subnet(self, *args, **kwargs):
+        yield from self.find_subnet(*args, **kwargs)
+
+    ### changes
+    def changes_since(self, *args, **kwargs):
+        headers = {'Authorization': self.api_key}
+        seq = args[0] if len(args) > 0 and args[0] != None else 0
+        path = [self.URL, "changes", str(int(seq))]
+        params = { 'limit': int(kwargs.get('limit',1000)) }
+        if kwargs.get('table',None) != None:
+            params['table'] = kwargs.get('table')
+        try:
+            res = requests.get("/".join(path),headers=headers,params=params)
+        except Exception as e:
+            raise Exception(e)
+        r = json.loads(res.text)
+        if res.status_code != 200:
+            raise Exception(f'response code {res.status_code}:{r["msg"]}')
+        if r['status'] == 'error':
+            raise Exception(r['msg'])
+        return(r['records'])
+
+    # the server returns whole lists, these only keep the interface the same as db_sqlite3
+    def iter_domain(self, *args, **kwargs):
+        yield from self.find_domain(*args, **kwargs)
+
+    def iter_record(self, *args, **kwargs):
+        yield from self.find_record(*args, **kwargs)
+
+    def iter_network(self, *args, **kwargs):
+        yield from self.find_network(*args, **kwargs)
+
+    def iter_address(self, *args, **kwargs):
+        yield from self.find_address(*args, **kwargs)
+
     def _splitfqdn(self, fqdn):
         if len(fqdn) == 0:
             return(None, None)
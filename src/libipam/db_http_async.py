@@ -0,0 +1,167 @@
+###
+### asyncio interface with ipamd server
+###
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+
+import json
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+"""
+    asyncio http interface for IPAMD
+
+    Same calls as db_http, but every one of them is a coroutine and the requests are made with
+    aiohttp so they do not block the event loop.  aiohttp is only needed when this driver is used.
+
+    await close()
+        Closes the http session.
+"""
+class db_http_async:
+    API_URL="api"
+    def __init__(self, server, port, key):
+        if aiohttp == None:
+            raise Exception("aiohttp is required for the async http driver")
+        self.server = server
+        self.port = port
+        self.api_key = key
+        self.URL=f'http://{server}:{port}/{self.API_URL}'
+        self.session = None
+
+    async def close(self):
+        if self.session != None:
+            await self.session.close()
+            self.session = None
+
+    ### Domains
+    async def find_domain(self, *args, **kwargs):
+        return await self._get("domain", args[0])
+
+    async def add_domain(self, *args, **kwargs):
+        return await self._send("POST", "domain", self._domain(*args, **kwargs))
+
+    async def update_domain(self, *args, **kwargs):
+        return await self._send("PUT", "domain", self._domain(*args, **kwargs))
+
+    async def delete_domain(self, *args, **kwargs):
+        return await self._send("DELETE", "domain", self._domain(*args, **kwargs))
+
+    ### records
+    async def find_record(self, *args, **kwargs):
+        return await self._get("record", args[0])
+
+    async def add_record(self, *args, **kwargs):
+        if len(args) < 3:
+            raise Exception("missing args")
+        data = { 'resouce': 'record', 'fqdn': args[0], 'rr_type': args[1], 'value': args[2], 'options': kwargs.get('options',None) }
+        return await self._send("POST", "record", data)
+
+    async def update_record(self, *args, **kwargs):
+        if len(args) < 3:
+            raise Exception("missing args")
+        data = { 'resouce': 'record', 'fqdn': args[0], 'rr_type': args[1], 'value': args[2], 'options': kwargs.get('options',None) }
+        return await self._send("PUT", "record", data)
+
+    async def delete_record(self, *args, **kwargs):
+        data = { 'resouce': 'record', 'fqdn': args[0], 'options': kwargs.get('options',None) }
+        return await self._send("DELETE", "record", data)
+
+    async def find_network(self, *args, **kwargs):
+        return await self._get("network", args[0])
+
+    async def find_address(self, *args, **kwargs):
+        return await self._get("address", args[0])
+
+    ### networks
+    async def find_subnet(self, *args, **kwargs):
+        params = { 'relation': kwargs.get('relation','exact') }
+        if kwargs.get('usage',False) == True:
+            params['usage'] = 1
+        return await self._get("subnet", args[0] if len(args) > 0 else None, params)
+
+    async def add_subnet(self, *args, **kwargs):
+        return await self._send("POST", "subnet", self._subnet(*args, **kwargs))
+
+    async def update_subnet(self, *args, **kwargs):
+        return await self._send("PUT", "subnet", self._subnet(*args, **kwargs))
+
+    async def delete_subnet(self, *args, **kwargs):
+        return await self._send("DELETE", "subnet", self._subnet(*args, **kwargs))
+
+    ### changes
+    async def changes_since(self, *args, **kwargs):
+        seq = args[0] if len(args) > 0 and args[0] != None else 0
+        params = { 'limit': int(kwargs.get('limit',1000)) }
+        if kwargs.get('table',None) != None:
+            params['table'] = kwargs.get('table')
+        return await self._get("changes", str(int(seq)), params)
+
+    def _domain(self, *args, **kwargs):
+        if args[0] == None:
+            raise Exception("name: not specified")
+        return { 'resouce': 'domain', 'fqdn': args[0], 'rr_type': 'SOA', 'value': None, 'options': kwargs.get('options',None) }
+
+    def _subnet(self, *args, **kwargs):
+        if len(args) == 0 or args[0] == None:
+            raise Exception("network: not specified")
+        return { 'resouce': 'subnet', 'network': args[0], 'options': kwargs.get('options',None) }
+
+    async def _get(self, resource, name, params=None):
+        path = [self.URL, resource]
+        if name != None:
+            path.append(name)
+        return await self._request("GET", "/".join(path), params=params)
+
+    async def _send(self, method, resource, data):
+        return await self._request(method, "/".join([self.URL, resource]), data=json.dumps(data))
+
+    async def _request(self, method, url, data=None, params=None):
+        if self.session == None:
+            self.session = aiohttp.ClientSession(headers={'Authorization': self.api_key})
+        try:
+            async with self.session.request(method, url, data=data, params=params) as res:
+                status = res.status
+                text = await res.text()
+        except Exception as e:
+            raise Exception(e)
+        r = json.loads(text)
+        if status != 200:
+            raise Exception(f'response code {status}:{r.get("msg")}')
+        if r['status'] == 'error':
+            raise Exception(r['msg'])
+        return(r['records'])
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
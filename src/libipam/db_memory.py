@@ -0,0 +1,760 @@
+###
+### interface with ipamd server
+###
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import ipaddress
+import bisect
+import contextlib
+import json
+import re
+from libipam.utils import *
+from libipam.db_sqlite3 import db_sqlite3
+
+"""
+    in memory database for IPAM
+
+    Same calls and return values as db_sqlite3, nothing is written anywhere unless dump() is
+    called.  Meant for tests and planning runs whose data is thrown away afterwards.
+
+    db_memory(dbfile=None)
+        With :dbfile the contents of that sqlite database are loaded first.
+
+    load(dbfile) / dump(dbfile)
+        Replace the contents with those of a sqlite database, or write the contents to one.  ids
+        are kept so records still point at the right domains and main records.  dump replaces
+        whatever the database held before, in one transaction.
+
+    [add|update|delete]_[domain|record|subnet], add_[domains|records], allocate_address
+    find_*/iter_*, transaction(), data_version()
+        See db_sqlite3.  Records are indexed by fqdn and by domain, A/AAAA records are also kept in
+        an address array sorted like the (family, intvalue) index so find_network bisects to the
+        start of the range.  transaction() keeps an undo log of the changes made in the block and
+        plays it back if the block raises, so it costs as much as the changes, not the data.
+
+    There is no change journal, changes_since is not available.
+"""
+class db_memory:
+    def __init__(self, *args, **kwargs):
+        self.writes = 0
+        # (function, args) that reverse each change, only while a transaction is open
+        self._undo = None
+        self._clear()
+        dbfile = args[0] if len(args) > 0 else kwargs.get('dbfile',None)
+        if dbfile != None:
+            self.load(dbfile)
+
+    def _clear(self):
+        self.domains = {}           # id -> row
+        self.domain_names = {}      # name -> id
+        self.records = {}           # id -> row
+        self.by_fqdn = {}           # fqdn -> [ids]
+        self.by_domain = {}         # domain_id -> { ids }
+        self.links = {}             # record_id -> { ids of records pointing at it }
+        self.addresses = []         # sorted (family, intvalue, fqdn, id)
+        self.networks = {}          # id -> row
+        self.network_names = {}     # name -> id
+        self.next_id = { 'domains': 1, 'records': 1, 'networks': 1 }
+
+    def close(self):
+        self._clear()
+
+    def load(self, dbfile):
+        db = db_sqlite3(dbfile)
+        try:
+            self._clear()
+            for res in db._iquery("SELECT id, name, serial, options FROM domains;", {}):
+                self._put_domain({ 'id': res['id'], 'name': res['name'], 'serial': res['serial'],
+                                   'options': db._unpack_options(res['options']) })
+            for res in db._iquery("SELECT id, name, rr_type, value, options, domain_id, record_id FROM records ORDER BY id;", {}):
+                self._put_record({ 'id': res['id'], 'name': res['name'], 'rr_type': res['rr_type'], 'value': res['value'],
+                                   'options': db._unpack_options(res['options']), 'domain_id': res['domain_id'],
+                                   'record_id': res['record_id'] })
+            for res in db._iquery("SELECT id, name, options FROM networks;", {}):
+                self._put_network({ 'id': res['id'], 'network': res['name'], 'options': db._unpack_options(res['options']) })
+            for table in self.next_id.keys():
+                r = db._query("SELECT MAX(id) AS id FROM {};".format(table), {})
+                self.next_id[table] = (r[0]['id'] or 0) + 1
+        finally:
+            db.close()
+        self.writes += 1
+
+    def dump(self, dbfile):
+        db = db_sqlite3(dbfile)
+        try:
+            with db.transaction():
+                # records first, they reference the domains
+                db._query("DELETE FROM records;", {})
+                db._query("DELETE FROM domains;", {})
+                db._query("DELETE FROM networks;", {})
+                db._bulk_insert("INSERT INTO domains (id,name,serial,options) VALUES (:id,:name,:serial,:options);",
+                    [ { 'id': d['id'], 'name': d['name'], 'serial': d['serial'], 'options': db._pack_options(d['options']) }
+                      for d in self.domains.values() ])
+                db._bulk_insert("INSERT INTO records (id,name,rr_type,domain_id,value,intvalue,family,record_id,options)" \
+                    " VALUES (:id,:name,:rr_type,:domain_id,:value,:intvalue,:family,:record_id,:options);",
+                    [ { 'id': r['id'], 'name': r['name'], 'rr_type': r['rr_type'], 'domain_id': r['domain_id'],
+                        'value': r['value'], 'record_id': r['record_id'], 'options': db._pack_options(r['options']),
+                        'intvalue': r['intvalue'].to_bytes(16, 'big') if r['intvalue'] != None else None,
+                        'family': r['family'] } for r in sorted(self.records.values(), key=lambda a: a['id']) ])
+                values = []
+                for n in self.networks.values():
+                    net = self._network(n['network'])
+                    values.append({ 'id': n['id'], 'name': n['network'], 'family': net.version,
+                                    'low': db._ip2num(net.network_address), 'high': db._ip2num(net.broadcast_address),
+                                    'prefixlen': net.prefixlen, 'options': db._pack_options(n['options']) })
+                db._bulk_insert("INSERT INTO networks (id,name,family,low,high,prefixlen,options)" \
+                    " VALUES (:id,:name,:family,:low,:high,:prefixlen,:options);", values)
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def transaction(self, immediate=False):
+        # nested blocks only roll back their own part of the log, like savepoints
+        outer = self._undo == None
+        if outer:
+            self._undo = []
+        mark = len(self._undo)
+        try:
+            yield self
+        except:
+            self._rollback(mark)
+            raise
+        finally:
+            if outer:
+                self._undo = None
+
+    def _log(self, func, *args):
+        if self._undo != None:
+            self._undo.append((func, args))
+
+    def _rollback(self, mark):
+        # the undo functions change the data themselves, they must not be logged again
+        undo = self._undo
+        self._undo = None
+        try:
+            while len(undo) > mark:
+                (func, args) = undo.pop()
+                func(*args)
+        finally:
+            self._undo = undo
+        self.writes += 1
+
+    def _set_next_id(self, next_id):
+        self.next_id = next_id
+
+    def _set_options(self, row, options, serial=None):
+        row['options'] = options
+        if serial != None:
+            row['serial'] = serial
+
+    def data_version(self):
+        return(self.writes)
+
+    ### Domains
+    def find_domain(self, *args, **kwargs):
+        return(list(self.iter_domain(*args, **kwargs)))
+
+    def iter_domain(self, *args, **kwargs):
+        name = args[0]
+        include_subs = kwargs.get('include_subs',False)
+        if name == None:
+            ids = self.domain_names.values()
+        else:
+            name = name.lower()
+            if name.find('*') == -1 and include_subs == False:
+                ids = [ self.domain_names[name] ] if name in self.domain_names else []
+            else:
+                match = self._like(name)
+                subs = self._like("*."+name) if include_subs == True else None
+                ids = [ i for (n, i) in self.domain_names.items() if match.match(n) or (subs != None and subs.match(n)) ]
+        rows = [ self.domains[i] for i in ids ]
+        rows = self._filter(rows, kwargs)
+        for d in self._page(rows, lambda a: (a['name'],), ["fqdn"], kwargs):
+            yield { 'id': d['id'], 'fqdn': d['name'], 'rr_type': 'SOA', 'serial': d['serial'], 'value': None,
+                    'options': self._options_out(d['options'], kwargs) }
+
+    def add_domain(self, *args, **kwargs):
+        name = args[0]
+        if len(name) <= 0:
+            raise Exception("name: not specified")
+        if name.lower() in self.domain_names: # domain already exists
+            raise Exception("domain already exists")
+        options = dict(kwargs.get('options',None) or {})
+        # :serial is passed as an options, but it isn't really
+        serial = options.pop('serial', None)
+        # dom_ins lower cases the name with an update, which has dom_upd bump the serial once
+        self._put_domain({ 'id': None, 'name': name, 'serial': (serial if serial != None else 0)+1, 'options': options })
+        return([])
+
+    def add_domains(self, *args, **kwargs):
+        errors = []
+        for i, d in enumerate(args[0]):
+            name = None
+            try:
+                if isinstance(d, str):
+                    (name, options) = (d, None)
+                elif isinstance(d, dict):
+                    (name, options) = (d.get('fqdn'), d.get('options'))
+                else:
+                    (name, options) = (list(d) + [None])[:2]
+                if name == None:
+                    raise Exception("name: not specified")
+                self.add_domain(name, options=options)
+            except Exception as e:
+                errors.append({'index': i, 'fqdn': name.lower() if name != None else None, 'error': str(e)})
+        return(errors)
+
+    def update_domain(self, *args, **kwargs):
+        name = args[0]
+        if len(name) <= 0:
+            raise Exception("name: not specified")
+        d = self.domains.get(self.domain_names.get(name.lower(), None), None)
+        if d == None:
+            raise Exception("domain does not exist")
+        options = kwargs.get('options',None)
+        serial = None
+        if options != None:
+            options = dict(self._unpack_options(options))
+            serial = options.pop('serial', None)
+        self._log(self._set_options, d, d['options'], d['serial'])
+        d['options'] = options if options != None else {}
+        # like the dom_upd trigger, every update bumps the serial unless one is given
+        d['serial'] = int(serial) if serial != None and int(serial) != d['serial'] else d['serial']+1
+        self.writes += 1
+        return([])
+
+    def delete_domain(self, *args, **kwargs):
+        name = args[0]
+        if len(name) == 0:
+            raise Exception("name: not specified")
+        domain_id = self.domain_names.get(name.lower(), None)
+        if domain_id == None:     # domain not found
+            raise Exception("domain does not exist")
+        ids = self.by_domain.get(domain_id, set())
+        if len(ids) > 0 and kwargs.get('force',False) == False:
+            raise Exception("domain is not empty. use -f to clear")
+        for rid in list(ids):
+            self._drop_record(rid)
+        self._log(self._put_back_domain, self.domains[domain_id])
+        del self.domain_names[self.domains[domain_id]['name']]
+        del self.domains[domain_id]
+        self.by_domain.pop(domain_id, None)
+        self.writes += 1
+        return([])
+
+    ### records
+    def find_record(self, *args, **kwargs):
+        return(list(self.iter_record(*args, **kwargs)))
+
+    def iter_record(self, *args, **kwargs):
+        fqdn = args[0]
+        include_subs = kwargs.get('include_subs',False)
+        if fqdn == None:
+            ids = self.records.keys()
+        else:
+            (name, domain) = self._splitfqdn(fqdn)
+            if name == None or domain == None:
+                raise Exception("missing required argument")
+            fqdn = fqdn.lower()
+            ids = None
+            if include_subs == False:
+                domain_id = self.domain_names.get(domain.lower(), None)
+                if domain_id == None:
+                    raise Exception("domain not found")
+                ids = self.by_domain.get(domain_id, set())
+            if fqdn.find('*') == -1:
+                ids = [ i for i in self.by_fqdn.get(fqdn, []) if ids == None or i in ids ]
+            else:
+                match = self._like(fqdn)
+                ids = [ i for i in (ids if ids != None else self.records.keys()) if match.match(self.records[i]['fqdn']) ]
+        rows = self._filter([ self.records[i] for i in ids ], kwargs)
+        for r in self._page(rows, lambda a: (a['fqdn'], a['id']), ["fqdn", "id"], kwargs):
+            yield self._record(r, kwargs)
+
+    def add_record(self, *args, **kwargs):
+        fqdn = args[0]
+        rr_type = args[1]
+        value = args[2]
+        if fqdn == None or rr_type == None or value == None:
+            raise Exception("missing required argument")
+        (name, domain) = self._splitfqdn(fqdn)
+        if name == None or domain == None:
+            raise Exception("required field not specified")
+        for r in self.find_record(fqdn):
+            # we already know that the fqdn matches... check the type and value
+            if r['rr_type'] == rr_type.upper() and r['value'] == value.lower():
+                raise Exception("host already exists")
+        domain_id = self.domain_names.get(domain.lower(), None)
+        if domain_id == None:
+            raise Exception("domain not found")
+        rec = { 'id': None, 'name': name, 'rr_type': rr_type, 'domain_id': domain_id, 'record_id': None,
+                'options': dict(kwargs.get('options',None) or {}) }
+        rec = merge_dicts(rec, self._fixup_values(rr_type.upper(), value))
+        self._put_record(rec)
+        return([])
+
+    def add_records(self, *args, **kwargs):
+        errors = []
+        plain = []
+        linked = []
+        for i, r in enumerate(args[0]):
+            if isinstance(r, dict):
+                r = (r.get('fqdn'), r.get('rr_type'), r.get('value'), r.get('options'))
+            else:
+                r = tuple((list(r) + [None])[:4])
+            # like db_sqlite3 the linked records go in after the rest so the ids come out the same
+            if r[1] != None and r[1].upper() in ["CNAME", "MX", "NS", "SRV"] and r[2] != None:
+                linked.append((i, r))
+            else:
+                plain.append((i, r))
+        for (i, r) in plain:
+            self._add_one(i, r, errors)
+        # linked records can point at each other, keep resolving until nothing new is found
+        while len(linked) > 0:
+            ready = [ (i, r) for (i, r) in linked if r[2].lower() in self.by_fqdn ]
+            if len(ready) == 0:
+                for (i, r) in linked:
+                    errors.append({'index': i, 'fqdn': r[0].lower() if r[0] != None else None, 'error': "could not find main record"})
+                break
+            linked = [ (i, r) for (i, r) in linked if r[2].lower() not in self.by_fqdn ]
+            for (i, r) in ready:
+                self._add_one(i, r, errors)
+        errors.sort(key=lambda a: a['index'])
+        return(errors)
+
+    def _add_one(self, i, r, errors):
+        (fqdn, rr_type, value, options) = r
+        try:
+            self.add_record(fqdn, rr_type, value, options=options)
+        except Exception as e:
+            errors.append({'index': i, 'fqdn': fqdn.lower() if fqdn != None else None, 'error': str(e)})
+
+    def update_record(self, *args, **kwargs):
+        fqdn = args[0]
+        rr_type = args[1].upper()
+        value = args[2]
+        if fqdn == None:
+            raise Exception("required field not specified")
+        options = kwargs.get('options',None)
+        recs = self.find_record(fqdn)
+        if len(recs) == 0:  # record not found
+            raise Exception("could not find record")
+        if options != None and 'id' not in options:
+            raise Exception("id missing")
+        rid = int(options['id'])
+        if len([ r for r in recs if r['rr_type'] == rr_type and r['id'] == rid ]) == 0:
+            raise Exception("id/type mismatch")
+        rec = dict(self.records[rid])
+        self._drop_record(rid, cascade=False)
+        rec = merge_dicts(rec, { 'family': None, 'intvalue': None })
+        rec = merge_dicts(rec, self._fixup_values(rr_type, value))
+        rec['options'] = dict(options)
+        self._put_record(rec)
+        return([])
+
+    def delete_record(self, *args, **kwargs):
+        fqdn = args[0]
+        if fqdn == None:
+            raise Exception("required field not specified")
+        options = kwargs.get('options',None)
+        recs = self.find_record(fqdn)
+        if len(recs) == 0:
+            raise Exception("record not found")
+        if options != None and 'id' not in options:
+            raise Exception("id Missing")
+        rid = int(options['id'])
+        if len([ r for r in recs if r['id'] == rid ]) == 0:
+            raise Exception("id/type mismatch")
+        if len(self.links.get(rid, set())) > 0 and kwargs.get('force',False) == False:
+            raise Exception("record has associations. use -f to clear")
+        self._drop_record(rid)
+        return([])
+
+    def find_network(self, *args, **kwargs):
+        return(list(self.iter_network(*args, **kwargs)))
+
+    def iter_network(self, *args, **kwargs):
+        net = self._network(args[0])
+        rows = [ self.records[a[3]] for a in self._address_range(net.version, int(net.network_address), int(net.broadcast_address)) ]
+        rows = self._filter(rows, kwargs)
+        after = kwargs.get('after',None)
+        if isinstance(after, dict):
+            kwargs = merge_dicts(dict(kwargs), { 'after': [int(ipaddress.ip_address(after['value'])), after['fqdn'], after['id']] })
+        for r in self._page(rows, lambda a: (a['intvalue'], a['fqdn'], a['id']), ["intvalue", "fqdn", "id"], kwargs):
+            yield self._record(r, kwargs)
+
+    def find_address(self, *args, **kwargs):
+        return(list(self.iter_address(*args, **kwargs)))
+
+    def iter_address(self, *args, **kwargs):
+        address = args[0]
+        if address == None:
+            raise Exception("missing argument")
+        try:
+            addr = ipaddress.ip_address(address)
+        except:
+            raise Exception("not valid address")
+        rows = [ self.records[a[3]] for a in self._address_range(addr.version, int(addr), int(addr)) ]
+        rows = self._filter(rows, kwargs)
+        for r in self._page(rows, lambda a: (a['fqdn'], a['id']), ["fqdn", "id"], kwargs):
+            yield self._record(r, kwargs)
+
+    ### networks
+    def find_subnet(self, *args, **kwargs):
+        return(list(self.iter_subnet(*args, **kwargs)))
+
+    def iter_subnet(self, *args, **kwargs):
+        network = args[0] if len(args) > 0 else None
+        relation = kwargs.get('relation','exact')
+        rows = list(self.networks.values())
+        if network != None:
+            net = self._network(network)
+            (low, high) = (int(net.network_address), int(net.broadcast_address))
+            if relation == "exact":
+                match = lambda n: n['low'] == low and n['prefixlen'] == net.prefixlen
+            elif relation == "subnets":
+                match = lambda n: n['low'] >= low and n['high'] <= high and n['prefixlen'] > net.prefixlen
+            elif relation == "supernets":
+                match = lambda n: n['low'] <= low and n['high'] >= high and n['prefixlen'] < net.prefixlen
+            elif relation == "overlaps":
+                match = lambda n: n['low'] <= high and n['high'] >= low
+            else:
+                raise Exception("relation: must be exact, subnets, supernets or overlaps")
+            rows = [ n for n in rows if n['family'] == net.version and match(n) ]
+        rows = self._filter(rows, kwargs)
+        after = kwargs.get('after',None)
+        if isinstance(after, dict):
+            net = self._network(after['network'])
+            kwargs = merge_dicts(dict(kwargs), { 'after': [net.version, int(net.network_address), net.prefixlen] })
+        for n in self._page(rows, lambda a: (a['family'], a['low'], a['prefixlen']), ["family", "low", "prefixlen"], kwargs):
+            r = { 'id': n['id'], 'network': n['network'], 'prefixlen': n['prefixlen'], 'options': self._options_out(n['options'], kwargs) }
+            if kwargs.get('usage',False) == True:
+                size = 2**((32 if n['family'] == 4 else 128)-n['prefixlen'])
+                (low, high) = (n['low'], n['high'])
+                if n['family'] == 4 and n['prefixlen'] < 31:
+                    # the network and broadcast addresses are neither free nor used
+                    size -= 2
+                    (low, high) = (low+1, high-1)
+                used = len(set([ a[1] for a in self._address_range(n['family'], low, high) ]))
+                r['size'] = size
+                r['used'] = used
+                r['free'] = max(size-used, 0)
+            yield r
+
+    def add_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        if str(net) in self.network_names:
+            raise Exception("network already exists")
+        self._put_network({ 'id': None, 'network': str(net), 'options': dict(kwargs.get('options',None) or {}) })
+        return([])
+
+    def update_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        if str(net) not in self.network_names:
+            raise Exception("network does not exist")
+        n = self.networks[self.network_names[str(net)]]
+        self._log(self._set_options, n, n['options'])
+        n['options'] = dict(kwargs.get('options',None) or {})
+        self.writes += 1
+        return([])
+
+    def delete_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        if str(net) not in self.network_names:
+            raise Exception("network does not exist")
+        self._log(self._put_back_network, self.networks[self.network_names[str(net)]])
+        del self.networks[self.network_names.pop(str(net))]
+        self.writes += 1
+        return([])
+
+    def allocate_address(self, *args, **kwargs):
+        if len(args) < 2:
+            raise Exception("missing argument")
+        net = self._network(args[0])
+        fqdn = args[1]
+        count = int(kwargs.get('count',1))
+        options = kwargs.get('options',None)
+        if count < 1:
+            raise Exception("count: must be at least 1")
+        low = int(net.network_address)
+        high = int(net.broadcast_address)
+        if net.version == 4 and net.prefixlen < 31:
+            # skip the network and broadcast addresses
+            low += 1
+            high -= 1
+        elif net.version == 6 and net.prefixlen < 127:
+            # skip the Subnet-Router anycast address, RFC 4291 2.6.1
+            low += 1
+        exclude = []
+        for e in kwargs.get('exclude',None) or []:
+            e = ipaddress.ip_network(e, strict=False)
+            if e.version == net.version:
+                exclude.append((int(e.network_address), int(e.broadcast_address)))
+        exclude.sort()
+        def skip(addr):
+            for (lo, hi) in exclude:
+                if lo <= addr <= hi:
+                    addr = hi+1
+            return(addr)
+        found = []
+        addr = skip(low)
+        # take the holes between the used addresses, the same walk as db_sqlite3
+        for a in self._address_range(net.version, low, high):
+            while addr < a[1] and len(found) < count:
+                found.append(addr)
+                addr = skip(addr+1)
+            if len(found) >= count:
+                break
+            if addr <= a[1]:
+                addr = skip(a[1]+1)
+        while len(found) < count and addr <= high:
+            found.append(addr)
+            addr = skip(addr+1)
+        addrtype = ipaddress.IPv4Address if net.version == 4 else ipaddress.IPv6Address
+        found = [ str(addrtype(a)) for a in found if a <= high ]
+        if len(found) < count:
+            raise Exception("not enough free addresses in network")
+        rr_type = "A" if net.version == 4 else "AAAA"
+        # the addresses are known to be free, only the domain can make add_record fail
+        (name, domain) = self._splitfqdn(fqdn)
+        if domain == None or domain.lower() not in self.domain_names:
+            raise Exception("domain not found")
+        for a in found:
+            self.add_record(fqdn, rr_type, a, options=dict(options) if options != None else None)
+        return(found)
+
+    def _put_domain(self, d):
+        self._log(self._set_next_id, dict(self.next_id))
+        if d['id'] == None:
+            d['id'] = self.next_id['domains']
+        self.next_id['domains'] = max(self.next_id['domains'], d['id']+1)
+        d['name'] = d['name'].lower()
+        self.domains[d['id']] = d
+        self.domain_names[d['name']] = d['id']
+        self._log(self._drop_domain, d['id'])
+        self.writes += 1
+
+    def _drop_domain(self, domain_id):
+        d = self.domains.pop(domain_id)
+        del self.domain_names[d['name']]
+        self.by_domain.pop(domain_id, None)
+        self.writes += 1
+
+    def _put_back_domain(self, d):
+        self.domains[d['id']] = d
+        self.domain_names[d['name']] = d['id']
+        self.writes += 1
+
+    def _put_record(self, r):
+        self._log(self._set_next_id, dict(self.next_id))
+        if r['id'] == None:
+            r['id'] = self.next_id['records']
+        self.next_id['records'] = max(self.next_id['records'], r['id']+1)
+        # the same normalizing the rec_ins/rec_upd triggers do
+        r['name'] = r['name'].lower()
+        r['rr_type'] = r['rr_type'].upper()
+        r['fqdn'] = r['name']+"."+self.domains[r['domain_id']]['name']
+        if r.get('intvalue',None) == None and r['rr_type'] in ["A", "AAAA"]:
+            r = merge_dicts(r, self._fixup_values(r['rr_type'], r['value']))
+        elif r.get('intvalue',None) == None:
+            r['intvalue'] = None
+            r['family'] = None
+        self.records[r['id']] = r
+        self.by_fqdn.setdefault(r['fqdn'], []).append(r['id'])
+        self.by_domain.setdefault(r['domain_id'], set()).add(r['id'])
+        if r['record_id'] != None:
+            self.links.setdefault(r['record_id'], set()).add(r['id'])
+        if r['intvalue'] != None:
+            bisect.insort(self.addresses, (r['family'], r['intvalue'], r['fqdn'], r['id']))
+        self._log(self._drop_record, r['id'], False)
+        self.writes += 1
+
+    def _drop_record(self, rid, cascade=True):
+        r = self.records.pop(rid, None)
+        if r == None:
+            return
+        self._log(self._put_record, r)
+        self.by_fqdn[r['fqdn']].remove(rid)
+        if len(self.by_fqdn[r['fqdn']]) == 0:
+            del self.by_fqdn[r['fqdn']]
+        self.by_domain[r['domain_id']].discard(rid)
+        if r['record_id'] != None and r['record_id'] in self.links:
+            self.links[r['record_id']].discard(rid)
+        if r['intvalue'] != None:
+            key = (r['family'], r['intvalue'], r['fqdn'], r['id'])
+            i = bisect.bisect_left(self.addresses, key)
+            if i < len(self.addresses) and self.addresses[i] == key:
+                del self.addresses[i]
+        if cascade == True:
+            # ON DELETE CASCADE on records.record_id
+            for lid in list(self.links.pop(rid, set())):
+                self._drop_record(lid)
+        self.writes += 1
+
+    def _put_network(self, n):
+        self._log(self._set_next_id, dict(self.next_id))
+        if n['id'] == None:
+            n['id'] = self.next_id['networks']
+        self.next_id['networks'] = max(self.next_id['networks'], n['id']+1)
+        net = self._network(n['network'])
+        n = merge_dicts(n, { 'network': str(net), 'family': net.version, 'prefixlen': net.prefixlen,
+                             'low': int(net.network_address), 'high': int(net.broadcast_address) })
+        self.networks[n['id']] = n
+        self.network_names[n['network']] = n['id']
+        self._log(self._drop_network, n['id'])
+        self.writes += 1
+
+    def _drop_network(self, network_id):
+        del self.network_names[self.networks.pop(network_id)['network']]
+        self.writes += 1
+
+    def _put_back_network(self, n):
+        self.networks[n['id']] = n
+        self.network_names[n['network']] = n['id']
+        self.writes += 1
+
+    def _address_range(self, family, low, high):
+        i = bisect.bisect_left(self.addresses, (family, low))
+        while i < len(self.addresses) and self.addresses[i][0] == family and self.addresses[i][1] <= high:
+            yield self.addresses[i]
+            i += 1
+
+    def _fixup_values(self, rr_type, value):
+        vals = {}
+        if rr_type in ["A", "AAAA"]:
+            addr = ipaddress.ip_address(value)
+            vals['intvalue'] = int(addr)
+            vals['family'] = addr.version
+        elif rr_type in ["CNAME", "MX", "NS", "SRV"]:
+            value = value.lower()
+            ids = self.by_fqdn.get(value, [])
+            if len(ids) == 0:
+                raise Exception("could not find main record")
+            vals['record_id'] = min(ids)
+        # add the actual value too
+        vals['value'] = value
+        return(vals)
+
+    def _record(self, r, kwargs):
+        return({ 'id': r['id'], 'fqdn': r['fqdn'], 'rr_type': r['rr_type'], 'value': r['value'],
+                 'options': self._options_out(r['options'], kwargs) })
+
+    def _options_out(self, options, kwargs):
+        # rows handed out are copies, like every find_* on db_sqlite3 returns fresh dicts
+        if kwargs.get('raw_options',False) == True:
+            return(json.dumps(options, separators=(',',':')))
+        return(dict(options))
+
+    def _unpack_options(self, options):
+        if isinstance(options, dict):
+            return(options)
+        if isinstance(options, str) and len(options) > 0 and options[0] == "{":
+            return(json.loads(options))
+        return({})
+
+    def _filter(self, rows, kwargs):
+        # :options_filter, compared the way the json_extract conditions in db_sqlite3 compare
+        match = kwargs.get('options_filter',None)
+        if match == None:
+            return(list(rows))
+        if isinstance(match, dict):
+            match = [ (k, "=", v) for k, v in match.items() ]
+        ops = { "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b,
+                "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b }
+        for (key, op, value) in match:
+            if op not in ops:
+                raise Exception("options_filter: unsupported operator {}".format(op))
+        ret = []
+        for r in rows:
+            ok = True
+            for (key, op, value) in match:
+                opt = r['options'].get(key, None)
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and opt != None:
+                    try:
+                        opt = float(opt)
+                    except:
+                        opt = 0
+                if opt == None:
+                    ok = False
+                    break
+                try:
+                    if not ops[op](opt, value):
+                        ok = False
+                        break
+                except TypeError:
+                    ok = False
+                    break
+            if ok == True:
+                ret.append(r)
+        return(ret)
+
+    def _page(self, rows, key, keys, kwargs):
+        # keyset pagination over rows already sorted by :key
+        after = kwargs.get('after',None)
+        limit = kwargs.get('limit',None)
+        rows = sorted(rows, key=key)
+        if after != None:
+            if isinstance(after, dict):
+                after = [ after[k] if k != "intvalue" else int(ipaddress.ip_address(after['value'])) for k in keys ]
+            elif not isinstance(after, (list, tuple)):
+                after = [after]
+            if len(after) != len(keys):
+                raise Exception("after: expected {} values".format(len(keys)))
+            after = tuple(after)
+            rows = rows[bisect.bisect_right([ key(r) for r in rows ], after):]
+        if limit != None:
+            rows = rows[:int(limit)]
+        return(rows)
+
+    def _like(self, pattern):
+        # the LIKE matching db_sqlite3 does for names with * in them
+        return(re.compile("^"+".*".join(map(re.escape, pattern.lower().split("*")))+"$"))
+
+    def _network(self, network):
+        if network == None:
+            raise Exception("missing argument")
+        try:
+            return(ipaddress.IPv4Network(network))
+        except:
+            try:
+                return(ipaddress.IPv6Network(network))
+            except:
+                raise Exception("not valid network")
+
+    def _splitfqdn(self, fqdn):
+        if len(fqdn) == 0:
+            return(None, None)
+        sp = fqdn.split('.')
+        return(sp[0],".".join(sp[1:]))
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
@@ -0,0 +1,475 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import os
+import re
+import mmap
+import json
+import zlib
+import struct
+import ipaddress
+from libipam.utils import *
+
+"""
+    read only snapshot of an IPAM database in one memory mapped file
+
+    compile_snapshot(db, path)
+        Writes the domains, records and networks of any database driver to :path.  The file is
+        a string table plus fixed width arrays: records sorted by (fqdn, id), A/AAAA addresses
+        sorted by (family, intvalue) and an open addressing hash of the fqdns.  It is written
+        to a temporary file and renamed, so readers that still have the old file mapped are
+        not disturbed.
+
+    db_snapshot(path)
+        Maps the file read only.  Opening does not depend on the size of the data, and every
+        process mapping the same file shares one copy in the page cache.  Rows are only turned
+        into python objects when they are returned.
+
+    find_*/iter_* for domains, records, networks, addresses and subnets
+        See db_sqlite3.  :limit, :after and :options_filter are supported, :raw_options returns
+        the options as stored JSON text.  Writes raise an exception.
+
+    data_version()
+        Identifies the mapped file, it does not change until the snapshot is opened again.
+"""
+MAGIC = b"IPAMSNAP"
+VERSION = 1
+# magic, version, counts of domains, records, addresses, hash buckets, networks, then the
+# offsets of those sections and of the string table
+HEADER = struct.Struct("<8sIIIIII6Q")
+# id, name, serial, options
+DOMAIN = struct.Struct("<qIIqII")
+# id, fqdn, rr_type, value, options, index of the domain or -1
+RECORD = struct.Struct("<qIIIIIIIIi")
+# family, big endian intvalue, index of the record
+ADDRESS = struct.Struct("<B16sI")
+# index of the first record with the fqdn + 1, 0 for an empty bucket
+BUCKET = struct.Struct("<I")
+# id, name, family, low, high, prefixlen, options
+NETWORK = struct.Struct("<qIIB16s16sBII")
+
+def compile_snapshot(db, path):
+    strings = _strings()
+    domains = sorted(db.iter_domain(None), key=lambda a: a['fqdn'])
+    names = { d['fqdn']: i for i, d in enumerate(domains) }
+    records = sorted(db.iter_record(None), key=lambda a: (a['fqdn'], a['id']))
+    networks = []
+    if hasattr(db, 'find_subnet'):
+        for n in db.find_subnet(None):
+            net = ipaddress.ip_network(n['network'], strict=False)
+            networks.append((net.version, int(net.network_address), net.prefixlen, net, n))
+        networks.sort(key=lambda a: a[:3])
+
+    out = bytearray()
+    for d in domains:
+        out += DOMAIN.pack(d['id'], *strings.add(d['fqdn']), int(d.get('serial',None) or 0), *strings.add(_pack_options(d['options'])))
+
+    addresses = []
+    buckets = [0] * _buckets(len(set([ r['fqdn'] for r in records ])))
+    out_records = bytearray()
+    for i, r in enumerate(records):
+        domain = r['fqdn'].split('.', 1)[1] if r['fqdn'].find('.') != -1 else ""
+        out_records += RECORD.pack(r['id'], *strings.add(r['fqdn']), *strings.add(r['rr_type']), *strings.add(r['value']),
+                                   *strings.add(_pack_options(r['options'])), names.get(domain, -1))
+        if i == 0 or records[i-1]['fqdn'] != r['fqdn']:
+            # records are sorted by fqdn, the bucket points at the first one
+            b = _hash(r['fqdn'].encode('utf-8')) & (len(buckets)-1)
+            while buckets[b] != 0:
+                b = (b+1) & (len(buckets)-1)
+            buckets[b] = i+1
+        if r['rr_type'] in ["A", "AAAA"]:
+            addr = ipaddress.ip_address(r['value'])
+            addresses.append((addr.version, int(addr), i))
+    # ties stay in record order, which is (fqdn, id) like the sqlite index
+    addresses.sort()
+
+    sections = [ bytes(out), bytes(out_records),
+                 b"".join([ ADDRESS.pack(f, v.to_bytes(16, 'big'), i) for (f, v, i) in addresses ]),
+                 b"".join([ BUCKET.pack(b) for b in buckets ]),
+                 b"".join([ NETWORK.pack(n['id'], *strings.add(str(net)), f, low.to_bytes(16, 'big'),
+                                         int(net.broadcast_address).to_bytes(16, 'big'), plen,
+                                         *strings.add(_pack_options(n['options'])))
+                            for (f, low, plen, net, n) in networks ]),
+                 bytes(strings.data) ]
+    offsets = []
+    pos = HEADER.size
+    for s in sections:
+        offsets.append(pos)
+        pos += len(s)
+    tmp = "{}.tmp.{}".format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(domains), len(records), len(addresses), len(buckets), len(networks), *offsets))
+            for s in sections:
+                f.write(s)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+class db_snapshot:
+    def __init__(self, *args, **kwargs):
+        self.path = args[0] if len(args) > 0 else kwargs.get('dbfile',None)
+        if self.path == None:
+            raise Exception("snapshot file not specified")
+        self.file = open(self.path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, self.ndomains, self.nrecords, self.naddresses, self.nbuckets, self.nnetworks,
+             self.domains_off, self.records_off, self.addresses_off, self.buckets_off, self.networks_off,
+             self.strings_off) = HEADER.unpack_from(self.mm, 0)
+        except (ValueError, struct.error):
+            self.file.close()
+            raise Exception("not a snapshot file")
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise Exception("not a snapshot file")
+        st = os.fstat(self.file.fileno())
+        self.version = (st.st_ino, st.st_mtime_ns)
+
+    def close(self):
+        if self.mm != None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def data_version(self):
+        return(self.version)
+
+    def _read_only(self, *args, **kwargs):
+        raise Exception("snapshot is read only")
+    add_domain = add_domains = update_domain = delete_domain = _read_only
+    add_record = add_records = update_record = delete_record = _read_only
+    add_subnet = update_subnet = delete_subnet = allocate_address = _read_only
+
+    ### Domains
+    def find_domain(self, *args, **kwargs):
+        return(list(self.iter_domain(*args, **kwargs)))
+
+    def iter_domain(self, *args, **kwargs):
+        name = args[0]
+        include_subs = kwargs.get('include_subs',False)
+        if name == None:
+            idx = range(self.ndomains)
+        else:
+            name = name.lower()
+            if name.find('*') == -1 and include_subs == False:
+                i = self._bisect(self.ndomains, lambda a: self._domain_name(a), name)
+                idx = [i] if i < self.ndomains and self._domain_name(i) == name else []
+            else:
+                match = _like(name)
+                subs = _like("*."+name) if include_subs == True else None
+                idx = ( i for i in range(self.ndomains) if match.match(self._domain_name(i)) or (subs != None and subs.match(self._domain_name(i))) )
+        rows = ( DOMAIN.unpack_from(self.mm, self.domains_off+i*DOMAIN.size) for i in idx )
+        for d in self._page(rows, lambda a: (self._str(a[1], a[2]),), ["fqdn"], lambda a: a[4:6], kwargs):
+            yield { 'id': d[0], 'fqdn': self._str(d[1], d[2]), 'rr_type': 'SOA', 'serial': d[3], 'value': None,
+                    'options': self._options(d[4], d[5], kwargs) }
+
+    ### records
+    def find_record(self, *args, **kwargs):
+        return(list(self.iter_record(*args, **kwargs)))
+
+    def iter_record(self, *args, **kwargs):
+        fqdn = args[0]
+        include_subs = kwargs.get('include_subs',False)
+        domain = None
+        if fqdn == None:
+            idx = range(self.nrecords)
+        else:
+            (name, dom) = self._splitfqdn(fqdn)
+            if name == None or dom == None:
+                raise Exception("missing required argument")
+            fqdn = fqdn.lower()
+            if include_subs == False:
+                d = self.find_domain(dom)
+                if len(d) == 0:
+                    raise Exception("domain not found")
+                domain = self._bisect(self.ndomains, lambda a: self._domain_name(a), d[0]['fqdn'])
+            if fqdn.find('*') == -1:
+                idx = self._lookup(fqdn)
+            else:
+                match = _like(fqdn)
+                idx = ( i for i in range(self.nrecords) if match.match(self._record_fqdn(i)) )
+        rows = ( RECORD.unpack_from(self.mm, self.records_off+i*RECORD.size) for i in idx )
+        if domain != None:
+            rows = ( r for r in rows if r[9] == domain )
+        for r in self._page(rows, lambda a: (self._str(a[1], a[2]), a[0]), ["fqdn", "id"], lambda a: a[7:9], kwargs):
+            yield self._record(r, kwargs)
+
+    def find_network(self, *args, **kwargs):
+        return(list(self.iter_network(*args, **kwargs)))
+
+    def iter_network(self, *args, **kwargs):
+        net = self._network(args[0])
+        after = kwargs.get('after',None)
+        if isinstance(after, dict):
+            kwargs = merge_dicts(dict(kwargs), { 'after': [int(ipaddress.ip_address(after['value'])), after['fqdn'], after['id']] })
+        rows = self._address_range(net.version, int(net.network_address), int(net.broadcast_address))
+        for (v, r) in self._page(rows, lambda a: (a[0], self._str(a[1][1], a[1][2]), a[1][0]), ["intvalue", "fqdn", "id"],
+                                 lambda a: a[1][7:9], kwargs):
+            yield self._record(r, kwargs)
+
+    def find_address(self, *args, **kwargs):
+        return(list(self.iter_address(*args, **kwargs)))
+
+    def iter_address(self, *args, **kwargs):
+        address = args[0]
+        if address == None:
+            raise Exception("missing argument")
+        try:
+            addr = ipaddress.ip_address(address)
+        except:
+            raise Exception("not valid address")
+        rows = ( r for (v, r) in self._address_range(addr.version, int(addr), int(addr)) )
+        for r in self._page(rows, lambda a: (self._str(a[1], a[2]), a[0]), ["fqdn", "id"], lambda a: a[7:9], kwargs):
+            yield self._record(r, kwargs)
+
+    ### networks
+    def find_subnet(self, *args, **kwargs):
+        return(list(self.iter_subnet(*args, **kwargs)))
+
+    def iter_subnet(self, *args, **kwargs):
+        network = args[0] if len(args) > 0 else None
+        relation = kwargs.get('relation','exact')
+        rows = ( self._subnet(i) for i in range(self.nnetworks) )
+        if network != None:
+            net = self._network(network)
+            (low, high) = (int(net.network_address), int(net.broadcast_address))
+            if relation == "exact":
+                match = lambda n: n['low'] == low and n['prefixlen'] == net.prefixlen
+            elif relation == "subnets":
+                match = lambda n: n['low'] >= low and n['high'] <= high and n['prefixlen'] > net.prefixlen
+            elif relation == "supernets":
+                match = lambda n: n['low'] <= low and n['high'] >= high and n['prefixlen'] < net.prefixlen
+            elif relation == "overlaps":
+                match = lambda n: n['low'] <= high and n['high'] >= low
+            else:
+                raise Exception("relation: must be exact, subnets, supernets or overlaps")
+            rows = ( n for n in rows if n['family'] == net.version and match(n) )
+        after = kwargs.get('after',None)
+        if isinstance(after, dict):
+            net = self._network(after['network'])
+            kwargs = merge_dicts(dict(kwargs), { 'after': [net.version, int(net.network_address), net.prefixlen] })
+        for n in self._page(rows, lambda a: (a['family'], a['low'], a['prefixlen']), ["family", "low", "prefixlen"],
+                            lambda a: a['options'], kwargs):
+            r = { 'id': n['id'], 'network': n['network'], 'prefixlen': n['prefixlen'], 'options': self._options(*n['options'], kwargs) }
+            if kwargs.get('usage',False) == True:
+                size = 2**((32 if n['family'] == 4 else 128)-n['prefixlen'])
+                (low, high) = (n['low'], n['high'])
+                if n['family'] == 4 and n['prefixlen'] < 31:
+                    # the network and broadcast addresses are neither free nor used
+                    size -= 2
+                    (low, high) = (low+1, high-1)
+                used = len(set([ v for (v, rec) in self._address_range(n['family'], low, high) ]))
+                r['size'] = size
+                r['used'] = used
+                r['free'] = max(size-used, 0)
+            yield r
+
+    def _str(self, off, length):
+        return(str(self.mm[self.strings_off+off:self.strings_off+off+length], 'utf-8'))
+
+    def _domain_name(self, i):
+        (off, length) = struct.unpack_from("<II", self.mm, self.domains_off+i*DOMAIN.size+8)
+        return(self._str(off, length))
+
+    def _record_fqdn(self, i):
+        (off, length) = struct.unpack_from("<II", self.mm, self.records_off+i*RECORD.size+8)
+        return(self._str(off, length))
+
+    def _record(self, r, kwargs):
+        return({ 'id': r[0], 'fqdn': self._str(r[1], r[2]), 'rr_type': self._str(r[3], r[4]), 'value': self._str(r[5], r[6]),
+                 'options': self._options(r[7], r[8], kwargs) })
+
+    def _subnet(self, i):
+        n = NETWORK.unpack_from(self.mm, self.networks_off+i*NETWORK.size)
+        return({ 'id': n[0], 'network': self._str(n[1], n[2]), 'family': n[3], 'low': int.from_bytes(n[4], 'big'),
+                 'high': int.from_bytes(n[5], 'big'), 'prefixlen': n[6], 'options': (n[7], n[8]) })
+
+    def _options(self, off, length, kwargs):
+        text = self._str(off, length)
+        if kwargs.get('raw_options',False) == True:
+            return(text)
+        return(json.loads(text))
+
+    def _lookup(self, fqdn):
+        # indexes of the records with :fqdn, through the hash of the first one
+        if self.nbuckets == 0:
+            return([])
+        key = fqdn.encode('utf-8')
+        mask = self.nbuckets-1
+        b = _hash(key) & mask
+        while True:
+            (i,) = BUCKET.unpack_from(self.mm, self.buckets_off+b*BUCKET.size)
+            if i == 0:
+                return([])
+            if self._record_fqdn(i-1) == fqdn:
+                break
+            b = (b+1) & mask
+        ret = []
+        i -= 1
+        while i < self.nrecords and self._record_fqdn(i) == fqdn:
+            ret.append(i)
+            i += 1
+        return(ret)
+
+    def _address_range(self, family, low, high):
+        # yields (intvalue, record) from the first address >= :low, compared as the stored bytes
+        start = bytes([family]) + low.to_bytes(16, 'big')
+        end = bytes([family]) + high.to_bytes(16, 'big')
+        key = lambda i: self.mm[self.addresses_off+i*ADDRESS.size:self.addresses_off+i*ADDRESS.size+17]
+        i = self._bisect(self.naddresses, key, start)
+        while i < self.naddresses:
+            (f, v, rec) = ADDRESS.unpack_from(self.mm, self.addresses_off+i*ADDRESS.size)
+            if bytes([f]) + v > end:
+                break
+            yield (int.from_bytes(v, 'big'), RECORD.unpack_from(self.mm, self.records_off+rec*RECORD.size))
+            i += 1
+
+    def _bisect(self, n, key, value):
+        # bisect_left over :n entries read with :key
+        (lo, hi) = (0, n)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if key(mid) < value:
+                lo = mid+1
+            else:
+                hi = mid
+        return(lo)
+
+    def _page(self, rows, key, keys, options, kwargs):
+        # rows already come in :key order, so pagination only has to skip and stop
+        after = kwargs.get('after',None)
+        limit = kwargs.get('limit',None)
+        if after != None:
+            if isinstance(after, dict):
+                after = [ after[k] for k in keys ]
+            elif not isinstance(after, (list, tuple)):
+                after = [after]
+            if len(after) != len(keys):
+                raise Exception("after: expected {} values".format(len(keys)))
+            after = tuple(after)
+        match = kwargs.get('options_filter',None)
+        if isinstance(match, dict):
+            match = [ (k, "=", v) for k, v in match.items() ]
+        for (k, op, v) in match or []:
+            if op not in _OPS:
+                raise Exception("options_filter: unsupported operator {}".format(op))
+        count = 0
+        for r in rows:
+            if limit != None and count >= int(limit):
+                break
+            if after != None and key(r) <= after:
+                continue
+            if match != None and not _match_options(json.loads(self._str(*options(r))), match):
+                continue
+            count += 1
+            yield r
+
+    def _network(self, network):
+        if network == None:
+            raise Exception("missing argument")
+        try:
+            return(ipaddress.IPv4Network(network))
+        except:
+            try:
+                return(ipaddress.IPv6Network(network))
+            except:
+                raise Exception("not valid network")
+
+    def _splitfqdn(self, fqdn):
+        if len(fqdn) == 0:
+            return(None, None)
+        sp = fqdn.split('.')
+        return(sp[0],".".join(sp[1:]))
+
+class _strings:
+    # string table, each distinct string is stored once
+    def __init__(self):
+        self.data = bytearray()
+        self.index = {}
+
+    def add(self, s):
+        if s == None:
+            s = ""
+        r = self.index.get(s, None)
+        if r == None:
+            b = s.encode('utf-8')
+            r = self.index[s] = (len(self.data), len(b))
+            self.data += b
+        return(r)
+
+_OPS = { "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b,
+         "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b }
+
+def _match_options(options, match):
+    # compared the way the json_extract conditions in db_sqlite3 compare
+    for (key, op, value) in match:
+        opt = options.get(key, None)
+        if opt == None:
+            return(False)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            try:
+                opt = float(opt)
+            except:
+                opt = 0
+        try:
+            if not _OPS[op](opt, value):
+                return(False)
+        except TypeError:
+            return(False)
+    return(True)
+
+def _pack_options(options):
+    if isinstance(options, str):
+        return(options)
+    return(json.dumps(options if isinstance(options, dict) else {}, separators=(',',':')))
+
+def _hash(key):
+    # stable across processes, unlike hash()
+    return(zlib.crc32(key))
+
+def _buckets(n):
+    # a power of two at least twice the number of keys
+    size = 1
+    while size < n*2:
+        size *= 2
+    return(size if n > 0 else 0)
+
+def _like(pattern):
+    # the LIKE matching db_sqlite3 does for names with * in them
+    return(re.compile("^"+".*".join(map(re.escape, pattern.lower().split("*")))+"$"))
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
@@ -33,14 +33,27 @@
 
 import sqlite3
 import ipaddress
+import socket
 import os
+import contextlib
+import threading
+import json
+import urllib.parse
 from libipam.utils import *
 
 """
     database interface for IPAM DB
 
     Initializing the class will look for the database.  If it is not found, it will create it and
-    initialize the schema.
+    initialize the schema.  Databases created by older versions are upgraded in place using the
+    sqlite3.upgrade-N.schema scripts.
+
+    db_sqlite3(dbfile, pooled=False, wal=pooled, busy_timeout=5000, synchronous=None, mmap_size=None, cache_size=None, readonly=False)
+        With :pooled each thread gets its own connection so the object can be shared by worker
+        threads.  :wal switches the database to WAL journaling so readers are not blocked by a
+        writer, and defaults :synchronous to NORMAL.  The remaining arguments set the pragma of
+        the same name on every connection.  With :readonly the database is opened read only, it
+        has to exist and be at the current schema version.
 
     [add|update|delete]_domain(fqdn, options={}, force=False)
         Accepts the :name of the domain and the :options
@@ -52,17 +65,93 @@ from libipam.utils import *
         Does not check to make sure that required options are there.  Calling library should do that.
         If the ":force flag is true, on delete it will delete all records associated with record too
 
+    add_domains(iterable)
+        Accepts an iterable of names, (fqdn, options) tuples or dicts like find_domain returns and
+        inserts them in a single transaction.  Returns the per-row errors like add_records.
+
+    add_records(iterable)
+        Accepts an iterable of (fqdn, rr_type, value, options) tuples or dicts like find_record returns.
+        Domains and CNAME/MX/NS/SRV targets are resolved in sets and the rows are inserted in a single
+        transaction.  Returns a list of { 'index': n, 'fqdn': value, 'error': message } for the rows
+        that could not be added.
+
+    data_version()
+        Returns a value that changes whenever the database is written to, by this object or by
+        another connection.  With :pooled every thread gets the same value.
+
+    domain_cache_stats()
+        Exact name lookups in find_domain are served from an in-process cache that is cleared by
+        domain writes and by commits from other connections.  Returns the hits, misses and size.
+
+    transaction(immediate=False)
+        Context manager that groups calls into a single transaction.  Nothing is committed until the
+        outer most block exits and everything is rolled back if it raises.  Blocks can be nested.
+        :immediate takes the write lock when the block starts, a nested block takes it for the
+        outer transaction.  That fails when another connection committed since the outer
+        transaction started reading, the outer transaction has to be retried then.
+
     find_[domain|record](fqdn, include_subs=False)
         Accepts the :name/:fqdn of the domain/record and searching for it.  If no :name/:fqdn is
         provided it does a wild card search.  Wild cards can also be added.
         If the :include_subs flag is set subdomains will also be returned
 
+    iter_zone(domain)
+        Everything an export of :domain needs, from one query.  Yields the domain and each of its
+        subdomains as find_domain returns them, each followed by its NS records and then its
+        other records as find_record returns them.  Every row has a 'zone' key with the name of
+        the domain it belongs to.  The domain comes first, then the subdomains by name.
+
+    zone_state(domain)
+        A cheap fingerprint of everything iter_zone returns, without reading the rows.  Returns
+        { 'serial': value, 'updated_at': newest updated_at, 'count': number of rows, 'now': the
+        database time }
+
     find_network(network/bitmask)
         Accepts a network/mask and finds all records tha coorespond to the nework
 
     find_address(address)
         Accepts an address and finds all records with that address
 
+    iter_[domain|record|network|address](...)
+        Generator versions of the find_* calls.  Rows are streamed from the cursor in chunks
+        instead of being collected into a list first.
+
+    [add|update|delete]_subnet(network/bitmask, options={})
+        Stores a network prefix in the networks table.
+
+    find_subnet(network/bitmask=None, relation='exact', usage=False)
+        Finds stored prefixes.  :relation picks the prefix itself or its 'subnets', 'supernets' or
+        'overlaps'.  With :usage every row also gets the 'size', 'used' and 'free' address counts,
+        computed in the same query.  IPv4 prefixes shorter than /31 leave out the network and
+        broadcast addresses from all three.  Returns [{ 'id': value, 'network': value, 'prefixlen': value,
+        'options': { dict of options } }]
+
+    changes_since(seq, limit=1000, table=None)
+        Every insert, update and delete of a domain, record or network is journaled by triggers.
+        Returns the entries after :seq in order as [{ 'seq': value, 'table': value, 'op': value,
+        'id': value, 'old': { row } or None, 'new': { row } or None, 'changed_at': value }]
+
+    last_change() / prune_changes(seq)
+        The newest sequence number, and removal of the journal up to and including :seq.
+
+    zone_changes(since=0, until=None)
+        The newest journal entry after :since, and up to :until, for every domain that changed
+        itself or had a record change.  Returns { domain name: seq }
+
+    allocate_address(network, fqdn, count=1, exclude=[], options={})
+        Finds the first :count free addresses in :network, skipping anything in :exclude, and adds
+        A/AAAA records for :fqdn with them.  The search walks the address index and the records are
+        added in one transaction(immediate=True) so concurrent callers never get the same address.
+        The IPv4 network and broadcast addresses and the IPv6 Subnet-Router anycast address are
+        never handed out.  Returns the list of addresses.
+
+    find_*/iter_* also accept :limit and :after for keyset pagination.  :after is the last row
+    returned by the previous page.
+
+    find_*/iter_* accept :options_filter to match options in sql, either a dict of key: value or
+    a list of (key, op, value) tuples, e.g. [('ttl', '<', 300)].  With :raw_options the options
+    are returned as the stored JSON text and are not decoded.
+
     NOTES:
         [add|update|delete]_* either return an exception or an empty list
         find_* will return a list of dict's with the following format
@@ -71,15 +160,89 @@ from libipam.utils import *
             [{ 'fqdn': value, 'tt_type': value, 'value': value, 'options': { dict of options } }]
 
 """
+class _connection:
+    # a sqlite connection and the state that belongs to it
+    def __init__(self, con):
+        self.con = con
+        self.txn_depth = 0
+        self.domains = {}
+        self.data_version = None
+
 class db_sqlite3:
     SCHEMA_FILE="sqlite3.schema"
-    def __init__(self, dbfile):
+    SCHEMA_VERSION=7
+    UPGRADE_FILE="sqlite3.upgrade-{}.schema"
+    OPTIONS=['pooled', 'wal', 'busy_timeout', 'synchronous', 'mmap_size', 'cache_size', 'readonly']
+    # json.dumps builds a new encoder on every call when given separators
+    PACK_OPTIONS=json.JSONEncoder(separators=(',',':')).encode
+    def __init__(self, dbfile, **kwargs):
         self.dbfile = dbfile
-        self.con = None
-        self.con = sqlite3.connect(dbfile, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-        self.con.row_factory = sqlite3.Row
+        self.domain_hits = 0
+        self.domain_misses = 0
+        self.writes = 0
+        self.pooled = kwargs.get('pooled',False)
+        # pooled connections are shared by threads, default them to settings that suit that
+        self.wal = kwargs.get('wal',self.pooled)
+        self.busy_timeout = kwargs.get('busy_timeout',5000)
+        self.synchronous = kwargs.get('synchronous',"NORMAL" if self.wal else None)
+        self.mmap_size = kwargs.get('mmap_size',None)
+        self.cache_size = kwargs.get('cache_size',None)
+        self.readonly = kwargs.get('readonly',False)
+        self._lock = threading.Lock()
+        self._pool = []
+        self._local = threading.local() if self.pooled else None
+        self._main = _connection(None)
+        # PRAGMA data_version is per connection, pooled threads all read it from this one
+        self._version = _connection(None)
         self._dbinit()
 
+    @property
+    def con(self):
+        return self._conn.con
+
+    @property
+    def _conn(self):
+        # with :pooled every thread gets a connection of its own, made the first time it is needed
+        if self._local == None:
+            if self._main.con == None and self.dbfile != None:
+                self._main.con = self._connect()
+            return self._main
+        conn = getattr(self._local, 'conn', None)
+        if conn == None:
+            conn = _connection(self._connect())
+            with self._lock:
+                self._pool.append(conn)
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        dbfile = self.dbfile
+        if self.readonly == True:
+            dbfile = "file:{}?mode=ro".format(urllib.parse.quote(os.path.abspath(dbfile)))
+        try:
+            con = sqlite3.connect(dbfile, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                timeout=self.busy_timeout/1000, check_same_thread=not self.pooled, uri=self.readonly == True)
+        except sqlite3.Error as e:
+            raise Exception(e)
+        con.row_factory = sqlite3.Row
+        pragmas = [ "busy_timeout = {}".format(int(self.busy_timeout)), "foreign_keys = ON" ]
+        # the journal mode is stored in the database, a read only connection cannot change it
+        if self.wal and self.readonly != True:
+            pragmas.append("journal_mode = WAL")
+        if self.synchronous != None:
+            pragmas.append("synchronous = {}".format(self.synchronous))
+        if self.mmap_size != None:
+            pragmas.append("mmap_size = {}".format(int(self.mmap_size)))
+        if self.cache_size != None:
+            pragmas.append("cache_size = {}".format(int(self.cache_size)))
+        try:
+            for pragma in pragmas:
+                con.execute("PRAGMA {};".format(pragma))
+        except sqlite3.Error as e:
+            con.close()
+            raise Exception(e)
+        return(con)
+
     def _dbinit(self):
         cur = self.con.cursor()
         try:
@@ -87,46 +250,153 @@ class db_sqlite3:
             cur.execute("SELECT 1 FROM domains;",())
             cur.close()
         except:
+            if self.readonly == True:
+                cur.close()
+                raise Exception("database is not initialized")
             # schema not there... add it
-            fullschema = os.path.dirname(os.path.abspath(__file__))+"/"+self.SCHEMA_FILE
-            schema=""
-            f = open(fullschema, 'r')
-            for l in f:
-                schema=schema+l
-            f.close()
-            cur.executescript(schema);
+            cur.executescript(self._read_schema(self.SCHEMA_FILE));
             cur.close()
             self.con.commit()
+        self._upgrade()
+
+    def _upgrade(self):
+        r = self._query("SELECT value FROM defaults WHERE name = 'ipam.version';", {})
+        version = int(r[0]['value']) if len(r) > 0 else 1
+        if version < self.SCHEMA_VERSION and self.readonly == True:
+            raise Exception("database needs to be upgraded")
+        if version < self.SCHEMA_VERSION:
+            self._upgrade_functions()
+        while version < self.SCHEMA_VERSION:
+            version += 1
+            cur = self.con.cursor()
+            try:
+                # each step runs in one transaction so a failed upgrade leaves the old schema intact
+                cur.executescript("BEGIN;\n"+self._read_schema(self.UPGRADE_FILE.format(version)))
+                upgrade = getattr(self, "_upgrade_{}".format(version), None)
+                if upgrade != None:
+                    upgrade(cur)
+                cur.execute("UPDATE defaults SET value = :version WHERE name = 'ipam.version';", {'version': str(version)})
+                self.con.commit()
+            except sqlite3.Error as e:
+                self.con.rollback()
+                raise Exception(e)
+            finally:
+                cur.close()
+
+    def _upgrade_functions(self):
+        # helpers the upgrade scripts use to backfill columns that sqlite cannot compute itself
+        def ipkey(value):
+            try:
+                return self._ip2num(value)
+            except:
+                return None
+        def ipfamily(value):
+            try:
+                return self._ipfamily(value)
+            except:
+                return None
+        self.con.create_function("ipam_ipkey", 1, ipkey, deterministic=True)
+        self.con.create_function("ipam_ipfamily", 1, ipfamily, deterministic=True)
+        self.con.create_function("ipam_options", 1, lambda a: self._pack_options(self._unpack_options(a)), deterministic=True)
+
+    def _read_schema(self, name):
+        fullschema = os.path.dirname(os.path.abspath(__file__))+"/"+name
+        schema=""
+        f = open(fullschema, 'r')
+        for l in f:
+            schema=schema+l
+        f.close()
+        return(schema)
 
     def close(self):
-        if self.con != None:
-            self.con.close()
-            self.con = None
+        with self._lock:
+            conns = self._pool + [self._main, self._version]
+            self._pool = []
+        for conn in conns:
+            if conn.con != None:
+                conn.con.close()
+                conn.con = None
+        # stop _conn from opening new connections
+        self.dbfile = None
+        self._local = None
+
+    @contextlib.contextmanager
+    def transaction(self, immediate=False):
+        if self.con == None:
+            raise Exception("not connected")
+        self._conn.txn_depth += 1
+        # the outer most level owns the transaction, nested levels become savepoints
+        savepoint = None
+        try:
+            if self._conn.txn_depth == 1:
+                if self.con.in_transaction:
+                    self.con.commit()
+                # :immediate takes the write lock up front so read-then-write blocks cannot race
+                self.con.execute("BEGIN IMMEDIATE;" if immediate == True else "BEGIN;")
+            else:
+                name = "txn_{}".format(self._conn.txn_depth)
+                self.con.execute("SAVEPOINT {};".format(name))
+                savepoint = name
+                if immediate == True:
+                    # a savepoint cannot be immediate, a write that changes nothing takes the lock
+                    self.con.execute("UPDATE defaults SET value = value WHERE 0;")
+        except sqlite3.Error as e:
+            self._conn.txn_depth -= 1
+            if savepoint != None:
+                self.con.execute("RELEASE {};".format(savepoint))
+            raise Exception(e)
+        try:
+            yield self
+        except:
+            self._conn.txn_depth -= 1
+            # anything cached during the block may not exist anymore
+            self._conn.domains.clear()
+            if savepoint == None:
+                self.con.rollback()
+            else:
+                self.con.execute("ROLLBACK TO {};".format(savepoint))
+                self.con.execute("RELEASE {};".format(savepoint))
+            raise
+        self._conn.txn_depth -= 1
+        try:
+            if savepoint == None:
+                self.con.commit()
+            else:
+                self.con.execute("RELEASE {};".format(savepoint))
+        except sqlite3.Error as e:
+            raise Exception(e)
 
     ### Domains
     def find_domain(self, *args, **kwargs):
+        name = args[0]
+        if name != None and name.find('*') == -1 and kwargs.get('include_subs',False) == False and set(kwargs.keys()) <= set(['include_subs','limit']):
+            return(self._cached_domain(name))
+        return(list(self.iter_domain(*args, **kwargs)))
+
+    def iter_domain(self, *args, **kwargs):
         name = args[0]
         include_subs = kwargs.get('include_subs',False)
         sql = 'SELECT * FROM domains'
+        where = []
         values={}
         if name != None:
             if name.find('*') == -1:
-                sql=sql+" WHERE name = :name"
+                match = "name = :name"
             else:
                 name = name.replace('*','%')
-                sql=sql+" WHERE name LIKE :name"
+                match = "name LIKE :name"
+            name = name.lower()
             values['name'] = name
             if include_subs == True:
-                sql=sql+" OR name LIKE :subname"
+                match = "("+match+" OR name LIKE :subname)"
                 values['subname'] = "%."+name
-        sql=sql+" ORDER BY name ASC;"
-        result = self._query(sql, values)
-        ret = []
-        for res in result:
+            where.append(match)
+        self._options_filter(where, values, kwargs)
+        sql = self._page(sql, where, values, "name", ["fqdn"], kwargs)
+        for res in self._iquery(sql, values):
             if 'options' in res:
-                options = self._unpack_options(res['options'])
-            ret.append({ 'id': res['id'], 'fqdn': res['name'], 'rr_type': 'SOA', 'serial': res['serial'], 'value': None, 'options': options })
-        return(ret)
+                options = res['options'] if kwargs.get('raw_options',False) == True else self._unpack_options(res['options'])
+            yield { 'id': res['id'], 'fqdn': res['name'], 'rr_type': 'SOA', 'serial': res['serial'], 'value': None, 'options': options }
 
     def add_domain(self, *args, **kwargs):
         sql=""
@@ -153,9 +423,37 @@ class db_sqlite3:
         else:
             sql = 'INSERT INTO domains (name,serial,options) VALUES (:name,:serial,:options);'
         values = { 'name': name, 'serial': serial, 'options': options }
+        self._conn.domains.clear()
         # will always return an empty array
         return self._query(sql, values)
 
+    def add_domains(self, *args, **kwargs):
+        errors = []
+        rows = []
+        for i, d in enumerate(args[0]):
+            try:
+                (name, options) = self._bulk_domain(d)
+                if name == None or len(name) <= 0:
+                    raise Exception("name: not specified")
+                rows.append((i, name.lower(), options))
+            except Exception as e:
+                errors.append({'index': i, 'fqdn': None, 'error': str(e)})
+        existing = self._bulk_lookup('SELECT name AS key, id FROM domains WHERE name IN ({});', set(map(lambda a: a[1], rows)))
+        values = []
+        for (i, name, options) in rows:
+            if name in existing:
+                errors.append({'index': i, 'fqdn': name, 'error': "domain already exists"})
+                continue
+            existing[name] = None
+            options = dict(options) if options != None else {}
+            serial = options.pop('serial', None)
+            values.append({ 'name': name, 'serial': serial if serial != None else 0, 'options': self._pack_options(options) })
+        self._conn.domains.clear()
+        with self.transaction():
+            self._bulk_insert('INSERT INTO domains (name,serial,options) VALUES (:name,:serial,:options);', values)
+        errors.sort(key=lambda a: a['index'])
+        return(errors)
+
     def update_domain(self, *args, **kwargs):
         name = args[0]
         options = kwargs.get('options',None)
@@ -180,6 +478,7 @@ class db_sqlite3:
             sql = 'UPDATE domains SET name=:name, options=:opts WHERE id=:id;'
         else:
             sql = 'UPDATE domains SET name=:name, serial=:serial, options=:opts WHERE id=:id;'
+        self._conn.domains.clear()
         # will always return an empty array
         return self._query(sql, {'name': name, 'serial': serial, 'opts': options, 'id': rid});
 
@@ -189,26 +488,34 @@ class db_sqlite3:
         if len(name) == 0:
             raise Exception("name: not specified")
         force = kwargs.get('force',False)
-        r = self.find_domain(name)
-        if len(r) == 0:     # domain not found
-            raise Exception("domain does not exist")
-        domain_id = r[0]['id']
-        if force == False:
-            sql1 = 'SELECT count(*) AS cnt FROM records WHERE domain_id=:domain_id;'
-            r = self._query(sql1, {'domain_id': domain_id})
-            if r[0]['cnt'] > 0:  # have records attached to the domain
-                raise Exception("domain is not empty. use -f to clear")
-        # will always return an empty array
-        return self._query(sql, {'id': domain_id})
+        with self.transaction():
+            r = self.find_domain(name)
+            if len(r) == 0:     # domain not found
+                raise Exception("domain does not exist")
+            domain_id = r[0]['id']
+            if force == False:
+                sql1 = 'SELECT count(*) AS cnt FROM records WHERE domain_id=:domain_id;'
+                r = self._query(sql1, {'domain_id': domain_id})
+                if r[0]['cnt'] > 0:  # have records attached to the domain
+                    raise Exception("domain is not empty. use -f to clear")
+            else:
+                # do not rely on the foreign key pragma being enabled for the cascade
+                self._query('DELETE FROM records WHERE domain_id=:domain_id;', {'domain_id': domain_id})
+            self._conn.domains.clear()
+            # will always return an empty array
+            return self._query(sql, {'id': domain_id})
 
     ### records
     def find_record(self, *args, **kwargs):
+        return(list(self.iter_record(*args, **kwargs)))
+
+    def iter_record(self, *args, **kwargs):
         fqdn = args[0]
         include_subs = kwargs.get('include_subs',False)
         values={}
+        where = []
         sql = "SELECT * FROM fqdn_records"
         if (fqdn != None):
-            sql=sql+" WHERE"
             (name, domain) = self._splitfqdn(fqdn)
             if name == None or domain == None:
                 raise Exception("missing required argument")
@@ -217,21 +524,18 @@ class db_sqlite3:
                 if len(res) == 0:
                     raise Exception("domain not found")
                 values['domain_id'] = res[0]['id']
-                sql=sql+" domain_id = :domain_id AND"
+                where.append("domain_id = :domain_id")
             if fqdn.find('*') == -1:
-                sql=sql+" fqdn = :name"
+                where.append("fqdn = :name")
             else:
                 fqdn = fqdn.replace('*','%')
-                sql=sql+" fqdn LIKE :name"
-            values["name"] = fqdn
-        sql=sql+" ORDER BY fqdn ASC;"
-        result = self._query(sql, values)
-        ret = []
-        for res in result:
-            if 'options' in res:
-                options = self._unpack_options(res['options'])
-            ret.append({ 'id': res['id'], 'fqdn': res['fqdn'], 'rr_type': res['rr_type'], 'value': res['value'], 'options': options })
-        return(ret)
+                where.append("fqdn LIKE :name")
+            # records.fqdn is stored lower case
+            values["name"] = fqdn.lower()
+        self._options_filter(where, values, kwargs)
+        sql = self._page(sql, where, values, "fqdn, id", ["fqdn", "id"], kwargs)
+        for res in self._iquery(sql, values):
+            yield self._record(res, kwargs.get('raw_options',False))
 
     def add_record(self, *args, **kwargs):
         fqdn = args[0]
@@ -250,10 +554,7 @@ class db_sqlite3:
                     raise Exception("host already exists")
 
         options = kwargs.get('options',None)
-        if options != None:
-            options = self._pack_options(options)
-        else:
-            options = ""
+        options = self._pack_options(options)
         sql = 'INSERT INTO records ({}) VALUES ({});'
         rr_type=rr_type.upper()
         values={'name':name, 'rr_type': rr_type}
@@ -274,6 +575,77 @@ class db_sqlite3:
         sql=sql.format(','.join(values.keys()), ",".join(list(map(lambda a: ":"+a, values.keys()))))
         return self._query(sql, values)
 
+    def add_records(self, *args, **kwargs):
+        errors = []
+        rows = []
+        for i, r in enumerate(args[0]):
+            fqdn = None
+            try:
+                (fqdn, rr_type, value, options) = self._bulk_record(r)
+                if fqdn == None or rr_type == None or value == None:
+                    raise Exception("missing required argument")
+                (name, domain) = self._splitfqdn(fqdn)
+                if name == None or domain == None:
+                    raise Exception("required field not specified")
+                rr_type = rr_type.upper()
+                # rows go in normalized with their fqdn so the rec_ins trigger does not rewrite them
+                values = { 'name': name.lower(), 'rr_type': rr_type, 'domain_id': domain.lower(), 'value': value,
+                           'intvalue': None, 'family': None, 'record_id': None, 'options': self._pack_options(options),
+                           'fqdn': name.lower()+"."+domain.lower() }
+                if rr_type in ["A", "AAAA"]:
+                    values['intvalue'] = self._ip2num(value)
+                    values['family'] = 6 if value.find(':') != -1 else 4
+                elif rr_type in ["CNAME", "MX", "NS", "SRV"]:
+                    values['value'] = value.lower()
+                rows.append((i, fqdn.lower(), values))
+            except Exception as e:
+                errors.append({'index': i, 'fqdn': fqdn, 'error': str(e)})
+        # resolve every referenced domain and every possible duplicate with one query per set
+        domains = self._bulk_lookup('SELECT name AS key, id FROM domains WHERE name IN ({});', set(map(lambda a: a[2]['domain_id'], rows)))
+        existing = set()
+        for chunk in self._chunks(list(set(map(lambda a: a[1], rows)))):
+            sql = 'SELECT fqdn, rr_type, value FROM fqdn_records WHERE fqdn IN ({});'.format(",".join("?"*len(chunk)))
+            for res in self._query(sql, chunk):
+                existing.add((res['fqdn'], res['rr_type'], res['value']))
+        plain = []
+        linked = []
+        for (i, fqdn, values) in rows:
+            if values['domain_id'] not in domains:
+                errors.append({'index': i, 'fqdn': fqdn, 'error': "domain not found"})
+                continue
+            values['domain_id'] = domains[values['domain_id']]
+            key = (fqdn, values['rr_type'], values['value'].lower())
+            if key in existing:
+                errors.append({'index': i, 'fqdn': fqdn, 'error': "host already exists"})
+                continue
+            existing.add(key)
+            if values['rr_type'] in ["CNAME", "MX", "NS", "SRV"]:
+                linked.append((i, fqdn, values))
+            else:
+                plain.append(values)
+        columns = ['name', 'rr_type', 'domain_id', 'value', 'intvalue', 'family', 'record_id', 'options', 'fqdn']
+        with self.transaction():
+            self._insert_rows('records', columns, plain)
+            # linked records can point at each other, keep resolving until nothing new is found
+            while len(linked) > 0:
+                targets = self._bulk_lookup('SELECT fqdn AS key, MIN(id) AS id FROM fqdn_records WHERE fqdn IN ({}) GROUP BY fqdn;', set(map(lambda a: a[2]['value'], linked)))
+                ready = []
+                waiting = []
+                for (i, fqdn, values) in linked:
+                    if values['value'] in targets:
+                        values['record_id'] = targets[values['value']]
+                        ready.append(values)
+                    else:
+                        waiting.append((i, fqdn, values))
+                if len(ready) == 0:
+                    for (i, fqdn, values) in waiting:
+                        errors.append({'index': i, 'fqdn': fqdn, 'error': "could not find main record"})
+                    break
+                self._insert_rows('records', columns, ready)
+                linked = waiting
+        errors.sort(key=lambda a: a['index'])
+        return(errors)
+
     def update_record(self, *args, **kwargs):
         fqdn = args[0]
         rr_type = args[1].upper()
@@ -297,10 +669,7 @@ class db_sqlite3:
                     break
         if found == False:
             raise Exception("id/type mismatch")
-        if options != None:
-            options = self._pack_options(options)
-        else:
-            options = ""
+        options = self._pack_options(options)
         values = {}
         vals = self._fixup_values(rr_type, value)
 #        values = values | vals
@@ -330,10 +699,7 @@ class db_sqlite3:
                     break
         if found == False:
             raise Exception("id/type mismatch")
-        if options != None:
-            options = self._pack_options(options)
-        else:
-            options = ""
+        options = self._pack_options(options)
         sql = "SELECT count(*) AS cnt FROM records WHERE record_id = :id"
         recs = self._query(sql, {'id': rid})
         if recs[0]['cnt'] > 0 and force == False:
@@ -341,47 +707,271 @@ class db_sqlite3:
         sql = 'DELETE FROM records WHERE id = :id;'
         return self._query(sql, {'id': rid})
 
+    def iter_zone(self, *args, **kwargs):
+        name = args[0].lower()
+        # a single statement reads one snapshot, so the zone can not change half way through
+        sql = "SELECT * FROM (" \
+            " SELECT domains.name AS zone, 0 AS kind, domains.id, domains.name AS fqdn, 'SOA' AS rr_type, NULL AS value," \
+            "  domains.serial, domains.options FROM domains WHERE domains.name = :name OR domains.name LIKE :subname" \
+            " UNION ALL" \
+            " SELECT domains.name AS zone, CASE WHEN records.rr_type = 'NS' THEN 1 ELSE 2 END AS kind, records.id," \
+            "  records.fqdn, records.rr_type, records.value, NULL AS serial, records.options" \
+            "  FROM domains JOIN records ON records.domain_id = domains.id WHERE domains.name = :name OR domains.name LIKE :subname" \
+            ") ORDER BY zone != :name, zone, kind, fqdn, id;"
+        for res in self._iquery(sql, { 'name': name, 'subname': "%."+name }):
+            if res['kind'] == 0:
+                yield { 'id': res['id'], 'fqdn': res['fqdn'], 'rr_type': 'SOA', 'serial': res['serial'], 'value': None,
+                        'options': self._unpack_options(res['options']), 'zone': res['zone'] }
+            else:
+                yield merge_dicts(self._record(res), { 'zone': res['zone'] })
+
+    def zone_state(self, *args, **kwargs):
+        name = args[0].lower()
+        # deletes only show in the count, inserts and updates move updated_at
+        sql = "SELECT (SELECT serial FROM domains WHERE name = :name) AS serial, MAX(updated_at) AS updated_at," \
+            " COUNT(*) AS count, DATETIME('NOW') AS now FROM (" \
+            " SELECT updated_at FROM domains WHERE name = :name OR name LIKE :subname" \
+            " UNION ALL" \
+            " SELECT records.updated_at FROM domains JOIN records ON records.domain_id = domains.id" \
+            "  WHERE domains.name = :name OR domains.name LIKE :subname);"
+        return(self._query(sql, { 'name': name, 'subname': "%."+name })[0])
+
     def find_network(self, *args, **kwargs):
-        network = args[0]
-        if network == None:
-            raise Exception("missing argument")
-        net = None
-        try:
-            net = ipaddress.IPv4Network(network)
-        except:
-            try:
-                net = ipaddress.IPv6Network(network)
-            except:
-                raise Exception("not valid network")
-        low_addr = ipaddress.ip_address(net.network_address).packed
-        high_addr = ipaddress.ip_address(net.broadcast_address).packed
-        sql="SELECT * FROM fqdn_records WHERE intvalue >= :low and intvalue <= :high ORDER BY intvalue,fqdn ASC;"
-        result = self._query(sql, { 'low': low_addr, 'high': high_addr})
-        ret = []
-        for res in result:
-            if 'options' in res:
-                options = self._unpack_options(res['options'])
-            ret.append({'id': res['id'], 'fqdn': res['fqdn'], 'rr_type': res['rr_type'], 'value': res['value'], 'options': options })
-        return(ret)
+        return(list(self.iter_network(*args, **kwargs)))
+
+    def iter_network(self, *args, **kwargs):
+        net = self._network(args[0])
+        low_addr = self._ip2num(net.network_address)
+        high_addr = self._ip2num(net.broadcast_address)
+        sql="SELECT * FROM fqdn_records"
+        where = ["family = :family", "intvalue >= :low", "intvalue <= :high"]
+        values = { 'family': net.version, 'low': low_addr, 'high': high_addr}
+        self._options_filter(where, values, kwargs)
+        sql = self._page(sql, where, values, "intvalue, fqdn, id", ["intvalue", "fqdn", "id"], kwargs)
+        for res in self._iquery(sql, values):
+            yield self._record(res, kwargs.get('raw_options',False))
 
     def find_address(self, *args, **kwargs):
+        return(list(self.iter_address(*args, **kwargs)))
+
+    def iter_address(self, *args, **kwargs):
         address = args[0]
         if address == None:
             raise Exception("missing argument")
         addr = None
         try:
-            addr = ipaddress.ip_address(address).packed
+            addr = ipaddress.ip_address(address)
         except:
             raise Exception("not valid address")
-        sql="SELECT * FROM fqdn_records WHERE intvalue = :ip ORDER BY fqdn ASC;"
-        result = self._query(sql, {'ip': addr})
+        sql="SELECT * FROM fqdn_records"
+        where = ["family = :family", "intvalue = :ip"]
+        values = {'family': addr.version, 'ip': self._ip2num(addr)}
+        self._options_filter(where, values, kwargs)
+        sql = self._page(sql, where, values, "fqdn, id", ["fqdn", "id"], kwargs)
+        for res in self._iquery(sql, values):
+            yield self._record(res, kwargs.get('raw_options',False))
+
+    ### networks
+    def find_subnet(self, *args, **kwargs):
+        return(list(self.iter_subnet(*args, **kwargs)))
+
+    def iter_subnet(self, *args, **kwargs):
+        network = args[0] if len(args) > 0 else None
+        relation = kwargs.get('relation','exact')
+        usage = kwargs.get('usage',False)
+        sql = "SELECT networks.*"
+        if usage == True:
+            # one correlated range seek on records (family, intvalue) per prefix
+            # IPv4 network and broadcast addresses are not part of the size, so are not counted as used
+            sql = sql+", (SELECT COUNT(DISTINCT records.intvalue) FROM records WHERE records.family = networks.family" \
+                " AND records.intvalue >= networks.low AND records.intvalue <= networks.high" \
+                " AND NOT (networks.family = 4 AND networks.prefixlen < 31 AND records.intvalue IN (networks.low, networks.high))) AS used"
+        sql = sql+" FROM networks"
+        where = []
+        values = {}
+        if network != None:
+            net = self._network(network)
+            values = { 'family': net.version, 'low': self._ip2num(net.network_address),
+                       'high': self._ip2num(net.broadcast_address), 'prefixlen': net.prefixlen }
+            where.append("family = :family")
+            if relation == "exact":
+                where.append("low = :low AND prefixlen = :prefixlen")
+            elif relation == "subnets":
+                where.append("low >= :low AND high <= :high AND prefixlen > :prefixlen")
+            elif relation == "supernets":
+                where.append("low <= :low AND high >= :high AND prefixlen < :prefixlen")
+            elif relation == "overlaps":
+                where.append("low <= :high AND high >= :low")
+            else:
+                raise Exception("relation: must be exact, subnets, supernets or overlaps")
+        after = kwargs.get('after',None)
+        if isinstance(after, dict):
+            net = self._network(after['network'])
+            kwargs = merge_dicts(dict(kwargs), { 'after': [net.version, self._ip2num(net.network_address), net.prefixlen] })
+        self._options_filter(where, values, kwargs)
+        sql = self._page(sql, where, values, "family, low, prefixlen", ["family", "low", "prefixlen"], kwargs)
+        for res in self._iquery(sql, values):
+            options = res['options'] if kwargs.get('raw_options',False) == True else self._unpack_options(res['options'])
+            r = { 'id': res['id'], 'network': res['name'], 'prefixlen': res['prefixlen'], 'options': options }
+            if usage == True:
+                bits = 32 if res['family'] == 4 else 128
+                size = 2**(bits-res['prefixlen'])
+                if res['family'] == 4 and res['prefixlen'] < 31:
+                    size -= 2
+                r['size'] = size
+                r['used'] = res['used']
+                r['free'] = max(size-res['used'], 0)
+            yield r
+
+    def add_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        options = self._pack_options(kwargs.get('options',None))
+        sql = 'INSERT INTO networks (name,family,low,high,prefixlen,options) VALUES (:name,:family,:low,:high,:prefixlen,:options);'
+        values = { 'name': str(net), 'family': net.version, 'low': self._ip2num(net.network_address),
+                   'high': self._ip2num(net.broadcast_address), 'prefixlen': net.prefixlen, 'options': options }
+        with self.transaction():
+            if len(self.find_subnet(str(net))) > 0:
+                raise Exception("network already exists")
+            # will always return an empty array
+            return self._query(sql, values)
+
+    def update_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        options = self._pack_options(kwargs.get('options',None))
+        with self.transaction():
+            r = self.find_subnet(str(net))
+            if len(r) == 0:
+                raise Exception("network does not exist")
+            # will always return an empty array
+            return self._query('UPDATE networks SET options=:options WHERE id=:id;', {'options': options, 'id': r[0]['id']})
+
+    def delete_subnet(self, *args, **kwargs):
+        net = self._network(args[0] if len(args) > 0 else None)
+        with self.transaction():
+            r = self.find_subnet(str(net))
+            if len(r) == 0:
+                raise Exception("network does not exist")
+            # will always return an empty array
+            return self._query('DELETE FROM networks WHERE id=:id;', {'id': r[0]['id']})
+
+    ### changes
+    def changes_since(self, *args, **kwargs):
+        seq = int(args[0]) if len(args) > 0 and args[0] != None else 0
+        limit = int(kwargs.get('limit',1000))
+        sql = "SELECT * FROM changes WHERE seq > :seq"
+        values = { 'seq': seq, 'limit': limit }
+        table = kwargs.get('table',None)
+        if table != None:
+            sql = sql+" AND tbl = :table"
+            values['table'] = table
+        sql = sql+" ORDER BY seq ASC LIMIT :limit;"
         ret = []
-        for res in result:
-            if 'options' in res:
-                options = self._unpack_options(res['options'])
-            ret.append({'id': res['id'], 'fqdn': res['fqdn'], 'rr_type': res['rr_type'], 'value': res['value'], 'options': options })
+        for res in self._iquery(sql, values):
+            ret.append({ 'seq': res['seq'], 'table': res['tbl'], 'op': res['op'], 'id': res['row_id'],
+                         'old': json.loads(res['old']) if res['old'] != None else None,
+                         'new': json.loads(res['new']) if res['new'] != None else None,
+                         'changed_at': res['changed_at'] })
         return(ret)
 
+    def last_change(self, *args, **kwargs):
+        # the autoincrement counter, so pruning the whole journal does not take the position back
+        r = self._query("SELECT seq FROM sqlite_sequence WHERE name = 'changes';", {})
+        return(r[0]['seq'] if len(r) > 0 and r[0]['seq'] != None else 0)
+
+    def zone_changes(self, *args, **kwargs):
+        since = int(args[0]) if len(args) > 0 and args[0] != None else 0
+        until = kwargs.get('until',None)
+        values = { 'since': since, 'until': int(until) if until != None else self.last_change() }
+        rows = "FROM changes WHERE tbl = '{}' AND seq > :since AND seq <= :until AND {} IS NOT NULL"
+        # a record belongs to the domain after the first label of its fqdn
+        parts = []
+        for col in ["old", "new"]:
+            parts.append("SELECT seq, json_extract({0}, '$.name') AS name ".format(col) + rows.format("domains", col))
+            parts.append("SELECT seq, SUBSTR(fqdn, INSTR(fqdn, '.')+1) AS name FROM (SELECT seq, json_extract({0}, '$.fqdn') AS fqdn ".format(col)
+                         + rows.format("records", col) + ")")
+        sql = "SELECT name, MAX(seq) AS seq FROM (" + " UNION ALL ".join(parts) + ") WHERE name IS NOT NULL GROUP BY name;"
+        ret = {}
+        for res in self._iquery(sql, values):
+            ret[res['name']] = res['seq']
+        return(ret)
+
+    def prune_changes(self, *args, **kwargs):
+        # will always return an empty array
+        return self._query("DELETE FROM changes WHERE seq <= :seq;", { 'seq': int(args[0]) })
+
+    def allocate_address(self, *args, **kwargs):
+        if len(args) < 2:
+            raise Exception("missing argument")
+        net = self._network(args[0])
+        fqdn = args[1]
+        count = int(kwargs.get('count',1))
+        options = kwargs.get('options',None)
+        if count < 1:
+            raise Exception("count: must be at least 1")
+        low = int(net.network_address)
+        high = int(net.broadcast_address)
+        if net.version == 4 and net.prefixlen < 31:
+            # skip the network and broadcast addresses
+            low += 1
+            high -= 1
+        elif net.version == 6 and net.prefixlen < 127:
+            # skip the Subnet-Router anycast address, RFC 4291 2.6.1
+            low += 1
+        exclude = []
+        for e in kwargs.get('exclude',None) or []:
+            e = ipaddress.ip_network(e, strict=False)
+            if e.version == net.version:
+                exclude.append((int(e.network_address), int(e.broadcast_address)))
+        exclude.sort()
+        def skip(addr):
+            for (lo, hi) in exclude:
+                if lo <= addr <= hi:
+                    addr = hi+1
+            return(addr)
+        found = []
+        with self.transaction(immediate=True):
+            # walk the used addresses in order and take the holes in between, stopping as soon as
+            # there are enough so a large IPv6 prefix is never enumerated
+            sql = "SELECT DISTINCT intvalue FROM records WHERE family = :family AND intvalue >= :low AND intvalue <= :high ORDER BY intvalue;"
+            used = self._iquery(sql, {'family': net.version, 'low': low.to_bytes(16, 'big'), 'high': high.to_bytes(16, 'big')})
+            addr = skip(low)
+            try:
+                for res in used:
+                    taken = int.from_bytes(res['intvalue'], 'big')
+                    while addr < taken and len(found) < count:
+                        found.append(addr)
+                        addr = skip(addr+1)
+                    if len(found) >= count:
+                        break
+                    if addr <= taken:
+                        addr = skip(taken+1)
+            finally:
+                used.close()
+            while len(found) < count and addr <= high:
+                found.append(addr)
+                addr = skip(addr+1)
+            addrtype = ipaddress.IPv4Address if net.version == 4 else ipaddress.IPv6Address
+            found = [ str(addrtype(a)) for a in found if a <= high ]
+            if len(found) < count:
+                raise Exception("not enough free addresses in network")
+            rr_type = "A" if net.version == 4 else "AAAA"
+            for a in found:
+                self.add_record(fqdn, rr_type, a, options=dict(options) if options != None else None)
+        return(found)
+
+    def _network(self, network):
+        if network == None:
+            raise Exception("missing argument")
+        net = None
+        try:
+            net = ipaddress.IPv4Network(network)
+        except:
+            try:
+                net = ipaddress.IPv6Network(network)
+            except:
+                raise Exception("not valid network")
+        return(net)
+
     def _splitfqdn(self, fqdn):
         if len(fqdn) == 0:
             return(None, None)
@@ -391,7 +981,17 @@ class db_sqlite3:
     def _ip2num(self, addr=None):
         if addr == None:
             raise Exception("value not specified")
-        return ipaddress.ip_address(addr).packed
+        # fixed width big endian so IPv4 and IPv6 keys sort the same way within their family
+        # inet_pton is much quicker, ipaddress still gets whatever it refuses and gives the error
+        try:
+            return socket.inet_pton(socket.AF_INET6 if addr.find(':') != -1 else socket.AF_INET, addr).rjust(16, b'\0')
+        except:
+            return int(ipaddress.ip_address(addr)).to_bytes(16, 'big')
+
+    def _ipfamily(self, addr=None):
+        if addr == None:
+            raise Exception("value not specified")
+        return ipaddress.ip_address(addr).version
 
     def _query(self, sql, *args):
         if self.con == None:
@@ -401,16 +1001,181 @@ class db_sqlite3:
             cur.execute(sql, args[0])
         except sqlite3.Error as e:
             raise Exception(e)
+        if cur.rowcount > 0:
+            self.writes += 1
         # this magic takes the return values and converts them to an array of dicts
         vals = [{k: item[k] for k in item.keys()} for item in cur.fetchall()]
         cur.close()
-        self.con.commit()
+        # reads never open a transaction, and writes inside transaction() wait for it to finish
+        if self._conn.txn_depth == 0 and self.con.in_transaction:
+            self.con.commit()
         return vals
 
+    def data_version(self):
+        # changes whenever this object or another connection writes to the database
+        if self._local == None:
+            r = self._query("PRAGMA data_version;", {})
+            return((r[0]['data_version'], self.writes))
+        # every pooled connection counts differently, so the values of two threads would never match
+        with self._lock:
+            if self._version.con == None:
+                self._version.con = self._connect()
+            try:
+                r = self._version.con.execute("PRAGMA data_version;").fetchone()
+            except sqlite3.Error as e:
+                raise Exception(e)
+        return((r[0], self.writes))
+
+    def domain_cache_stats(self):
+        return({ 'hits': self.domain_hits, 'misses': self.domain_misses, 'size': len(self._conn.domains) })
+
+    def _cached_domain(self, name):
+        # zones rarely change but are looked up for nearly every record operation
+        self._check_data_version()
+        key = name.lower()
+        r = self._conn.domains.get(key, None)
+        if r != None:
+            self.domain_hits += 1
+        else:
+            self.domain_misses += 1
+            res = list(self.iter_domain(key))
+            if len(res) == 0:
+                return([])
+            r = res[0]
+            self._conn.domains[key] = r
+        # callers are free to modify what they get back
+        return([merge_dicts(dict(r), { 'options': dict(r['options']) })])
+
+    def _check_data_version(self):
+        # data_version only changes when another connection commits
+        r = self._query("PRAGMA data_version;", {})
+        version = r[0]['data_version']
+        if version != self._conn.data_version:
+            self._conn.domains.clear()
+            self._conn.data_version = version
+
+    def _iquery(self, sql, values, size=500):
+        # like _query but streams the rows from the cursor instead of building the whole list
+        if self.con == None:
+            raise Exception("not connected")
+        cur = self.con.cursor()
+        try:
+            try:
+                cur.execute(sql, values)
+            except sqlite3.Error as e:
+                raise Exception(e)
+            while True:
+                rows = cur.fetchmany(size)
+                if len(rows) == 0:
+                    break
+                for item in rows:
+                    yield {k: item[k] for k in item.keys()}
+        finally:
+            cur.close()
+
+    def _page(self, sql, where, values, order, keys, kwargs):
+        # keyset pagination, :after is the last row of the previous page
+        after = kwargs.get('after',None)
+        limit = kwargs.get('limit',None)
+        if after != None:
+            if isinstance(after, dict):
+                if keys[0] == "intvalue":
+                    after = [self._ip2num(after['value'])] + [after[k] for k in keys[1:]]
+                else:
+                    after = [after[k] for k in keys]
+            elif not isinstance(after, (list, tuple)):
+                after = [after]
+            if len(after) != len(keys):
+                raise Exception("after: expected {} values".format(len(keys)))
+            names = []
+            for i, v in enumerate(after):
+                values['after_{}'.format(i)] = v
+                names.append(':after_{}'.format(i))
+            where.append("({}) > ({})".format(order, ",".join(names)))
+        if len(where) > 0:
+            sql = sql+" WHERE "+" AND ".join(where)
+        sql = sql+" ORDER BY {} ASC".format(order.replace(",", " ASC,"))
+        if limit != None:
+            sql = sql+" LIMIT :limit"
+            values['limit'] = int(limit)
+        return(sql+";")
+
+    def _record(self, res, raw=False):
+        options = {}
+        if 'options' in res:
+            options = res['options'] if raw == True else self._unpack_options(res['options'])
+        return({ 'id': res['id'], 'fqdn': res['fqdn'], 'rr_type': res['rr_type'], 'value': res['value'], 'options': options })
+
+    def _chunks(self, items, size=500):
+        # keep IN (...) lists under the sqlite host parameter limit
+        for i in range(0, len(items), size):
+            yield items[i:i+size]
+
+    def _bulk_lookup(self, sql, keys):
+        found = {}
+        for chunk in self._chunks(list(keys)):
+            for res in self._query(sql.format(",".join("?"*len(chunk))), chunk):
+                found[res['key']] = res['id']
+        return(found)
+
+    def _bulk_insert(self, sql, values):
+        if self.con == None:
+            raise Exception("not connected")
+        cur = self.con.cursor()
+        try:
+            cur.executemany(sql, values)
+            if cur.rowcount > 0:
+                self.writes += 1
+        except sqlite3.Error as e:
+            raise Exception(e)
+        finally:
+            cur.close()
+
+    def _insert_rows(self, table, columns, rows):
+        # once a table has triggers every statement pays for a statement journal, so the rows go
+        # in as many at a time as the 999 host parameter limit of older sqlite versions allows
+        if self.con == None:
+            raise Exception("not connected")
+        size = max(1, 999 // len(columns))
+        sql = "INSERT INTO {} ({}) VALUES ".format(table, ",".join(columns))
+        row = "(" + ",".join("?"*len(columns)) + ")"
+        full = sql + ",".join([row]*size) + ";"
+        cur = self.con.cursor()
+        try:
+            for i in range(0, len(rows), size):
+                chunk = rows[i:i+size]
+                values = [ r[c] for r in chunk for c in columns ]
+                cur.execute(full if len(chunk) == size else sql + ",".join([row]*len(chunk)) + ";", values)
+            if len(rows) > 0:
+                self.writes += 1
+        except sqlite3.Error as e:
+            raise Exception(e)
+        finally:
+            cur.close()
+
+    def _bulk_domain(self, item):
+        # accepts a name, a (name, options) tuple or a dict like find_domain returns
+        if isinstance(item, str):
+            return(item, None)
+        if isinstance(item, dict):
+            return(item.get('fqdn'), item.get('options'))
+        item = list(item) + [None]
+        return(item[0], item[1])
+
+    def _bulk_record(self, item):
+        # accepts a (fqdn, rr_type, value[, options]) tuple or a dict like find_record returns
+        if isinstance(item, dict):
+            return(item.get('fqdn'), item.get('rr_type'), item.get('value'), item.get('options'))
+        item = list(item) + [None]
+        if len(item) < 4:
+            raise Exception("missing required argument")
+        return(item[0], item[1], item[2], item[3])
+
     def _fixup_values(self, rr_type, value):
         vals = {}
         if rr_type in ["A", "AAAA"]:
             vals['intvalue'] = self._ip2num(value)
+            vals['family'] = self._ipfamily(value)
         elif rr_type in ["CNAME", "MX", "NS", "SRV"]:
             value=value.lower()
             r = self.find_record(value)
@@ -433,21 +1198,39 @@ class db_sqlite3:
             opts = options
         else:
             return(vals)
-        if len(options) == 0:
+        if len(opts) == 0:
             return(vals)
+        if opts[0] == "{":
+            return(json.loads(opts))
+        # the old space separated key:value format
         for o in opts.split(" "):
-            (k,v) = o.split(":")
+            (k,v) = o.split(":",1)
             vals[k]=v
         return(vals)
 
     def _pack_options(self, options):
         # take a dict and make the option DB format
-        s=[]
         if not isinstance(options, dict):
-            return("")
-        for k in options.keys():
-            s.append("{}:{}".format(k,options[k]))
-        return(" ".join(s))
+            return("{}")
+        return(self.PACK_OPTIONS(options))
+
+    def _options_filter(self, where, values, kwargs):
+        # :options_filter is a dict of key: value or a list of (key, op, value) to match in sql
+        match = kwargs.get('options_filter',None)
+        if match == None:
+            return
+        if isinstance(match, dict):
+            match = [ (k, "=", v) for k, v in match.items() ]
+        for i, (key, op, value) in enumerate(match):
+            if op not in ["=", "!=", "<", "<=", ">", ">="]:
+                raise Exception("options_filter: unsupported operator {}".format(op))
+            column = "json_extract(options, :opt_key_{})".format(i)
+            # values may have been stored as strings, compare numbers as numbers
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                column = "CAST({} AS NUMERIC)".format(column)
+            where.append("{} {} :opt_val_{}".format(column, op, i))
+            values['opt_key_{}'.format(i)] = '$."{}"'.format(key)
+            values['opt_val_{}'.format(i)] = value
 
 # do not allow ourselved to be alled directly
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+from libipam.utils import *
+from libipam.export_bind import export_bind
+
+"""
+    changes from the journal as a dynamic update script instead of a full zone file
+
+    process(since=seq, format='nsupdate', domain=None, server=None, ttl=3600)
+        Returns every record change after :since as text for one of
+            nsupdate - an RFC 2136 script, one zone/update/send block per zone
+            unbound-control - unbound-control commands, one per line, each changed name is
+                removed with local_data_remove and its current records added back
+        :domain limits the output to that zone and its subdomains, :server adds a server line to
+        the nsupdate script.  Records without a ttl option get the ttl option of their domain,
+        the way the full export does, or :ttl.
+
+        last_seq is the journal position the output covers, pass it as :since next time.
+        reload is the list of zones that changed in ways an update can not express, SOA
+        options, new, renamed or deleted domains and delegations, plus apex changes for
+        unbound-control.  Those need a full export.  removed is the list of zones that were
+        deleted, the nsupdate script leaves them out and unbound-control only gets the
+        local_data_remove of their names.
+"""
+class export_delta:
+
+    FORMATS = [ 'nsupdate', 'unbound-control' ]
+
+    def __init__(self, *args, **kwargs):
+        self.db = args[0]
+        self.last_seq = None
+        self.reload = []
+        self.removed = []
+        self._parents = {}
+        self._zones = {}
+
+    def process(self, *args, **kwargs):
+        since = kwargs.get('since',None)
+        fmt = kwargs.get('format','nsupdate')
+        if self.db == None or since == None:
+            raise Exception("missing arguments")
+        if fmt not in self.FORMATS:
+            raise Exception("unsupported format")
+        domain = kwargs.get('domain',None)
+        ttl = kwargs.get('ttl',3600)
+        self.last_seq = int(since)
+        self.reload = []
+        self.removed = []
+        self._zones = {}
+        zones = {}
+        while True:
+            changes = self.db.changes_since(self.last_seq, limit=1000)
+            if len(changes) == 0:
+                break
+            for c in changes:
+                if c['table'] == "domains":
+                    for d in [c['old'], c['new']]:
+                        if d != None and (d['name'] not in self.reload) and self._in_domain(d['name'], domain):
+                            self.reload.append(d['name'])
+                elif c['table'] == "records":
+                    for (op, rec) in self._record_ops(c):
+                        (name, zone) = self.db._splitfqdn(rec['fqdn'])
+                        if not self._in_domain(zone, domain):
+                            continue
+                        zones.setdefault(zone, []).append((op, rec))
+                        if rec['rr_type'] == "NS":
+                            parent = self._parent(zone)
+                            if parent != None and parent not in self.reload and self._in_domain(parent, domain):
+                                self.reload.append(parent)
+            self.last_seq = changes[-1]['seq']
+        for zone in list(self.reload) + list(zones.keys()):
+            if zone not in self.removed and self._zone(zone) == None:
+                self.removed.append(zone)
+                if zone not in self.reload:
+                    self.reload.append(zone)
+        if fmt == "unbound-control":
+            return(self._unbound(zones, ttl))
+        return(self._nsupdate(zones, ttl, kwargs.get('server',None)))
+
+    def _nsupdate(self, zones, ttl, server):
+        file = []
+        if server != None:
+            file.append(f'server {server}')
+        for zone in zones.keys():
+            if zone in self.removed:
+                # the server would refuse an update to a zone it is about to lose
+                continue
+            file.append(f'zone {zone}.')
+            for (op, rec) in zones[zone]:
+                if op == "delete":
+                    file.append("update delete "+self._rr_data(rec, ""))
+                else:
+                    file.append("update add "+self._rr_data(rec, ttl))
+            file.append("send")
+        return("\n".join(file))
+
+    def _unbound(self, zones, ttl):
+        file = []
+        seen = set()
+        for zone in zones.keys():
+            for (op, rec) in zones[zone]:
+                if rec['fqdn'] in seen:
+                    continue
+                seen.add(rec['fqdn'])
+                if zone in self.removed:
+                    file.append("local_data_remove "+self._owner(rec['fqdn']))
+                    continue
+                if self.db._splitfqdn(rec['fqdn'])[0] == "@":
+                    # local_data_remove on the apex would take the SOA with it
+                    if zone not in self.reload:
+                        self.reload.append(zone)
+                    continue
+                file.append("local_data_remove "+self._owner(rec['fqdn']))
+                for r in self.db.find_record(rec['fqdn']):
+                    file.append("local_data "+self._rr_data(r, ttl))
+        return("\n".join(file))
+
+    def _record_ops(self, change):
+        # an update is a delete of the old data and an add of the new, unless the data is the same
+        old = change['old']
+        new = change['new']
+        if old != None and new != None and self._rr_data(old, "") == self._rr_data(new, "") \
+                and old['options'].get('ttl') == new['options'].get('ttl'):
+            return([])
+        ops = []
+        if old != None:
+            ops.append(("delete", old))
+        if new != None:
+            ops.append(("add", new))
+        return(ops)
+
+    def _rr_data(self, rec, ttl):
+        opts = rec['options'] if isinstance(rec['options'], dict) else {}
+        if ttl != "" and opts.get('ttl', rec.get('ttl')) != None:
+            ttl = opts['ttl'] if 'ttl' in opts else rec['ttl']
+        elif ttl != "":
+            dom = self._zone(self.db._splitfqdn(rec['fqdn'])[1])
+            if dom != None and dom['options'].get('ttl') != None:
+                ttl = dom['options']['ttl']
+        if not isinstance(rec['options'], dict):
+            rec = merge_dicts(dict(rec), { 'options': opts })
+        return(self._squash(export_bind.RENDER.render(rec, { 'ttl': ttl, 'name': self._owner(rec['fqdn']) })))
+
+    def _squash(self, line):
+        # drop the column padding in front of the rdata, the rdata itself is left alone
+        (pre, sep, post) = line.partition(" IN ")
+        return(" ".join(pre.split()) + sep + post)
+
+    def _owner(self, fqdn):
+        (name, domain) = self.db._splitfqdn(fqdn)
+        if name == "@":
+            return(domain+".")
+        return(fqdn+".")
+
+    def _zone(self, zone):
+        # the domain as it is now, None once it has been deleted
+        if zone not in self._zones:
+            found = self.db.find_domain(zone)
+            self._zones[zone] = found[0] if len(found) > 0 else None
+        return(self._zones[zone])
+
+    def _in_domain(self, zone, domain):
+        if domain == None:
+            return(True)
+        return(zone == domain or zone.endswith("."+domain))
+
+    def _parent(self, zone):
+        if zone not in self._parents:
+            parent = None
+            (name, up) = self.db._splitfqdn(zone)
+            while up != None and len(up) > 0:
+                if len(self.db.find_domain(up)) > 0:
+                    parent = up
+                    break
+                (name, up) = self.db._splitfqdn(up)
+            self._parents[zone] = parent
+        return(self._parents[zone])
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
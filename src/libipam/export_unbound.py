@@ -30,6 +30,7 @@
 #     SUCH DAMAGE.
 
 from libipam.utils import *
+from libipam.render import rr_render, rr_ttl, rr_fqdn
 
 class export_unbound:
 
@@ -55,64 +56,38 @@ class export_unbound:
             'TLSA':   "local-data: \"{fqdn:<25} {ttl:<6} IN {rr_type} {usage} {selector} {type} {value}\"",
             'XX':     "local-data: \"{fqdn:<25} {ttl:<6} IN {rr_type} {value}\""
     }
+    RENDER = rr_render(RR_FMT, derived={ 'ttl': rr_ttl, 'fqdn': rr_fqdn })
+    # first line of every reverse zone
+    REVERSE_HEADER = 'local-zone: "{zone}." static'
 
     def __init__(self, *args, **kwargs):
         self.db = args[0]
 
     def process(self, *args, **kwargs):
+        out = kwargs.get('out',None)
+        if out != None:
+            return write_lines(self.lines(*args, **kwargs), out)
+        return("\n".join(self.lines(*args, **kwargs)))
+
+    def lines(self, *args, **kwargs):
         domain = kwargs.get('domain',None)
         if self.db == None or domain == None:
             raise Exception("missing arguments")
-        file = []
-        domain_record = self.db.find_domain(domain)
-        resource_records = self.db.find_record("*."+domain)
-        subdomain_record = self.db.find_domain("*."+domain)
-        file.append(f'local-zone: "{domain}." static')
-        dom_r = domain_record[0]
-#        dom_r = dom_r | { 'rr_type': "SOA"}
-        dom_r = merge_dicts(dom_r,{ 'rr_type': "SOA"})
-        file.append(self._rr_print(dom_r))
-        ns_recs = extract_records("NS", resource_records)
-        mx_recs = extract_records("MX", resource_records)
-        resource_records = clear_records(["NS", "MS"], resource_records)
-        # add NS records
-        for r in ns_recs:
-            file.append(self._rr_print(r))
-        # add MX records
-        for r in resource_records:
-            file.append(self._rr_print(r))
-        # handle subdomains
-        for sub in subdomain_record:
-            save_ns=[]
-            sub_rr = self.db.find_record("*."+sub['fqdn'])
-            # only need to print the NS and A records for NS
-            ns_recs = extract_records("NS", sub_rr)
-            for r in ns_recs:
-                file.append(self._rr_print(r))
-                save_ns.append(r['value'])
-            # now go back thru and look for the NS A records
-            for i, r in enumerate(sub_rr):
-                if r['fqdn'] in save_ns:
-                    file.append(self._rr_print(r))
-        return("\n".join(file))
+        # :serial keeps the SOA serial of a zone that has not changed
+        serial = kwargs.get('serial',None)
+
+        # the domain, its subdomains and their records come from one ordered query
+        for (kind, r) in zone_export(self.db, domain):
+            if kind == "zone":
+                yield f'local-zone: "{domain}." static'
+            if kind != "subdomain":
+                yield self._rr_print(r, serial)
 
-    def _rr_print(self, kwargs):
-        rr_type = kwargs['rr_type']
-        opts = kwargs['options']
-#        kwargs = kwargs | opts
-        kwargs = merge_dicts(kwargs,opts)
-        if kwargs.get('ttl') == None:
-            kwargs['ttl'] = ""
-        (name, domain) = self.db._splitfqdn(kwargs['fqdn'])
-        if name == "@":
-            kwargs['fqdn'] = domain+"."
-        else:
-            kwargs['fqdn'] = kwargs['fqdn']+"."
-        if rr_type == "SOA":
-            kwargs['serial'] = gen_serial()
-        if self.RR_FMT[rr_type] != None:
-            str=self.RR_FMT[rr_type].format(**kwargs)
-        else:
-            str=self.RR_FMT['XX'].format(**kwargs)
-        return(str)
+    def process_reverse(self, *args, **kwargs):
+        return reverse_export(self.db, kwargs.get('reverse',None), self._rr_print, header=self.REVERSE_HEADER,
+                              soa=kwargs.get('soa',None))
 
+    def _rr_print(self, rec, serial=None):
+        if rec['rr_type'] == "SOA":
+            return self.RENDER.render(rec, { 'serial': serial if serial != None else gen_serial() })
+        return self.RENDER.render(rec)
@@ -0,0 +1,368 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import os
+from libipam.utils import *
+
+"""
+    bulk loader for RFC 1035 master files
+
+    import_zone(db, rr_opts=None)
+        :db is a database driver, :rr_opts the option fields by rr_type, ipam.RR_OPTS by default.
+
+    process(file=path, domain=None, batch=10000)
+        Streams the file, following $ORIGIN, $TTL and $INCLUDE and records that span lines in
+        ( ).  :domain is the zone, by default the owner of the SOA record.  The SOA creates the
+        domain when it does not exist yet, NS records below the zone create the delegated
+        subdomains with the SOA options of the zone.  The rdata is split into the option fields of ipam.RR_OPTS and the records
+        are added with add_records, :batch at a time.  CNAME/MX/NS/SRV records are added after
+        the rest so their targets exist.
+        Returns { 'domain': value, 'records': number added, 'errors': [ { 'line': 'file:n',
+        'fqdn': value, 'error': message } ] }
+"""
+class import_zone:
+
+    # the option fields in rdata order, whatever follows them is the value
+    FIELDS = {
+            'SOA':    ['mname', 'email', 'serial', 'refresh', 'retry', 'expire', 'ncache'],
+            'AFSDB':  ['subtype'],
+            'CAA':    ['flag', 'tag'],
+            'CERT':   ['type', 'tag', 'algo'],
+            'DS':     ['tag', 'algo', 'digest'],
+            'HIP':    ['algo', 'hit', 'key'],
+            'MX':     ['priority'],
+            'NAPTR':  ['order', 'perf', 'flag', 'service', 'regx'],
+            'RP':     ['mbox'],
+            'SRV':    ['priority', 'weight', 'port'],
+            'SSHFP':  ['algo', 'type'],
+            'TLSA':   ['usage', 'selector', 'type'],
+    }
+    # values that are domain names, the linked ones are stored like the fqdn of their target
+    NAMES = [ 'AFSDB', 'CNAME', 'DNAME', 'MX', 'NS', 'PTR', 'RP', 'SRV' ]
+    LINKED = [ 'CNAME', 'MX', 'NS', 'SRV' ]
+    CLASSES = [ 'IN', 'CH', 'HS', 'CS' ]
+    UNITS = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800 }
+
+    def __init__(self, *args, **kwargs):
+        self.db = args[0]
+        self.rr_opts = kwargs.get('rr_opts', None)
+        if self.rr_opts == None:
+            from libipam import ipam
+            self.rr_opts = ipam.RR_OPTS
+
+    def process(self, *args, **kwargs):
+        path = kwargs.get('file', None)
+        if self.db == None or path == None:
+            raise Exception("missing arguments")
+        zone = kwargs.get('domain', None)
+        zone = zone.lower().rstrip('.') if zone != None else None
+        size = int(kwargs.get('batch', 10000))
+        self.errors = []
+        self.added = 0
+        self.domains = set([ zone ]) if zone != None else set()
+        self.new_domains = []
+        self.zone = zone
+        self.soa = None
+        batch = []
+        linked = []
+        for (where, owner, ttl, rr_type, rdata) in self.records(path, origin=zone):
+            try:
+                if zone == None:
+                    if rr_type != "SOA":
+                        raise Exception("zone does not start with a SOA record")
+                    zone = owner
+                    self.zone = zone
+                    self.domains.add(zone)
+                if owner != zone and not owner.endswith("."+zone):
+                    raise Exception("out of zone")
+                if rr_type == "SOA":
+                    self._soa(zone, owner, ttl, rdata)
+                    continue
+                if rr_type == "NS" and owner != zone and owner not in self.domains:
+                    # a delegation, the subdomain holds the NS records
+                    self.domains.add(owner)
+                    self.new_domains.append(owner)
+                row = self._row(zone, owner, ttl, rr_type, rdata)
+            except Exception as e:
+                self._error(where, owner, str(e))
+                continue
+            if rr_type in self.LINKED:
+                linked.append((where, row))
+            else:
+                batch.append((where, row))
+                if len(batch) >= size:
+                    self._flush(batch)
+                    batch = []
+        self._flush(batch)
+        # linked records need their targets, retry the ones that point at later records
+        while len(linked) > 0:
+            missing = []
+            for i in range(0, len(linked), size):
+                missing.extend(self._flush(linked[i:i+size], retry=True))
+            if len(missing) == len(linked):
+                for (where, row, error) in missing:
+                    self._error(where, row[0], error)
+                break
+            linked = [ (where, row) for (where, row, error) in missing ]
+        return({ 'domain': zone, 'records': self.added, 'errors': self.errors })
+
+    def records(self, path, origin=None, ttl=None):
+        # yields ((file, line), owner, ttl, rr_type, [rdata]) for every record in the file
+        owner = origin
+        default_ttl = ttl
+        last_ttl = ttl
+        with open(path, 'r') as f:
+            tokens = []
+            depth = 0
+            start = None
+            blank = False
+            for lineno, line in enumerate(f, 1):
+                if depth == 0:
+                    blank = line[:1] in [" ", "\t"]
+                    start = lineno
+                parts = self._tokens(line)
+                if depth == 0 and "(" not in parts and ")" not in parts:
+                    tokens = parts
+                else:
+                    for t in parts:
+                        if t == "(" and not isinstance(t, _quoted):
+                            depth += 1
+                        elif t == ")" and not isinstance(t, _quoted):
+                            depth -= 1
+                        else:
+                            tokens.append(t)
+                if depth > 0 or len(tokens) == 0:
+                    continue
+                where = (path, start)
+                entry = tokens
+                tokens = []
+                if entry[0] == "$ORIGIN":
+                    origin = self._name(entry[1], origin)
+                    continue
+                if entry[0] == "$TTL":
+                    default_ttl = self._ttl(entry[1])
+                    continue
+                if entry[0] == "$INCLUDE":
+                    inc = entry[1] if os.path.isabs(entry[1]) else os.path.join(os.path.dirname(path), entry[1])
+                    # the origin and owner go back to what they were after the included file
+                    for r in self.records(inc, origin=self._name(entry[2], origin) if len(entry) > 2 else origin, ttl=default_ttl):
+                        yield(r)
+                    continue
+                if blank == False:
+                    owner = self._name(entry.pop(0), origin)
+                rr_ttl = None
+                while len(entry) > 0:
+                    if entry[0].upper() in self.CLASSES:
+                        entry.pop(0)
+                    elif entry[0][:1].isdigit():
+                        rr_ttl = self._ttl(entry.pop(0))
+                    else:
+                        break
+                if len(entry) == 0:
+                    continue
+                if rr_ttl == None:
+                    rr_ttl = default_ttl if default_ttl != None else last_ttl
+                last_ttl = rr_ttl
+                yield((where, owner, rr_ttl, entry[0].upper(), entry[1:]))
+
+    def _soa(self, zone, owner, ttl, rdata):
+        if owner != zone:
+            raise Exception("SOA is not at the zone apex")
+        options = self._options("SOA", rdata)
+        options['mname'] = self._name(options['mname'], zone)
+        options['email'] = self._name(options['email'], zone)
+        options['serial'] = int(options['serial'])
+        # stored as numbers like add_domain callers pass them, the timers can use units as well
+        for k in ['refresh', 'retry', 'expire', 'ncache']:
+            options[k] = self._ttl(options[k])
+        if ttl != None:
+            options['ttl'] = ttl
+        if len(self.db.find_domain(zone)) == 0:
+            self.db.add_domain(zone, options=options)
+            self.soa = options
+
+    def _row(self, zone, owner, ttl, rr_type, rdata):
+        fields = self.FIELDS.get(rr_type, None)
+        if rr_type == "LOC":
+            options = self._loc(rdata)
+            value = " ".join(rdata)
+        else:
+            options = self._options(rr_type, rdata) if fields != None else {}
+            value = rdata[len(fields):] if fields != None else rdata
+            if len(value) == 0:
+                raise Exception("missing rdata")
+            # the exporters put the TXT value in one pair of quotes
+            value = "\" \"".join(value) if rr_type == "TXT" else " ".join(value)
+        if rr_type in self.NAMES:
+            value = self._name(value, zone)
+            if rr_type not in self.LINKED:
+                value = value+"."
+        if ttl != None:
+            options['ttl'] = ttl
+        if rr_type in self.rr_opts:
+            for k in self.rr_opts[rr_type]['req']:
+                if k not in options:
+                    raise Exception("missing {}".format(k))
+        # the domain of a record is everything after the first label
+        if owner in self.domains:
+            owner = "@."+owner
+        return((owner, rr_type, value, options))
+
+    def _options(self, rr_type, rdata):
+        fields = self.FIELDS.get(rr_type, [])
+        if len(rdata) < len(fields):
+            raise Exception("missing rdata")
+        return(dict(zip(fields, rdata)))
+
+    def _loc(self, rdata):
+        # d [m [s]] N|S d [m [s]] E|W alt[m] [size[m] [hp[m] [vp[m]]]]
+        options = { 'ver': "0" }
+        rest = list(rdata)
+        for (key, ends) in [('lat', ["N", "S"]), ('long', ["E", "W"])]:
+            part = []
+            while len(rest) > 0 and rest[0].upper() not in ends:
+                part.append(rest.pop(0))
+            if len(rest) == 0:
+                raise Exception("missing rdata")
+            part.append(rest.pop(0).upper())
+            options[key] = " ".join(part)
+        for (key, default) in [('alt', None), ('size', "1m"), ('hor', "10000m"), ('vert', "10m")]:
+            if len(rest) > 0:
+                options[key] = rest.pop(0)
+            elif default == None:
+                raise Exception("missing rdata")
+            else:
+                options[key] = default
+        return(options)
+
+    def _flush(self, rows, retry=False):
+        # adds the rows in one add_records call, with :retry the rows whose target is missing
+        # are returned instead of being reported
+        if len(self.new_domains) > 0:
+            # delegations get the SOA options of the zone so they can be exported on their own
+            if self.soa == None:
+                d = self.db.find_domain(self.zone)
+                self.soa = d[0]['options'] if len(d) > 0 else {}
+            self.db.add_domains([ (name, dict(self.soa)) for name in self.new_domains ])
+            self.new_domains = []
+        if len(rows) == 0:
+            return([])
+        errors = self.db.add_records([ row for (where, row) in rows ])
+        missing = []
+        for e in errors:
+            (where, row) = rows[e['index']]
+            if retry == True and e['error'] == "could not find main record":
+                missing.append((where, row, e['error']))
+            else:
+                self._error(where, row[0], e['error'])
+        self.added += len(rows)-len(errors)
+        return(missing)
+
+    def _error(self, where, fqdn, error):
+        self.errors.append({ 'line': "{}:{}".format(where[0], where[1]), 'fqdn': fqdn, 'error': error })
+
+    def _name(self, name, origin):
+        if name == "@":
+            if origin == None:
+                raise Exception("no origin for @")
+            return(origin)
+        if name.endswith("."):
+            return(name[:-1].lower())
+        if origin == None:
+            raise Exception("no origin for relative name {}".format(name))
+        return((name+"."+origin).lower())
+
+    def _ttl(self, value):
+        if value.isdigit():
+            return(int(value))
+        # BIND style 1h30m
+        total = 0
+        num = ""
+        for c in value.lower():
+            if c.isdigit():
+                num += c
+            elif c in self.UNITS and len(num) > 0:
+                total += int(num)*self.UNITS[c]
+                num = ""
+            else:
+                raise Exception("not valid ttl {}".format(value))
+        return(total+int(num or 0))
+
+    def _tokens(self, line):
+        # plain lines are split directly, only quotes and escapes need the character walk
+        if line.find('"') == -1 and line.find('\\') == -1:
+            line = line.split(';', 1)[0]
+            if line.find('(') == -1 and line.find(')') == -1:
+                return(line.split())
+            return(line.replace('(', ' ( ').replace(')', ' ) ').split())
+        tokens = []
+        cur = None
+        quoted = False
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if c == '\\' and i+1 < len(line):
+                cur = (cur or "") + line[i:i+2]
+                i += 2
+                continue
+            if quoted:
+                if c == '"':
+                    tokens.append(_quoted(cur or ""))
+                    cur = None
+                    quoted = False
+                else:
+                    cur = (cur or "") + c
+            elif c == '"':
+                if cur != None:
+                    tokens.append(cur)
+                cur = ""
+                quoted = True
+            elif c == ';':
+                break
+            elif c in " \t\r\n()":
+                if cur != None:
+                    tokens.append(cur)
+                    cur = None
+                if c in "()":
+                    tokens.append(c)
+            else:
+                cur = (cur or "") + c
+            i += 1
+        if cur != None:
+            tokens.append(_quoted(cur) if quoted else cur)
+        return(tokens)
+
+class _quoted(str):
+    # a token that was in quotes, so "(" in it is not a parenthesis
+    pass
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
@@ -0,0 +1,165 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import ipaddress
+import socket
+
+"""
+    in-memory longest prefix match index
+
+    prefix_trie()
+        Binary trie of network prefixes, one per address family, plus a table of host addresses.
+
+    insert(network/bitmask, value) / delete(network/bitmask)
+        Add or remove a prefix.  :value is returned by longest_match.
+
+    add_host(address, value) / remove_host(address, value)
+        Add or remove a value for an exact address.  Dict values with an 'id' are removed by id.
+
+    longest_match(address)
+        Returns { 'address': value, 'network': value of the longest matching prefix or None,
+        'records': [ values stored for the exact address ] }
+
+    match_many(addresses)
+        longest_match for every address in the iterable, repeated addresses are only looked up once
+
+    load(db)
+        Fills the index from a database driver, using find_subnet for the prefixes and
+        iter_network for the A/AAAA records.
+"""
+class prefix_trie:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # a node is [child for bit 0, child for bit 1, value, has value]
+        self.roots = { 4: [None, None, None, False], 6: [None, None, None, False] }
+        self.hosts = {}
+        self.networks = 0
+
+    def insert(self, network, value):
+        net = ipaddress.ip_network(network, strict=False)
+        bits = net.max_prefixlen
+        num = int(net.network_address)
+        node = self.roots[net.version]
+        for i in range(net.prefixlen):
+            bit = (num >> (bits-1-i)) & 1
+            if node[bit] == None:
+                node[bit] = [None, None, None, False]
+            node = node[bit]
+        if node[3] == False:
+            self.networks += 1
+        node[2] = value
+        node[3] = True
+
+    def delete(self, network):
+        net = ipaddress.ip_network(network, strict=False)
+        bits = net.max_prefixlen
+        num = int(net.network_address)
+        path = []
+        node = self.roots[net.version]
+        for i in range(net.prefixlen):
+            bit = (num >> (bits-1-i)) & 1
+            if node[bit] == None:
+                return(False)
+            path.append((node, bit))
+            node = node[bit]
+        if node[3] == False:
+            return(False)
+        node[2] = None
+        node[3] = False
+        self.networks -= 1
+        # prune the branches that no longer lead anywhere
+        while len(path) > 0 and node[0] == None and node[1] == None and node[3] == False:
+            (parent, bit) = path.pop()
+            parent[bit] = None
+            node = parent
+        return(True)
+
+    def add_host(self, address, value):
+        addr = ipaddress.ip_address(address)
+        self.hosts.setdefault((addr.version, int(addr)), []).append(value)
+
+    def remove_host(self, address, value):
+        addr = ipaddress.ip_address(address)
+        key = (addr.version, int(addr))
+        vals = self.hosts.get(key, [])
+        # rows from the database are matched on their id
+        if isinstance(value, dict) and 'id' in value:
+            vals[:] = [ v for v in vals if not (isinstance(v, dict) and v.get('id') == value['id']) ]
+        elif value in vals:
+            vals.remove(value)
+        if len(vals) == 0:
+            self.hosts.pop(key, None)
+
+    def longest_match(self, address):
+        (version, num) = self._parse(address)
+        shift = (32 if version == 4 else 128)-1
+        node = self.roots[version]
+        best = node[2] if node[3] else None
+        while shift >= 0:
+            node = node[(num >> shift) & 1]
+            if node == None:
+                break
+            if node[3]:
+                best = node[2]
+            shift -= 1
+        return({ 'address': address, 'network': best, 'records': list(self.hosts.get((version, num), [])) })
+
+    def match_many(self, addresses):
+        seen = {}
+        ret = []
+        for address in addresses:
+            r = seen.get(address, None)
+            if r == None:
+                r = seen[address] = self.longest_match(address)
+            ret.append(r)
+        return(ret)
+
+    def _parse(self, address):
+        # inet_pton is several times faster than ipaddress for the common string case
+        try:
+            if isinstance(address, str):
+                if address.find(':') == -1:
+                    return(4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big'))
+                return(6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big'))
+        except OSError:
+            pass
+        addr = ipaddress.ip_address(address)
+        return(addr.version, int(addr))
+
+    def load(self, db):
+        self.clear()
+        if hasattr(db, 'find_subnet'):
+            for net in db.find_subnet(None):
+                self.insert(net['network'], net)
+        for network in ['0.0.0.0/0', '::/0']:
+            for rec in db.iter_network(network):
+                self.add_host(rec['value'], rec)
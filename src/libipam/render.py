@@ -0,0 +1,118 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import re
+import string
+import linecache
+
+"""
+    compiled record templates shared by the exporters
+
+    rr_render(formats, default='XX', derived={})
+        Compiles every template of a RR_FMT style dict of { rr_type: str.format template } once
+        into a function built around an f-string, so rendering a record does not parse the
+        template again or build a merged dict.  Unknown rr_types use the :default template.
+        :derived is { field: function(options, record) } for fields that are worked out from
+        the record, the function is only called when a template uses the field.
+
+    render(record, fields={})
+        Returns the line for a record dict like find_record returns.  A template field is
+        looked up in :fields first, then :derived, then the record options, then the record
+        itself.  A field that is in none of them raises an exception naming the record and the
+        field.
+
+    rr_ttl(options, record) / rr_fqdn(options, record)
+        Derived fields for the exporters.  The ttl option, or "" so the zone default applies, and
+        the absolute owner name with the apex as the domain name.
+"""
+class rr_render:
+    def __init__(self, formats, default='XX', derived={}):
+        self.formats = formats
+        self.default = default
+        self.derived = derived
+        self.renderers = {}
+        for (rr_type, fmt) in formats.items():
+            if fmt != None:
+                self.renderers[rr_type] = self._compile(rr_type, fmt)
+        self.fallback = self.renderers[default]
+
+    def render(self, record, fields={}):
+        rr_type = record['rr_type']
+        func = self.renderers.get(rr_type) or self.fallback
+        try:
+            return func(fields, record['options'], record)
+        except KeyError as e:
+            raise Exception("{} record {}: missing field {}".format(rr_type, record.get('fqdn', None), e.args[0]))
+
+    def _compile(self, rr_type, fmt):
+        # each field becomes (fields[k] if k in fields else options[k] if k in options else record[k])
+        parts = []
+        scope = {}
+        for (literal, field, spec, conversion) in string.Formatter().parse(fmt):
+            if literal:
+                parts.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field == None:
+                continue
+            if spec != None and spec.find("{") != -1:
+                raise Exception("nested fields are not supported: {}".format(fmt))
+            # the names are bound in the scope so the f-string needs no quotes of its own, and
+            # passed in as defaults so they are local variables rather than global lookups
+            key = "k{}".format(len(scope))
+            scope[key] = field
+            if field in self.derived:
+                scope["d"+key] = self.derived[field]
+                expr = "(f[{0}] if {0} in f else d{0}(o, r))".format(key)
+            else:
+                expr = "(f[{0}] if {0} in f else o[{0}] if {0} in o else r[{0}])".format(key)
+            if conversion == None and spec != None and re.match(r'^<[0-9]+$', spec):
+                # plain left alignment, ljust is about twice as quick as a format spec
+                parts.append("{str(" + expr + ").ljust(" + spec[1:] + ")}")
+            else:
+                parts.append("{" + expr + ("!"+conversion if conversion else "") + (":"+spec if spec else "") + "}")
+        args = "".join(", {0}={0}".format(k) for k in scope.keys())
+        code = "def _render(f, o, r" + args + "):\n    return f" + repr("".join(parts)) + "\n"
+        # the source goes in linecache so a traceback through it shows the generated line, the
+        # template is in the name because the exporters share rr_types but not templates
+        filename = "<rr_render {} {}>".format(rr_type, fmt)
+        linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+        exec(compile(code, filename, "exec"), scope)
+        return(scope['_render'])
+
+def rr_ttl(options, record):
+    ttl = options['ttl'] if 'ttl' in options else record.get('ttl')
+    return(ttl if ttl != None else "")
+
+def rr_fqdn(options, record):
+    (name, sep, domain) = record['fqdn'].partition('.')
+    return(domain+"." if name == "@" else record['fqdn']+".")
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
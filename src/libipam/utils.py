@@ -28,9 +28,13 @@
 #     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 #     SUCH DAMAGE.
 
+import os
+import json
 import time
+import hashlib
+import ipaddress
 
-__all__ = [ 'merge_dicts', 'gen_serial', 'clear_records', 'extract_records', 'rr_cmp' ]
+__all__ = [ 'merge_dicts', 'gen_serial', 'clear_records', 'extract_records', 'rr_cmp', 'reverse_zones', 'reverse_records', 'reverse_soa', 'reverse_export', 'write_lines', 'zone_export', 'zone_hash' ]
 
 def merge_dicts(d1, d2):
     out = d1
@@ -83,3 +87,167 @@ def rr_cmp(record_a, record_b):
         else:
             return 0
 
+"""
+reverse_zones(network)
+
+return an array of (zone, network) covering the network, split on octet (IPv4) or nibble
+(IPv6) boundaries, e.g. 10.0.0.0/20 is 16 /24 zones 0.0.10.in-addr.arpa to 15.0.10.in-addr.arpa
+a network smaller than the last boundary, e.g. a /26, is returned in its enclosing zone
+"""
+def reverse_zones(network):
+    net = ipaddress.ip_network(network, strict=False)
+    step = 8 if net.version == 4 else 4
+    plen = max(step, -(-net.prefixlen // step) * step)
+    if plen > net.max_prefixlen - step:
+        plen = max(step, net.prefixlen // step * step)
+    ret=[]
+    for sub in net.subnets(new_prefix=plen) if plen >= net.prefixlen else [net]:
+        labels = sub.network_address.reverse_pointer.split(".")
+        # reverse_pointer names the first address, keep the labels above the zone cut
+        ret.append((".".join(labels[(sub.max_prefixlen - plen) // step:]), sub))
+    return(ret)
+
+"""
+reverse_records(db, network, zone)
+
+return a generator of PTR records for the A/AAAA records in the network, in address order,
+with the fqdn in the zone and the ttl taken from the address record
+"""
+def reverse_records(db, network, zone):
+    for r in db.iter_network(network):
+        if r['rr_type'] not in ["A", "AAAA"]:
+            continue
+        if r['rr_type'] == "A":
+            fqdn = ".".join(reversed(r['value'].split(".")))+".in-addr.arpa"
+        else:
+            fqdn = ipaddress.ip_address(r['value']).reverse_pointer
+        target = r['fqdn'][2:] if r['fqdn'].startswith("@.") else r['fqdn']
+        opts = {}
+        if r['options'].get('ttl') != None:
+            opts['ttl'] = r['options']['ttl']
+        yield({ 'fqdn': fqdn, 'name': fqdn[:-len(zone)-1], 'rr_type': "PTR", 'value': target+".", 'options': opts })
+
+"""
+reverse_soa(db, zone, soa)
+
+return the SOA and NS records for a reverse zone, from the database when the zone is a domain
+there, otherwise from the soa dict of SOA options with the name servers in 'ns'
+"""
+def reverse_soa(db, zone, soa=None):
+    dom = db.find_domain(zone)
+    if len(dom) > 0:
+        ns_recs = [ r for r in extract_records("NS", db.find_record("*."+zone)) if r['fqdn'] == "@."+zone ]
+        return(merge_dicts(dom[0], { 'rr_type': "SOA" }), ns_recs)
+    if soa == None:
+        raise Exception("no SOA for reverse zone {}".format(zone))
+    opts = { k: v for k, v in soa.items() if k != 'ns' }
+    ns_recs = [ { 'fqdn': "@."+zone, 'rr_type': "NS", 'value': ns, 'options': {} } for ns in soa.get('ns',[]) ]
+    return({ 'fqdn': zone, 'rr_type': "SOA", 'value': None, 'options': opts }, ns_recs)
+
+"""
+reverse_export(db, reverse, rr_print, header=None, soa=None)
+
+return { zone: text } for the reverse zones covering the reverse network, each one the SOA, the
+NS and the PTR records formatted by rr_print.  header is a format string for the line that
+starts every zone, {zone} is the zone name.  soa is passed to reverse_soa
+"""
+def reverse_export(db, reverse, rr_print, header=None, soa=None):
+    if db == None or reverse == None:
+        raise Exception("missing arguments")
+    zones = {}
+    # one ordered range scan per zone
+    for (zone, net) in reverse_zones(reverse):
+        file = []
+        (soa_r, ns_recs) = reverse_soa(db, zone, soa)
+        if header != None:
+            file.append(header.format(zone=zone))
+        file.append(rr_print(soa_r))
+        for r in ns_recs:
+            file.append(rr_print(r))
+        for r in reverse_records(db, net, zone):
+            file.append(rr_print(r))
+        zones[zone] = "\n".join(file)
+    return(zones)
+
+"""
+write_lines(lines, out)
+
+write the lines from an iterable to a file object, or to a file name through a temporary file
+that is renamed over it once everything is written.  returns the number of lines
+"""
+def write_lines(lines, out):
+    if not isinstance(out, str):
+        count = 0
+        for l in lines:
+            out.write(l+"\n")
+            count += 1
+        return(count)
+    tmp = "{}.tmp.{}".format(out, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            count = write_lines(lines, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, out)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return(count)
+
+"""
+zone_export(db, domain)
+
+return a generator of (kind, row) for an export of the domain, kind is 'zone' for the domain,
+'subdomain' for each subdomain and 'record' for the records to print.  the domain records come
+NS first, for a subdomain only its NS records and the records those name are returned.  uses
+db.iter_zone when the driver has it, otherwise the equivalent find_* calls
+"""
+def zone_export(db, domain):
+    rows = db.iter_zone(domain) if hasattr(db, 'iter_zone') else _zone_rows(db, domain)
+    found = False
+    save_ns = []
+    for r in rows:
+        if 'serial' in r:
+            # the domain and its subdomains start their sections
+            if r['zone'] == domain.lower():
+                found = True
+                yield("zone", r)
+            elif found == False:
+                break
+            else:
+                save_ns = []
+                yield("subdomain", r)
+        elif r['zone'] == domain.lower():
+            yield("record", r)
+        elif r['rr_type'] == "NS":
+            save_ns.append(r['value'])
+            yield("record", r)
+        elif r['fqdn'] in save_ns:
+            yield("record", r)
+    if found == False:
+        raise Exception("domain does not exist")
+
+def _zone_rows(db, domain):
+    for d in db.find_domain(domain) + db.find_domain("*."+domain):
+        yield(merge_dicts(d, { 'zone': d['fqdn'] }))
+        recs = db.find_record("*."+d['fqdn'])
+        for r in recs:
+            if r['rr_type'] == "NS":
+                yield(merge_dicts(r, { 'zone': d['fqdn'] }))
+        for r in recs:
+            if r['rr_type'] != "NS":
+                yield(merge_dicts(r, { 'zone': d['fqdn'] }))
+
+"""
+zone_hash(db, domain)
+
+return a sha256 hex digest of what zone_export returns for the domain, without the domain serial
+and the ids, so it only changes when the exported zone would
+"""
+def zone_hash(db, domain):
+    h = hashlib.sha256()
+    for (kind, r) in zone_export(db, domain):
+        h.update(json.dumps([kind, r['fqdn'], r['rr_type'], r['value'], r['options']], sort_keys=True, separators=(',',':')).encode('utf-8'))
+        h.update(b"\n")
+    return(h.hexdigest())
@@ -0,0 +1,658 @@
+#
+# Copyright 2022 Michael Graves <mg@brainfat.net>
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice,
+#        this list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright
+#        notice, this list of conditions and the following disclaimer in the
+#        documentation and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#     "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+#     TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#     A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#     HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#     SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#     LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+#     USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+#     ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+#     OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#     SUCH DAMAGE.
+
+import asyncio
+import concurrent.futures
+import threading
+import ipaddress
+import socket
+import struct
+import base64
+import json
+from libipam.db_sqlite3 import db_sqlite3
+from libipam.utils import *
+
+"""
+    asyncio zone transfer server for a db_sqlite3 database
+
+    xfr_server(dbfile, host='127.0.0.1', port=53, allow=['127.0.0.0/8', '::1/128'], workers=4,
+               ttl=3600, timeout=30)
+        Answers AXFR, IXFR and SOA queries over TCP, and SOA queries over UDP, for every domain in
+        the database.  Only clients in the :allow networks get an answer, the rest get REFUSED.
+        The database is opened read only with a connection per worker thread.  Records without
+        a ttl option get the ttl option of their domain, or :ttl.  A TCP connection that sends
+        nothing, or only part of a query, for :timeout seconds is closed.
+
+        The SOA serial of a zone is the position of the newest journal entry that touched the
+        zone or one of its subdomains (zone_changes), so a secondary's serial says which changes
+        it has seen and a change to another zone leaves it alone.  Entries that were pruned count
+        as changes to every zone.  IXFR sends the difference from the journal when it has every
+        change after the secondary's serial and none of them touch a subdomain or the domain
+        itself, otherwise the full zone is sent like AXFR.  These serials are not the ones
+        export_all(manifest=...) writes to zone files, a zone should be served from one or the
+        other.
+
+        A transfer reads the zone in one transaction and encodes the rows to wire format as the
+        cursor returns them, a message at a time, on a worker thread.  Use a WAL database or a
+        long transfer holds off writers.
+
+    await start()
+        Binds the sockets, with port=0 the port picked is in self.port afterwards.
+
+    await serve_forever() / await close()
+        Runs until cancelled, and shuts the server, the workers and the database down.
+"""
+
+class xfr_server:
+    TYPES = { 'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'RP': 17,
+              'AFSDB': 18, 'AAAA': 28, 'LOC': 29, 'SRV': 33, 'NAPTR': 35, 'CERT': 37, 'DNAME': 39,
+              'DS': 43, 'SSHFP': 44, 'DCHID': 49, 'TLSA': 52, 'HIP': 55, 'CAA': 257 }
+    IXFR = 251
+    AXFR = 252
+    # rcodes
+    FORMERR = 1
+    SERVFAIL = 2
+    NOTAUTH = 9
+    NOTIMP = 4
+    REFUSED = 5
+    # messages are cut at this size, well under the 64k limit so one large record still fits
+    MESSAGE_SIZE = 16384
+
+    def __init__(self, *args, **kwargs):
+        self.dbfile = args[0]
+        self.host = kwargs.get('host', "127.0.0.1")
+        self.port = int(kwargs.get('port', 53))
+        self.allow = [ ipaddress.ip_network(a) for a in kwargs.get('allow', ['127.0.0.0/8', '::1/128']) ]
+        self.ttl = int(kwargs.get('ttl', 3600))
+        self.timeout = kwargs.get('timeout', 30)
+        self.workers = int(kwargs.get('workers', 4))
+        self.db = db_sqlite3(self.dbfile, pooled=True, readonly=True)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="xfr")
+        self.server = None
+        self.udp = None
+        self.udp_protocol = None
+        # stop events of the transfers in progress, and the tasks of the open connections
+        self.active = set()
+        self.clients = set()
+        # newest journal entry per domain name and its ancestors, up to journal position :scanned
+        self.touched = {}
+        self.scanned = None
+        self.lock = threading.Lock()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        # UDP goes on the port TCP got, which matters with port=0
+        self.port = self.server.sockets[0].getsockname()[1]
+        (self.udp, self.udp_protocol) = await loop.create_datagram_endpoint(lambda: _udp_protocol(self), local_addr=(self.host, self.port))
+        return(self)
+
+    async def serve_forever(self):
+        if self.server == None:
+            await self.start()
+        await self.server.serve_forever()
+
+    async def close(self):
+        if self.server != None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.udp != None:
+            self.udp.close()
+        for stop in list(self.active):
+            stop.set()
+        clients = list(self.clients)
+        if self.udp_protocol != None:
+            clients += list(self.udp_protocol.tasks)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        # the loop has to keep running while the workers finish, they hand it their messages
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown, True)
+        self.db.close()
+
+    async def _client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readexactly(2), timeout=self.timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                try:
+                    query = await asyncio.wait_for(reader.readexactly(struct.unpack("!H", head)[0]), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    break
+                if await self._transfer(query, peer, writer) == False:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # cancelled by close()
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _transfer(self, query, peer, writer):
+        # the messages are made on a worker thread and written here, the queue keeps the
+        # worker at most a few messages ahead of the client
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=4)
+        stop = threading.Event()
+        self.active.add(stop)
+        def put(item):
+            # gives up once the transfer is over, nothing empties the queue then
+            try:
+                fut = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:
+                return(False)
+            while not stop.is_set():
+                try:
+                    fut.result(timeout=0.5)
+                    return(True)
+                except concurrent.futures.TimeoutError:
+                    pass
+            fut.cancel()
+            return(False)
+        def produce():
+            messages = self.messages(query, peer)
+            try:
+                for msg in messages:
+                    if not put(msg):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+            finally:
+                # ends the read transaction on this thread
+                messages.close()
+        loop.run_in_executor(self.executor, produce)
+        sent = 0
+        try:
+            while True:
+                msg = await queue.get()
+                if msg == None:
+                    return(True)
+                if isinstance(msg, Exception):
+                    # part of a transfer is worse than none, drop the connection
+                    if sent > 0:
+                        return(False)
+                    msg = self._error(query, self.SERVFAIL)
+                    if msg == None:
+                        return(False)
+                writer.write(struct.pack("!H", len(msg)) + msg)
+                await writer.drain()
+                sent += 1
+        finally:
+            stop.set()
+            self.active.discard(stop)
+
+    def messages(self, query, peer, udp=False):
+        # runs on a worker thread, yields the response messages for :query
+        try:
+            (qid, flags, qname, qtype, qclass, serial) = self._parse(query)
+        except Exception:
+            msg = self._error(query, self.FORMERR)
+            if msg != None:
+                yield(msg)
+            return
+        question = (qid, flags, qname, qtype, qclass)
+        if (flags >> 11) & 0xf != 0:
+            yield(self._reply(question, self.NOTIMP).finish())
+            return
+        if not self._allowed(peer):
+            yield(self._reply(question, self.REFUSED).finish())
+            return
+        if qtype not in [self.AXFR, self.IXFR, self.TYPES['SOA']] or qclass not in [1, 255] or (udp and qtype == self.AXFR):
+            yield(self._reply(question, self.REFUSED if qtype != self.AXFR else self.FORMERR).finish())
+            return
+        zone = qname.lower()
+        with self.db.transaction():
+            domains = self.db.find_domain(zone)
+            if len(domains) == 0:
+                yield(self._reply(question, self.NOTAUTH).finish())
+                return
+            soa = domains[0]
+            current = self._serial(zone) & 0xffffffff
+            ttl = soa['options'].get('ttl', self.ttl)
+            if qtype == self.TYPES['SOA'] or (qtype == self.IXFR and (udp or self._newer(serial, current))):
+                # up to date, or IXFR over UDP which only ever gets the SOA
+                for m in self._reply(question).soa(soa, current, ttl, last=True):
+                    yield(m)
+                return
+            diff = None
+            if qtype == self.IXFR:
+                diff = self._ixfr_diff(zone, soa, serial, current)
+            msg = self._reply(question)
+            for m in msg.soa(soa, current, ttl):
+                yield(m)
+            if diff != None:
+                (deleted, added) = diff
+                for m in msg.soa(soa, serial, ttl):
+                    yield(m)
+                for r in deleted:
+                    for m in msg.record(r, ttl):
+                        yield(m)
+                for m in msg.soa(soa, current, ttl):
+                    yield(m)
+                for r in added:
+                    for m in msg.record(r, ttl):
+                        yield(m)
+            else:
+                for (kind, r) in zone_export(self.db, zone):
+                    if kind == "record":
+                        for m in msg.record(r, ttl):
+                            yield(m)
+            for m in msg.soa(soa, current, ttl, last=True):
+                yield(m)
+
+    def _serial(self, zone):
+        # the zone's serial as of this thread's read transaction, see the docstring
+        last = self.db.last_change()
+        first = self.db.changes_since(0, limit=1)
+        floor = first[0]['seq']-1 if len(first) > 0 else last
+        with self.lock:
+            if self.scanned == None or last > self.scanned:
+                for (name, seq) in self.db.zone_changes(self.scanned, until=last).items():
+                    labels = name.split('.')
+                    for i in range(len(labels)):
+                        suffix = ".".join(labels[i:])
+                        self.touched[suffix] = max(self.touched.get(suffix, 0), seq)
+                self.scanned = last
+            seq = self.touched.get(zone, 0)
+        if seq > last:
+            # another worker scanned changes this transaction does not see, work it out from the start
+            seq = 0
+            for (name, s) in self.db.zone_changes(floor, until=last).items():
+                if name == zone or name.endswith("."+zone):
+                    seq = max(seq, s)
+        return(max(seq, floor))
+
+    def _ixfr_diff(self, zone, soa, serial, current):
+        # returns ([deleted], [added]) from the journal, or None when the full zone has to go
+        first = self.db.changes_since(serial, limit=1)
+        if len(first) == 0 or first[0]['seq'] != serial+1:
+            # pruned, or a serial this database never had
+            return(None)
+        subs = set([ d['id'] for d in self.db.find_domain("*."+zone) ])
+        deleted = {}
+        added = {}
+        seq = serial
+        while seq < current:
+            changes = self.db.changes_since(seq, limit=1000)
+            if len(changes) == 0:
+                break
+            for c in changes:
+                seq = c['seq']
+                if seq > current:
+                    break
+                if c['table'] == "domains":
+                    for row in [c['old'], c['new']]:
+                        if row != None and (row['id'] == soa['id'] or row['id'] in subs or row['name'] == zone or row['name'].endswith("."+zone)):
+                            return(None)
+                    continue
+                if c['table'] != "records":
+                    continue
+                for (row, add) in [(c['old'], False), (c['new'], True)]:
+                    if row == None:
+                        continue
+                    if row['domain_id'] in subs:
+                        return(None)
+                    if row['domain_id'] != soa['id']:
+                        continue
+                    key = json.dumps([row['fqdn'], row['rr_type'], row['value'], row['options']], sort_keys=True)
+                    # an add and a delete of the same record cancel out
+                    (this, other) = (added, deleted) if add else (deleted, added)
+                    if key in other:
+                        other.pop(key)
+                    else:
+                        this[key] = row
+        return((list(deleted.values()), list(added.values())))
+
+    def _newer(self, serial, current):
+        # RFC 1982 serial arithmetic, true when :serial is the same as or after :current
+        return(serial == current or 0 < ((serial - current) & 0xffffffff) < 0x80000000)
+
+    def _allowed(self, peer):
+        try:
+            addr = ipaddress.ip_address(peer[0])
+        except Exception:
+            return(False)
+        for net in self.allow:
+            if addr.version == net.version and addr in net:
+                return(True)
+        return(False)
+
+    def _parse(self, data):
+        (qid, flags, qdcount, ancount, nscount, arcount) = struct.unpack("!HHHHHH", data[:12])
+        if qdcount != 1:
+            raise Exception("one question expected")
+        (qname, pos) = _read_name(data, 12)
+        (qtype, qclass) = struct.unpack("!HH", data[pos:pos+4])
+        pos += 4
+        serial = None
+        if qtype == self.IXFR:
+            # the secondary's SOA is in the authority section
+            for i in range(ancount + nscount):
+                (name, pos) = _read_name(data, pos)
+                (rtype, rclass, rttl, rdlen) = struct.unpack("!HHIH", data[pos:pos+10])
+                pos += 10
+                if rtype == self.TYPES['SOA']:
+                    (mname, p) = _read_name(data, pos)
+                    (rname, p) = _read_name(data, p)
+                    serial = struct.unpack("!I", data[p:p+4])[0]
+                pos += rdlen
+            if serial == None:
+                raise Exception("IXFR without SOA")
+        return((qid, flags, qname, qtype, qclass, serial))
+
+    def _reply(self, question, rcode=0):
+        return(_message(self, question, rcode))
+
+    def _error(self, query, rcode):
+        # an answer to a query that may not even parse, None when there is not an id to answer
+        if len(query) < 12:
+            return(None)
+        (qid, flags) = struct.unpack("!HH", query[:4])
+        return(struct.pack("!HHHHHH", qid, 0x8000 | (flags & 0x7900) | rcode, 0, 0, 0, 0))
+
+class _message:
+    # builds the response messages, each RR is encoded in place so names can be compressed
+    CERT_TYPES = { 'PKIX': 1, 'SPKI': 2, 'PGP': 3, 'IPKIX': 4, 'ISPKI': 5, 'IPGP': 6, 'ACPKIX': 7, 'IACPKIX': 8, 'URI': 253, 'OID': 254 }
+
+    def __init__(self, server, question, rcode=0):
+        self.server = server
+        self.question = question
+        self.rcode = rcode
+        self.first = True
+        self._start()
+
+    def _start(self):
+        (qid, flags, qname, qtype, qclass) = self.question
+        self.buf = bytearray(12)
+        self.names = {}
+        self.count = 0
+        # the question only goes in the first message of a transfer
+        self.qdcount = 1 if self.first else 0
+        if self.first:
+            self.name(qname)
+            self.buf += struct.pack("!HH", qtype, qclass)
+
+    def finish(self):
+        (qid, flags, qname, qtype, qclass) = self.question
+        flags = 0x8000 | (flags & 0x7900) | (0x0400 if self.rcode == 0 else 0) | self.rcode
+        self.buf[0:12] = struct.pack("!HHHHHH", qid, flags, self.qdcount, self.count, 0, 0)
+        msg = bytes(self.buf)
+        self.first = False
+        self._start()
+        return(msg)
+
+    def soa(self, soa, serial, ttl, last=False):
+        o = soa['options']
+        def rdata():
+            self.name(_absolute(o['mname']))
+            self.name(_absolute(o['email'].replace('@', '.')))
+            self.buf += struct.pack("!IIIII", serial, int(o['refresh']), int(o['retry']), int(o['expire']), int(o['ncache']))
+        out = self._rr(soa['fqdn'], 'SOA', ttl, rdata)
+        if last:
+            out.append(self.finish())
+        return(out)
+
+    def record(self, r, default_ttl):
+        # returns the finished messages, normally none
+        o = r['options'] if r['options'] != None else {}
+        (name, sep, domain) = r['fqdn'].partition('.')
+        # reverse records carry their name relative to the zone, it can have more than one label
+        name = o.get('name', name)
+        owner = domain if name == "@" else name+"."+domain
+        return(self._rr(owner, r['rr_type'], o.get('ttl', default_ttl), lambda: self.rdata(r['rr_type'], r['value'], o)))
+
+    def _rr(self, owner, rr_type, ttl, rdata):
+        if rr_type not in self.server.TYPES:
+            raise Exception("cannot encode {} records".format(rr_type))
+        out = []
+        for attempt in [1, 2]:
+            mark = len(self.buf)
+            self.name(owner)
+            self.buf += struct.pack("!HHIH", self.server.TYPES[rr_type], 1, int(ttl), 0)
+            start = len(self.buf)
+            rdata()
+            self.buf[start-2:start] = struct.pack("!H", len(self.buf)-start)
+            if len(self.buf) <= 65535:
+                break
+            # did not fit, undo it and put it at the start of the next message
+            del self.buf[mark:]
+            self.names = { k: v for k, v in self.names.items() if v < mark }
+            if attempt == 2 or self.count == 0:
+                raise Exception("record too large")
+            out.append(self.finish())
+        self.count += 1
+        if len(self.buf) >= self.server.MESSAGE_SIZE:
+            out.append(self.finish())
+        return(out)
+
+    def name(self, fqdn, compress=True):
+        fqdn = fqdn.rstrip('.')
+        while len(fqdn) > 0:
+            if compress:
+                off = self.names.get(fqdn)
+                if off != None:
+                    self.buf += struct.pack("!H", 0xc000 | off)
+                    return
+                if len(self.buf) < 0x4000:
+                    self.names[fqdn] = len(self.buf)
+            (label, sep, fqdn) = fqdn.partition('.')
+            label = label.encode('ascii')
+            if len(label) == 0 or len(label) > 63:
+                raise Exception("not valid label in name")
+            self.buf.append(len(label))
+            self.buf += label
+        self.buf.append(0)
+
+    def rdata(self, rr_type, value, o):
+        buf = self.buf
+        if rr_type == "A":
+            buf += socket.inet_pton(socket.AF_INET, value)
+        elif rr_type == "AAAA":
+            buf += socket.inet_pton(socket.AF_INET6, value)
+        elif rr_type in ["NS", "CNAME", "PTR"]:
+            self.name(_absolute(value))
+        elif rr_type == "MX":
+            buf += struct.pack("!H", int(o['priority']))
+            self.name(_absolute(value))
+        elif rr_type == "SRV":
+            buf += struct.pack("!HHH", int(o['priority']), int(o['weight']), int(o['port']))
+            self.name(_absolute(value), compress=False)
+        elif rr_type == "DNAME":
+            self.name(_absolute(value), compress=False)
+        elif rr_type == "TXT":
+            for s in _strings(value):
+                buf.append(len(s))
+                buf += s
+        elif rr_type == "CAA":
+            tag = o['tag'].encode('ascii')
+            buf += struct.pack("!BB", int(o['flag']), len(tag)) + tag + _unescape(_unquote(value))
+        elif rr_type == "SSHFP":
+            buf += struct.pack("!BB", int(o['algo']), int(o['type'])) + _hex(value)
+        elif rr_type == "TLSA":
+            buf += struct.pack("!BBB", int(o['usage']), int(o['selector']), int(o['type'])) + _hex(value)
+        elif rr_type == "DS":
+            buf += struct.pack("!HBB", int(o['tag']), int(o['algo']), int(o['digest'])) + _hex(value)
+        elif rr_type == "AFSDB":
+            buf += struct.pack("!H", int(o['subtype']))
+            self.name(_absolute(value), compress=False)
+        elif rr_type == "RP":
+            self.name(_absolute(o['mbox']), compress=False)
+            self.name(_absolute(value), compress=False)
+        elif rr_type == "NAPTR":
+            buf += struct.pack("!HH", int(o['order']), int(o.get('perf', o.get('pref'))))
+            for s in [o.get('flag', o.get('flags')), o['service'], o['regx']]:
+                s = _unescape(_unquote(str(s)))
+                buf.append(len(s))
+                buf += s
+            self.name(_absolute(value), compress=False)
+        elif rr_type == "CERT":
+            ctype = str(o['type']).upper()
+            ctype = self.CERT_TYPES[ctype] if ctype in self.CERT_TYPES else int(ctype)
+            buf += struct.pack("!HHB", ctype, int(o['tag']), int(o['algo'])) + _base64(value)
+        elif rr_type == "DCHID":
+            buf += _base64(value)
+        elif rr_type == "HIP":
+            hit = _hex(o['hit'])
+            key = _base64(o['key'])
+            buf += struct.pack("!BBH", len(hit), int(o['algo']), len(key)) + hit + key
+            for rvs in value.split():
+                self.name(_absolute(rvs), compress=False)
+        elif rr_type == "LOC":
+            buf += _loc(o)
+
+def _absolute(name):
+    # stored names are absolute with or without the dot, apex records are @.domain
+    name = name.rstrip('.')
+    return(name[2:] if name.startswith("@.") else name)
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return(value[1:-1])
+    return(value)
+
+def _unescape(value):
+    # zone file escapes, \X and \DDD
+    if value.find('\\') == -1:
+        return(value.encode('utf-8'))
+    out = bytearray()
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == '\\' and len(value[i+1:i+4]) == 3 and value[i+1:i+4].isdigit():
+            out.append(int(value[i+1:i+4]))
+            i += 4
+        elif c == '\\' and i+1 < len(value):
+            out += value[i+1].encode('utf-8')
+            i += 2
+        else:
+            out += c.encode('utf-8')
+            i += 1
+    return(bytes(out))
+
+def _strings(value):
+    # TXT values hold several strings as a" "b, the way the exporters print them back
+    out = []
+    for part in _unquote(value).split('" "'):
+        raw = _unescape(part)
+        for i in range(0, max(len(raw), 1), 255):
+            out.append(raw[i:i+255])
+    return(out)
+
+def _hex(value):
+    return(bytes.fromhex("".join(value.split())))
+
+def _base64(value):
+    return(base64.b64decode("".join(value.split())))
+
+def _loc(o):
+    # RFC 1876
+    def coord(text, pos):
+        parts = text.split()
+        nums = parts[:-1] + ["0", "0"]
+        msec = int(round(((int(nums[0])*60 + int(nums[1]))*60 + float(nums[2]))*1000))
+        return(0x80000000 + msec if parts[-1].upper() == pos else 0x80000000 - msec)
+    def cm(text):
+        return(int(round(float(str(text).rstrip('mM'))*100)))
+    def precision(text):
+        value = cm(text)
+        exp = 0
+        while value >= 10 and exp < 9:
+            value = value // 10
+            exp += 1
+        return((value << 4) | exp)
+    return(struct.pack("!BBBBIII", 0, precision(o['size']), precision(o['hor']), precision(o['vert']),
+                       coord(o['lat'], "N"), coord(o['long'], "E"), cm(o['alt']) + 10000000))
+
+def _read_name(data, pos):
+    # returns (name, position after it), following compression pointers
+    labels = []
+    end = None
+    hops = 0
+    while True:
+        length = data[pos]
+        if length & 0xc0 == 0xc0:
+            if end == None:
+                end = pos+2
+            pos = ((length & 0x3f) << 8) | data[pos+1]
+            hops += 1
+            if hops > 64:
+                raise Exception("compression loop")
+            continue
+        pos += 1
+        if length == 0:
+            break
+        labels.append(data[pos:pos+length].decode('ascii'))
+        pos += length
+    return((".".join(labels), end if end != None else pos))
+
+class _udp_protocol(asyncio.DatagramProtocol):
+    # SOA queries, and IXFR which gets the SOA so the secondary comes back over TCP
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        # the event loop only keeps weak references to tasks
+        self.tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        task = asyncio.ensure_future(self._answer(data, addr))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _answer(self, data, addr):
+        loop = asyncio.get_running_loop()
+        try:
+            msgs = await loop.run_in_executor(self.server.executor, lambda: list(self.server.messages(data, addr, udp=True)))
+        except Exception:
+            msgs = [ self.server._error(data, self.server.SERVFAIL) ]
+        if len(msgs) > 0 and msgs[0] != None and not self.transport.is_closing():
+            self.transport.sendto(msgs[0], addr)
+
+# do not allow ourselved to be alled directly
+if __name__ == "__main__":
+    raise Exception("cannot call directly")
@@ -0,0 +1,80 @@
+import pytest
+from libipam import ipam
+
+SOA = { 'email': "hostmaster.ex.com", 'mname': "ns1.ex.com", 'refresh': 3600, 'retry': 600,
+        'expire': 86400, 'ncache': 300 }
+
+@pytest.fixture
+def db(tmp_path):
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"), cache=128)
+    db.add_domain("ex.com", options=SOA)
+    return(db)
+
+def test_rollback_drops_cached_reads(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+            assert len(db.find_record("a.ex.com")) == 1
+            raise RuntimeError("abort")
+    assert db.db.find_record("a.ex.com") == []
+    assert db.find_record("a.ex.com") == []
+
+def test_rollback_of_direct_driver_write(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.db.add_record("b.ex.com", "A", "10.0.0.2", options={})
+            assert len(db.find_record("b.ex.com")) == 1
+            raise RuntimeError("abort")
+    assert db.find_record("b.ex.com") == []
+
+def test_reads_in_transaction_are_not_cached(db):
+    with db.transaction():
+        db.find_domain("ex.com")
+        assert db.cache_stats()['size'] == 0
+    db.find_domain("ex.com")
+    db.find_domain("ex.com")
+    assert db.cache_stats()['hits'] == 1
+
+def test_commit_is_visible(db):
+    assert db.find_record("c.ex.com") == []
+    with db.transaction():
+        db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+    assert len(db.find_record("c.ex.com")) == 1
+
+def test_pooled_threads_share_the_version(tmp_path):
+    import threading
+    import concurrent.futures
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"), pooled=True, cache=128)
+    db.add_domain("ex.com", options=SOA)
+    barrier = threading.Barrier(4)
+    def work(i):
+        # one call per thread, each has its own connection and the first one writes on it
+        db.db.data_version()
+        barrier.wait()
+        if i == 0:
+            db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+        barrier.wait()
+        return(db.db.data_version())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        versions = set(pool.map(work, range(4)))
+    assert len(versions) == 1
+
+def test_async_close_does_not_block_the_loop(tmp_path):
+    import time
+    import asyncio
+    from libipam.async_ipam import async_ipam
+    async def run():
+        db = async_ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"), workers=2)
+        ticks = []
+        async def tick():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.sleep(0)
+        # a queued call close() has to wait for
+        db.executor.submit(time.sleep, 0.3)
+        await db.close()
+        ticker.cancel()
+        return(len(ticks))
+    assert asyncio.run(run()) > 5
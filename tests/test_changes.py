@@ -0,0 +1,72 @@
+import pytest
+from libipam.db_sqlite3 import db_sqlite3
+
+SOA = { 'email': "hostmaster.ex.com", 'mname': "ns1.ex.com", 'refresh': 3600, 'retry': 600,
+        'expire': 86400, 'ncache': 300 }
+
+@pytest.fixture
+def db(tmp_path):
+    db = db_sqlite3(str(tmp_path/"ipam.db"))
+    db.add_domain("Ex.COM", options=SOA)
+    return(db)
+
+def test_insert_update_delete(db):
+    seq = db.last_change()
+    db.add_record("WWW.ex.com", "a", "10.0.0.1", options={ 'ttl': 60 })
+    rid = db.find_record("www.ex.com")[0]['id']
+    db.update_record("www.ex.com", "A", "10.0.0.2", options={ 'id': rid, 'ttl': 60 })
+    db.delete_record("www.ex.com", options={ 'id': rid })
+    changes = db.changes_since(seq)
+    assert [ (c['table'], c['op'], c['id']) for c in changes ] == [("records", "INSERT", rid), ("records", "UPDATE", rid), ("records", "DELETE", rid)]
+    assert [ c['seq'] for c in changes ] == [seq+1, seq+2, seq+3]
+    (ins, upd, dele) = changes
+    # the rows are logged normalized, the way find_record returns them
+    assert ins['old'] == None
+    assert (ins['new']['fqdn'], ins['new']['rr_type'], ins['new']['value'], ins['new']['options']) == ("www.ex.com", "A", "10.0.0.1", { 'ttl': 60 })
+    assert (upd['old']['value'], upd['new']['value']) == ("10.0.0.1", "10.0.0.2")
+    assert (dele['old']['value'], dele['new']) == ("10.0.0.2", None)
+    assert db.last_change() == seq+3
+
+def test_domains_and_cascades(db):
+    seq = db.last_change()
+    db.add_domain("sub.ex.com", options=SOA)
+    db.add_record("a.sub.ex.com", "A", "10.0.0.1", options={})
+    db.update_domain("sub.ex.com", options=dict(SOA, email="other.ex.com"))
+    db.delete_domain("sub.ex.com", force=True)
+    ops = [ (c['table'], c['op']) for c in db.changes_since(seq) ]
+    assert ops[:3] == [("domains", "INSERT"), ("records", "INSERT"), ("domains", "UPDATE")]
+    # the records the delete cascades to are journaled too
+    assert sorted(ops[3:]) == [("domains", "DELETE"), ("records", "DELETE")]
+    upd = db.changes_since(seq+2, limit=1)[0]
+    assert (upd['old']['options']['email'], upd['new']['options']['email']) == ("hostmaster.ex.com", "other.ex.com")
+
+def test_rolled_back_changes_are_not_journaled(db):
+    seq = db.last_change()
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+            raise RuntimeError("abort")
+    assert db.changes_since(seq) == []
+
+def test_paging_and_table_filter(db):
+    seq = db.last_change()
+    for i in range(5):
+        db.add_record("h{}.ex.com".format(i), "A", "10.0.0.{}".format(i+1), options={})
+    db.add_subnet("10.0.0.0/24")
+    first = db.changes_since(seq, limit=2)
+    assert [ c['seq'] for c in first ] == [seq+1, seq+2]
+    assert [ c['seq'] for c in db.changes_since(first[-1]['seq'], limit=10) ] == list(range(seq+3, seq+7))
+    assert [ c['table'] for c in db.changes_since(seq, table="networks") ] == ["networks"]
+
+def test_prune(db):
+    for i in range(3):
+        db.add_record("h{}.ex.com".format(i), "A", "10.0.0.{}".format(i+1), options={})
+    last = db.last_change()
+    db.prune_changes(last-1)
+    assert [ c['seq'] for c in db.changes_since(0) ] == [last]
+    # pruning everything keeps the position, new entries carry on from it
+    db.prune_changes(last)
+    assert db.changes_since(0) == []
+    assert db.last_change() == last
+    db.add_record("h9.ex.com", "A", "10.0.0.9", options={})
+    assert [ c['seq'] for c in db.changes_since(0) ] == [last+1]
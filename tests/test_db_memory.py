@@ -0,0 +1,50 @@
+import pytest
+from libipam.db_memory import db_memory
+
+@pytest.fixture
+def db():
+    db = db_memory()
+    db.add_domain("ex.com", options={ 'email': "hostmaster.ex.com" })
+    db.add_domain("sub.ex.com", options={})
+    db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+    db.add_record("www.ex.com", "CNAME", "a.ex.com", options={})
+    db.add_record("b.sub.ex.com", "A", "10.0.0.2", options={})
+    db.add_subnet("10.0.0.0/24", options={ 'site': "one" })
+    return(db)
+
+def dump(db):
+    return({ 'domains': db.find_domain("*"), 'records': db.find_record(None),
+             'subnets': db.find_subnet(None), 'network': db.find_network("10.0.0.0/24") })
+
+def test_rollback_restores_everything(db):
+    before = dump(db)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+            rid = db.find_record("a.ex.com")[0]['id']
+            db.update_record("a.ex.com", "A", "10.0.0.9", options={ 'id': rid, 'ttl': 60 })
+            # cascades to the CNAME
+            db.delete_record("a.ex.com", options={ 'id': rid }, force=True)
+            db.delete_domain("sub.ex.com", force=True)
+            db.update_domain("ex.com", options={ 'email': "other.ex.com" })
+            db.update_subnet("10.0.0.0/24", options={ 'site': "two" })
+            db.add_subnet("10.1.0.0/24")
+            raise RuntimeError("abort")
+    assert dump(db) == before
+    # ids are handed out again from where they were
+    db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+    assert db.find_record("c.ex.com")[0]['id'] == max(r['id'] for r in before['records'])+1
+
+def test_nested_rollback_keeps_outer_changes(db):
+    with db.transaction():
+        db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.add_record("d.ex.com", "A", "10.0.0.4", options={})
+                raise RuntimeError("abort")
+    assert len(db.find_record("c.ex.com")) == 1
+    assert db.find_record("d.ex.com") == []
+
+def test_allocate_skips_reserved_addresses(db):
+    assert db.allocate_address("10.0.0.0/24", "c.ex.com") == ["10.0.0.3"]
+    assert db.allocate_address("2001:db8::/64", "d.ex.com") == ["2001:db8::1"]
@@ -0,0 +1,90 @@
+import pytest
+from libipam.db_sqlite3 import db_sqlite3
+
+SOA = { 'email': "hostmaster.ex.com", 'mname': "ns1.ex.com", 'refresh': 3600, 'retry': 600,
+        'expire': 86400, 'ncache': 300 }
+
+@pytest.fixture
+def dbfile(tmp_path):
+    db = db_sqlite3(str(tmp_path/"ipam.db"))
+    db.add_domain("ex.com", options=SOA)
+    db.close()
+    return(str(tmp_path/"ipam.db"))
+
+def test_allocate_skips_reserved_addresses(dbfile):
+    db = db_sqlite3(dbfile)
+    assert db.allocate_address("10.0.0.0/30", "a.ex.com", count=2) == ["10.0.0.1", "10.0.0.2"]
+    assert db.allocate_address("2001:db8::/64", "b.ex.com", count=2) == ["2001:db8::1", "2001:db8::2"]
+    assert db.allocate_address("2001:db8:1::/127", "c.ex.com", count=2) == ["2001:db8:1::", "2001:db8:1::1"]
+
+def test_allocate_takes_the_write_lock(dbfile):
+    a = db_sqlite3(dbfile, busy_timeout=100)
+    b = db_sqlite3(dbfile, busy_timeout=100)
+    assert a.allocate_address("10.0.0.0/24", "a.ex.com") == ["10.0.0.1"]
+    # nothing is held once it returns
+    assert b.allocate_address("10.0.0.0/24", "b.ex.com") == ["10.0.0.2"]
+
+def test_nested_allocate_takes_the_write_lock(dbfile):
+    a = db_sqlite3(dbfile, busy_timeout=100)
+    b = db_sqlite3(dbfile, busy_timeout=100)
+    with a.transaction():
+        assert a.allocate_address("10.0.0.0/24", "a.ex.com") == ["10.0.0.1"]
+        # the outer transaction keeps the lock until it ends
+        with pytest.raises(Exception, match="locked"):
+            b.allocate_address("10.0.0.0/24", "b.ex.com")
+    assert b.allocate_address("10.0.0.0/24", "b.ex.com") == ["10.0.0.2"]
+
+def test_nested_immediate_locks_before_writing(dbfile):
+    # with WAL a reader does not hold writers off, only the write lock does
+    a = db_sqlite3(dbfile, wal=True, busy_timeout=100)
+    b = db_sqlite3(dbfile, wal=True, busy_timeout=100)
+    with a.transaction():
+        a.find_record("*.ex.com")
+        with a.transaction(immediate=True):
+            # held before the free address scan, not only from the first insert
+            with pytest.raises(Exception, match="locked"):
+                b.add_record("b.ex.com", "A", "10.0.0.9", options={})
+
+def test_nested_allocate_after_a_stale_read(dbfile):
+    # the outer transaction read before the other connection wrote, it cannot take the lock
+    # and has to be retried instead of handing out the same address twice
+    a = db_sqlite3(dbfile, wal=True, busy_timeout=100)
+    b = db_sqlite3(dbfile, wal=True, busy_timeout=100)
+    with pytest.raises(Exception):
+        with a.transaction():
+            a.find_record("*.ex.com")
+            assert b.allocate_address("10.0.0.0/24", "b.ex.com") == ["10.0.0.1"]
+            a.allocate_address("10.0.0.0/24", "a.ex.com")
+    assert a.allocate_address("10.0.0.0/24", "a.ex.com") == ["10.0.0.2"]
+
+def test_nested_rollback_keeps_the_outer_block(dbfile):
+    db = db_sqlite3(dbfile)
+    with db.transaction():
+        db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                db.add_record("b.ex.com", "A", "10.0.0.2", options={})
+                raise RuntimeError("abort")
+        assert db.find_record("b.ex.com") == []
+        with db.transaction():
+            db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+    assert [ r['fqdn'] for r in db.find_record("*.ex.com") ] == ["a.ex.com", "c.ex.com"]
+
+def test_commit_only_when_the_outer_block_ends(dbfile):
+    db = db_sqlite3(dbfile)
+    other = db_sqlite3(dbfile)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            with db.transaction():
+                db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+            # the inner block is done but nothing is visible outside yet
+            assert other.find_record("a.ex.com") == []
+            raise RuntimeError("abort")
+    assert db.find_record("a.ex.com") == []
+    with db.transaction():
+        with db.transaction():
+            db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+    assert len(other.find_record("a.ex.com")) == 1
+    # a plain call outside any block commits on its own
+    db.add_record("b.ex.com", "A", "10.0.0.2", options={})
+    assert len(other.find_record("b.ex.com")) == 1
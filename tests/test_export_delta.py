@@ -0,0 +1,34 @@
+import pytest
+from libipam import ipam
+
+SOA = { 'email': "hostmaster.ex.com", 'mname': "ns1.ex.com", 'refresh': 3600, 'retry': 600,
+        'expire': 86400, 'ncache': 300, 'ttl': 600 }
+
+@pytest.fixture
+def db(tmp_path):
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"))
+    db.add_domain("ex.com", options=SOA)
+    return(db)
+
+def test_deleted_domain(db):
+    db.add_domain("gone.org", options=SOA)
+    db.add_record("a.gone.org", "A", "10.0.0.1", options={})
+    db.add_record("b.ex.com", "A", "10.0.0.2", options={})
+    since = db.db.last_change() - 3
+    db.delete_domain("gone.org", force=True)
+    text = db.export(type="unbound-control", since=since)
+    assert "local_data_remove a.gone.org." in text.split("\n")
+    assert "local_data b.ex.com. 600 IN A 10.0.0.2" in text.split("\n")
+    assert db.edriver.removed == ["gone.org"]
+    assert "gone.org" in db.edriver.reload
+    text = db.export(type="nsupdate", since=since)
+    assert "gone.org" not in text
+    assert text.split("\n") == ["zone ex.com.", "update add b.ex.com. 600 IN A 10.0.0.2", "send"]
+
+def test_ttl_comes_from_the_domain(db):
+    since = db.db.last_change()
+    db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+    db.add_record("d.ex.com", "A", "10.0.0.4", options={ 'ttl': 60 })
+    text = db.export(type="nsupdate", since=since)
+    assert "update add c.ex.com. 600 IN A 10.0.0.3" in text.split("\n")
+    assert "update add d.ex.com. 60 IN A 10.0.0.4" in text.split("\n")
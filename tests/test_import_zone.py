@@ -0,0 +1,84 @@
+import pytest
+from libipam import ipam
+
+ZONE = """$ORIGIN ex.com.
+$TTL 1h
+@   IN SOA ns1 hostmaster (
+        2024010101 ; serial
+        3600       ; refresh
+        600        ; retry
+        86400      ; expire
+        300 )      ; negative cache
+    IN NS ns1
+ns1 IN A 10.0.0.1
+www 300 IN A 10.0.0.2
+    IN TXT "a ( quoted ; string"
+mail IN MX 10 www
+$ORIGIN sub.ex.com.
+@   IN NS ns1.ex.com.
+host IN A 10.0.1.1
+$INCLUDE hosts.inc ex.com.
+after IN A 10.0.1.3
+"""
+
+HOSTS = """ia  IN A 10.0.2.1
+ib  IN CNAME ia
+"""
+
+@pytest.fixture
+def db(tmp_path):
+    (tmp_path/"ex.com.zone").write_text(ZONE)
+    (tmp_path/"hosts.inc").write_text(HOSTS)
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"))
+    res = db.import_zone(file=str(tmp_path/"ex.com.zone"))
+    assert res['errors'] == []
+    assert res['domain'] == "ex.com"
+    return(db)
+
+def values(db, fqdn, rr_type):
+    return(sorted(r['value'] for r in db.find_record(fqdn, include_subs=True) if r['rr_type'] == rr_type))
+
+def test_multi_line_soa(db):
+    d = db.find_domain("ex.com")[0]
+    assert d['options']['mname'] == "ns1.ex.com"
+    assert d['options']['email'] == "hostmaster.ex.com"
+    assert [ d['options'][k] for k in ['refresh', 'retry', 'expire', 'ncache'] ] == [3600, 600, 86400, 300]
+    assert d['options']['ttl'] == 3600
+
+def test_owner_and_ttl_carry_over(db):
+    assert values(db, "www.ex.com", "A") == ["10.0.0.2"]
+    assert values(db, "www.ex.com", "TXT") == ["a ( quoted ; string"]
+    assert db.find_record("www.ex.com")[0]['options']['ttl'] == 300
+    assert db.find_record("ns1.ex.com")[0]['options']['ttl'] == 3600
+
+def test_origin(db):
+    # the NS line below the zone makes sub.ex.com a delegation with records of its own
+    assert values(db, "host.sub.ex.com", "A") == ["10.0.1.1"]
+    assert values(db, "@.sub.ex.com", "NS") == ["ns1.ex.com"]
+
+def test_include_with_origin(db):
+    # the included file starts at the origin given on the $INCLUDE line, the includer's comes back after
+    assert values(db, "ia.ex.com", "A") == ["10.0.2.1"]
+    assert values(db, "ib.ex.com", "CNAME") == ["ia.ex.com"]
+    assert values(db, "after.sub.ex.com", "A") == ["10.0.1.3"]
+
+def test_delegation_gets_the_zone_soa(db):
+    sub = db.find_domain("sub.ex.com")[0]
+    assert sub['options']['mname'] == "ns1.ex.com"
+    assert sub['options']['refresh'] == 3600
+    text = db.export(type="bind", domain="sub.ex.com")
+    assert "IN SOA ns1.ex.com. hostmaster.ex.com." in text
+
+def test_soa_matches_add_domain(db, tmp_path):
+    # the same SOA through the API and through a zone file, the timers may use units
+    db.add_domain("api.org", options={ 'mname': "ns1.ex.com", 'email': "hostmaster.ex.com", 'serial': 1,
+                                       'refresh': 3600, 'retry': 600, 'expire': 86400, 'ncache': 300, 'ttl': 3600 })
+    (tmp_path/"file.org.zone").write_text("$ORIGIN file.org.\n$TTL 1h\n@ IN SOA ns1.ex.com. hostmaster.ex.com. 1 1h 10m 1d 300\n")
+    assert db.import_zone(file=str(tmp_path/"file.org.zone"))['errors'] == []
+    assert db.find_domain("file.org")[0]['options'] == db.find_domain("api.org")[0]['options']
+
+def test_errors_name_the_line(tmp_path):
+    (tmp_path/"bad.zone").write_text("$ORIGIN ex.com.\n@ IN SOA ns1 hm 1 2 3 4 5\nx IN MX 10\nother.org. IN A 10.0.0.1\n")
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"))
+    res = db.import_zone(file=str(tmp_path/"bad.zone"))
+    assert [ (e['line'].rsplit(":", 1)[1], e['fqdn']) for e in res['errors'] ] == [("3", "x.ex.com"), ("4", "other.org")]
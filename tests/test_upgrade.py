@@ -0,0 +1,111 @@
+import sqlite3
+import pytest
+from libipam.db_sqlite3 import db_sqlite3
+
+# sqlite3.schema as ipam.version 1 shipped it
+BASELINE = """
+CREATE TABLE defaults (
+	name TEXT UNIQUE,
+	value TEXT
+);
+INSERT INTO defaults (name,value) VALUES ('ipam.version','1');
+CREATE TABLE domains (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	name TEXT UNIQUE,
+	serial INTEGER DEFAULT 0,
+	options TEXT,
+	created_at TEXT DEFAULT current_timestamp,
+	updated_at TEXT DEFAULT current_timestamp
+);
+CREATE TABLE records (
+	id  INTEGER PRIMARY KEY AUTOINCREMENT,
+	name TEXT,
+	rr_type TEXT,
+	options TEXT,
+	value TEXT,
+	intvalue BLOB,
+	created_at TEXT DEFAULT current_timestamp,
+	updated_at TEXT DEFAULT current_timestamp,
+	domain_id INTEGER NOT NULL REFERENCES domains(id) ON DELETE CASCADE,
+	record_id INTEGER REFERENCES records(id) ON DELETE CASCADE
+);
+CREATE INDEX records_rec_link ON records (record_id);
+CREATE INDEX records_dom_link ON records (domain_id);
+CREATE VIEW fqdn_records(id, fqdn, domain_id, rr_type, value, options, record_id, intvalue) AS
+	SELECT records.id, records.name || '.' || domains.name, records.domain_id,
+		records.rr_type, records.value, records.options, records.record_id, records.intvalue
+	FROM records JOIN domains ON records.domain_id = domains.id;
+CREATE TRIGGER dom_ins AFTER INSERT ON domains BEGIN
+	UPDATE domains SET name = LOWER(NEW.name) WHERE id = NEW.id;
+END;
+CREATE TRIGGER dom_upd AFTER UPDATE ON domains BEGIN
+	UPDATE domains SET
+		name = LOWER(NEW.name),
+		serial = IIF(OLD.serial != NEW.serial, NEW.serial, OLD.serial+1),
+		updated_at = DATETIME('NOW')
+	WHERE id = OLD.id;
+END;
+CREATE TRIGGER rec_ins AFTER INSERT ON records BEGIN
+	UPDATE records SET name = LOWER(NEW.name), rr_type = UPPER(NEW.rr_type) WHERE id=NEW.id;
+END;
+CREATE TRIGGER rec_upd AFTER UPDATE ON records BEGIN
+	UPDATE records SET
+		name = LOWER(NEW.name),
+		rr_type = UPPER(NEW.rr_type),
+		updated_at = DATETIME('NOW')
+	WHERE id=OLD.id;
+END;
+"""
+
+@pytest.fixture
+def old(tmp_path):
+    # rows the way the version 1 code wrote them, options as key:value pairs and 4 or 16 byte
+    # packed addresses
+    path = str(tmp_path/"old.db")
+    con = sqlite3.connect(path)
+    con.executescript(BASELINE)
+    con.execute("INSERT INTO domains (name, options) VALUES ('Ex.COM', 'email:hostmaster.ex.com refresh:3600 ttl:600');")
+    con.execute("INSERT INTO records (name, rr_type, value, intvalue, options, domain_id) VALUES ('WWW', 'a', '10.0.0.5', ?, 'ttl:60', 1);",
+                (bytes([10, 0, 0, 5]),))
+    con.execute("INSERT INTO records (name, rr_type, value, intvalue, options, domain_id) VALUES ('v6', 'AAAA', '2001:db8::5', ?, '', 1);",
+                (bytes.fromhex("20010db8000000000000000000000005"),))
+    con.execute("INSERT INTO records (name, rr_type, value, options, domain_id, record_id) VALUES ('alias', 'CNAME', 'www.ex.com', '', 1, 1);")
+    con.commit()
+    con.close()
+    return(path)
+
+def test_upgrade_to_current(old):
+    db = db_sqlite3(old)
+    assert db._query("SELECT value FROM defaults WHERE name = 'ipam.version';", {})[0]['value'] == str(db_sqlite3.SCHEMA_VERSION)
+    d = db.find_domain("ex.com")[0]
+    assert d['options'] == { 'email': "hostmaster.ex.com", 'refresh': "3600", 'ttl': "600" }
+    www = db.find_record("www.ex.com")[0]
+    assert (www['rr_type'], www['value'], www['options']) == ("A", "10.0.0.5", { 'ttl': "60" })
+    # the fqdn column, the address keys and the JSON options are all usable after the upgrade
+    assert [ r['fqdn'] for r in db.find_network("10.0.0.0/24") ] == ["www.ex.com"]
+    assert [ r['fqdn'] for r in db.find_network("2001:db8::/64") ] == ["v6.ex.com"]
+    assert [ r['fqdn'] for r in db.find_record("*.ex.com", options_filter={ 'ttl': "60" }) ] == ["www.ex.com"]
+    assert db.find_record("alias.ex.com")[0]['value'] == "www.ex.com"
+
+def test_upgraded_schema_matches_a_new_one(old, tmp_path):
+    db_sqlite3(old).close()
+    new = db_sqlite3(str(tmp_path/"new.db"))
+    new.close()
+    def schema(path):
+        con = sqlite3.connect(path)
+        objs = set(con.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%';").fetchall())
+        cols = { name: set(r[1] for r in con.execute("PRAGMA table_info({});".format(name)))
+                 for (kind, name) in objs if kind in ["table", "view"] }
+        con.close()
+        return(objs, cols)
+    assert schema(old) == schema(str(tmp_path/"new.db"))
+
+def test_upgraded_database_keeps_working(old):
+    db = db_sqlite3(old)
+    seq = db.last_change()
+    db.add_record("mail.ex.com", "A", "10.0.0.6", options={})
+    db.update_domain("ex.com", options={ 'email': "other.ex.com" })
+    assert [ (c['table'], c['op']) for c in db.changes_since(seq) ] == [("records", "INSERT"), ("domains", "UPDATE")]
+    assert db.allocate_address("10.0.0.0/29", "h.ex.com", count=2) == ["10.0.0.1", "10.0.0.2"]
+    db.delete_domain("ex.com", force=True)
+    assert db.find_record(None) == []
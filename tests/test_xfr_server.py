@@ -0,0 +1,138 @@
+import asyncio
+import struct
+import pytest
+from libipam import ipam
+from libipam.xfr_server import xfr_server, _read_name
+
+SOA = { 'email': "hostmaster.ex.com", 'mname': "ns1.ex.com", 'refresh': 3600, 'retry': 600,
+        'expire': 86400, 'ncache': 300 }
+
+@pytest.fixture
+def db(tmp_path):
+    db = ipam(database='sqlite3', dbfile=str(tmp_path/"ipam.db"))
+    db.add_domain("ex.com", options=SOA)
+    db.add_domain("other.org", options=SOA)
+    db.add_record("a.ex.com", "A", "10.0.0.1", options={})
+    db.add_record("b.ex.com", "A", "10.0.0.2", options={})
+    return(db)
+
+def query(name, qtype, serial=None):
+    # a dig-style query, IXFR carries the secondary's SOA in the authority section
+    msg = struct.pack("!HHHHHH", 1234, 0, 1, 0, 0 if serial == None else 1, 0)
+    qname = b"".join(bytes([len(l)]) + l.encode('ascii') for l in name.split('.')) + b"\x00"
+    msg += qname + struct.pack("!HH", qtype, 1)
+    if serial != None:
+        rdata = b"\x00\x00" + struct.pack("!IIIII", serial, 0, 0, 0, 0)
+        msg += qname + struct.pack("!HHIH", 6, 1, 0, len(rdata)) + rdata
+    return(struct.pack("!H", len(msg)) + msg)
+
+def answers(msg):
+    # returns [(owner, type, serial or rdata)] of the answer section
+    (qid, flags, qdcount, ancount, nscount, arcount) = struct.unpack("!HHHHHH", msg[:12])
+    assert qid == 1234 and flags & 0x8000 and flags & 0xf == 0
+    pos = 12
+    for i in range(qdcount):
+        pos = _read_name(msg, pos)[1] + 4
+    out = []
+    for i in range(ancount):
+        (owner, pos) = _read_name(msg, pos)
+        (rtype, rclass, ttl, rdlen) = struct.unpack("!HHIH", msg[pos:pos+10])
+        pos += 10
+        if rtype == 6:
+            p = _read_name(msg, _read_name(msg, pos)[1])[1]
+            out.append((owner, rtype, struct.unpack("!I", msg[p:p+4])[0]))
+        else:
+            out.append((owner, rtype, msg[pos:pos+rdlen]))
+        pos += rdlen
+    return(out)
+
+def done(query, rrs):
+    # a SOA query, or an up to date IXFR, is answered with one SOA.  A transfer ends with the
+    # current SOA, which an incremental one also has between the deleted and added records
+    pos = _read_name(query[2:], 12)[1]
+    qtype = struct.unpack("!H", query[2+pos:4+pos])[0]
+    if len(rrs) == 0 or qtype == 6:
+        return(len(rrs) > 0)
+    current = [ r for r in rrs if r[1] == 6 and r[2] == rrs[0][2] ]
+    if len(rrs) == 1:
+        return(qtype == 251)
+    incremental = rrs[1][1] == 6 and rrs[1][2] != rrs[0][2]
+    return(len(current) == (3 if incremental else 2))
+
+def transfer(dbfile, *queries, timeout=30):
+    # starts the server on a free loopback port and returns the answers to each query on one connection
+    async def run():
+        async with xfr_server(dbfile, port=0, timeout=timeout) as server:
+            (reader, writer) = await asyncio.open_connection("127.0.0.1", server.port)
+            out = []
+            for q in queries:
+                writer.write(q)
+                rrs = []
+                while not done(q, rrs):
+                    (length,) = struct.unpack("!H", await reader.readexactly(2))
+                    rrs += answers(await reader.readexactly(length))
+                out.append(rrs)
+            writer.close()
+            return(out)
+    return(asyncio.run(run()))
+
+def test_axfr_framing(db, tmp_path):
+    (rrs,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 252))
+    assert rrs[0][:2] == ("ex.com", 6) and rrs[-1] == rrs[0]
+    assert sorted(r[2] for r in rrs[1:-1]) == [bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2])]
+
+def test_ixfr_framing(db, tmp_path):
+    (soa,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 6))
+    old = soa[0][2]
+    rid = db.find_record("a.ex.com")[0]['id']
+    db.delete_record("a.ex.com", options={ 'id': rid })
+    db.add_record("c.ex.com", "A", "10.0.0.3", options={})
+    (rrs,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 251, serial=old))
+    new = rrs[0][2]
+    assert new > old
+    assert [ (r[0], r[2]) for r in rrs ] == [("ex.com", new), ("ex.com", old), ("a.ex.com", bytes([10, 0, 0, 1])),
+                                             ("ex.com", new), ("c.ex.com", bytes([10, 0, 0, 3])), ("ex.com", new)]
+    # an up to date secondary gets the SOA alone
+    (rrs,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 251, serial=new))
+    assert [ r[2] for r in rrs ] == [new]
+
+def test_serial_is_per_zone(db, tmp_path):
+    (before,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 6))
+    db.add_record("x.other.org", "A", "10.0.0.9", options={})
+    (ex, other) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 6), query("other.org", 6))
+    assert ex == before
+    assert other[0][2] > before[0][2]
+    # a subdomain is part of the transfer, its changes move the parent's serial
+    db.add_domain("sub.ex.com", options=SOA)
+    (ex,) = transfer(str(tmp_path/"ipam.db"), query("ex.com", 6))
+    assert ex[0][2] > other[0][2]
+
+def test_partial_query_times_out(db, tmp_path):
+    async def run():
+        async with xfr_server(str(tmp_path/"ipam.db"), port=0, timeout=0.2) as server:
+            (reader, writer) = await asyncio.open_connection("127.0.0.1", server.port)
+            # only the length prefix, the server closes the connection instead of waiting
+            writer.write(struct.pack("!H", 40))
+            data = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+            return(data)
+    assert asyncio.run(run()) == b""
+
+def test_udp_soa(db, tmp_path):
+    async def run():
+        async with xfr_server(str(tmp_path/"ipam.db"), port=0) as server:
+            loop = asyncio.get_running_loop()
+            answer = loop.create_future()
+            class client(asyncio.DatagramProtocol):
+                def datagram_received(self, data, addr):
+                    answer.set_result(data)
+            (transport, proto) = await loop.create_datagram_endpoint(client, remote_addr=("127.0.0.1", server.port))
+            transport.sendto(query("ex.com", 6)[2:])
+            data = await asyncio.wait_for(answer, timeout=5)
+            transport.close()
+            # answered from a task the server keeps until it is done
+            await asyncio.sleep(0)
+            assert server.udp_protocol.tasks == set()
+            return(data)
+    rrs = answers(asyncio.run(run()))
+    assert [ r[:2] for r in rrs ] == [("ex.com", 6)]